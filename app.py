@@ -1,9 +1,16 @@
 import streamlit as st
 import polars as pl
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+import numpy as np
+import pyarrow as pa
+import os
+import sys
+import json
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import metrics_registry
+import color_scales
 
 # Page Config
 st.set_page_config(
@@ -34,20 +41,74 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data(ttl=60)
-def load_data():
+# Uncompressed Arrow IPC written by calculate_metrics.py next to the parquet, so it can be memory-mapped
+METRICS_IPC = "data/market_breadth_metrics.arrow"
+SEGMENTS_IPC = "data/market_breadth_segments.arrow"
+
+def file_version(path):
+    """mtime of a pipeline output (None if missing); part of the cache key instead of a TTL."""
     try:
-        df = pl.read_parquet("data/market_breadth_metrics.parquet")
-        # Convert to pandas for easy Streamlit/Plotly usage
-        return df.to_pandas()
+        return os.stat(path).st_mtime_ns
     except FileNotFoundError:
         return None
 
+def read_mapped(path):
+    """
+    Memory-map an uncompressed Arrow IPC file. Numeric and Date columns stay backed by the mapping
+    (pl.read_ipc would copy them onto the heap), so pages are only read when a slice touches them.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return pl.from_arrow(table, rechunk=False)
+
+# cache_resource hands every rerun the same mapped frame (cache_data would copy it);
+# a new pipeline output changes the version and maps the new file
+@st.cache_resource(max_entries=2)
+def load_data(version):
+    if version is None:
+        return None
+    return read_mapped(METRICS_IPC)
+
+@st.cache_resource(max_entries=16)
+def load_segment(segment, version):
+    if version is None:
+        return None
+    segments = read_mapped(SEGMENTS_IPC)
+    if segment is None:
+        return segments["Segment"].unique().sort()
+    return segments.filter(pl.col("Segment") == segment).drop("Segment")
+
+@st.cache_resource(max_entries=2)
+def load_scales(version):
+    if version is None:
+        return None
+    with open(color_scales.SCALES_FILE) as f:
+        return json.load(f)["segments"]
+
+@st.cache_resource(max_entries=16)
+def load_rolling_scales(segment, version):
+    if version is None:
+        return None
+    return read_mapped(color_scales.ROLLING_SCALES_FILE).filter(pl.col("Segment") == segment).drop("Segment")
+
+# Heatmap colour scale: (source, low stat, high stat); source None scales on the visible rows
+SCALE_MODES = {
+    "Full history (5-95%)": ("global", "q05", "q95"),
+    "Full history (min-max)": ("global", "min", "max"),
+    "Rolling 1Y (5-95%)": ("rolling", "q05", "q95"),
+    "Visible range (min-max)": (None, "min", "max"),
+}
+
+def date_slice(df, start_date, end_date):
+    """Rows in [start_date, end_date] by binary search on the sorted Date column (zero-copy slice)."""
+    lo = df["Date"].search_sorted(start_date, side="left")
+    hi = df["Date"].search_sorted(end_date, side="right")
+    return df.slice(lo, max(hi - lo, 0))
+
 def main():
     st.title("🇮🇳 NSE Market Breadth Dashboard")
     st.caption("Tracking internal market strength across all NSE stocks (2023-Present)")
 
-    df = load_data()
+    df = load_data(file_version(METRICS_IPC))
 
     if df is None:
         st.error("Data not found. Please ensure the pipeline has run successfully.")
@@ -55,18 +116,38 @@ def main():
 
     # Sidebar
     st.sidebar.header("Configuration")
+
+    # Segment Filter (index / sector / liquidity bucket breadth from calculate_metrics.py)
+    segment = "ALL"
+    segments_version = file_version(SEGMENTS_IPC)
+    if segments_version is not None:
+        segment_names = ["ALL"] + [s for s in load_segment(None, segments_version) if s != "ALL"]
+        segment = st.sidebar.selectbox("Segment", segment_names)
+        if segment != "ALL":
+            df = load_segment(segment, segments_version)
     
-    # Date Filter
-    min_date = df['Date'].min()
-    max_date = df['Date'].max()
+    # Date Filter (Date is sorted ascending in the pipeline output)
+    min_date = df['Date'][0]
+    max_date = df['Date'][-1]
     
     # Default to last 30 days view
     start_date = st.sidebar.date_input("Start Date", value=max_date - timedelta(days=90), min_value=min_date, max_value=max_date)
     end_date = st.sidebar.date_input("End Date", value=max_date, min_value=min_date, max_value=max_date)
     
-    # Filter Data
-    mask = (df['Date'].dt.date >= start_date) & (df['Date'].dt.date <= end_date)
-    filtered_df = df.loc[mask].copy()
+    scale_mode = st.sidebar.selectbox("Colour scale", list(SCALE_MODES))
+    scale_source, lo_stat, hi_stat = SCALE_MODES[scale_mode]
+    
+    # Filter Data - only the visible slice is converted for display
+    view = date_slice(df, start_date, end_date).reverse()
+    filtered_df = view.to_pandas()
+
+    scales = None
+    if scale_source == "global":
+        scales = (load_scales(file_version(color_scales.SCALES_FILE)) or {}).get(segment)
+    elif scale_source == "rolling":
+        rolling = load_rolling_scales(segment, file_version(color_scales.ROLLING_SCALES_FILE))
+        if rolling is not None:
+            scales = view.select("Date").join(rolling, on="Date", how="left", maintain_order="left")
 
     # Latest Values
     # st.metric removed as per request for plain table view
@@ -76,21 +157,8 @@ def main():
     # ----------------------------------
     st.subheader(f"🗓️ Market Breadth Data ({start_date} to {end_date})")
     
-    # Heatmap Metrics Selection - EXACT ORDER Requested by User
-    metrics_cols = [
-        "No. of stocks up 4.5%+ in the current day",
-        "No. of stocs down 4.5%+ in the current day",
-        "No. of stocks up 20%+ in 5 days",
-        "No. of stocks down 20%+ in 5 days",
-        "No of stocks above 200 day simple moving average",
-        "No of stocks above 50 day simple moving average",
-        "No of stocks above 20 day simple moving average",
-        "No of stocks which are positive",
-        "No of stocks which are negative",
-        "Advance/Decline Ratio",
-        "Net New Highs",
-        "Net New 52-Week Highs as % of Total Stocks"
-    ]
+    # Heatmap Metrics Selection - registry order (scripts/metrics_registry.py)
+    metrics_cols = [m for m in metrics_registry.output_columns() if metrics_registry.get(m).sentiment]
     
     # Prepare Dataframe for Display
     # Ensure all columns exist (calculate_metrics.py must have been run)
@@ -99,66 +167,39 @@ def main():
     if missing:
         st.warning(f"Missing metrics in data: {missing}. Please re-run calculation script.")
         # Fallback to display whatever is available
-        display_df = filtered_df.sort_values(by="Date", ascending=False).set_index("Date")
+        display_df = filtered_df.set_index("Date")
     else:
-        display_df = filtered_df.sort_values(by="Date", ascending=False).set_index("Date")[metrics_cols]
-    
-    # Apply Gradient Styling
-    # Green gradients for "Good" things
-    good_cols = [
-        "No. of stocks up 4.5%+ in the current day", 
-        "No. of stocks up 20%+ in 5 days",
-        "No of stocks above 200 day simple moving average",
-        "No of stocks above 50 day simple moving average",
-        "No of stocks above 20 day simple moving average",
-        "No of stocks which are positive"
-    ]
-    
-    # Red gradients for "Bad" things
-    bad_cols = [
-        "No. of stocs down 4.5%+ in the current day",
-        "No. of stocks down 20%+ in 5 days",
-        "No of stocks which are negative"
-    ]
-    
-    # Diverging for Ratios/Net
-    diverging_cols = [
-        "Advance/Decline Ratio",
-        "Net New Highs",
-        "Net New 52-Week Highs as % of Total Stocks"
-    ]
-
-    # Dynamically select valid columns for styling to avoid KeyError
-    valid_cols = display_df.columns.tolist()
-    style_diverging = [c for c in diverging_cols if c in valid_cols]
-    style_good = [c for c in good_cols if c in valid_cols]
-    style_bad = [c for c in bad_cols if c in valid_cols]
+        display_df = filtered_df.set_index("Date")[metrics_cols]
     
-    # Formatting subsets
-    fmt_2f = ["Advance/Decline Ratio", "Net New 52-Week Highs as % of Total Stocks"]
-    fmt_2f_valid = [c for c in fmt_2f if c in valid_cols]
-    fmt_0f_valid = [c for c in valid_cols if c not in fmt_2f]
-
+    # Apply Colour Styling
     # Dynamically select valid columns for styling to avoid KeyError
     valid_cols = display_df.columns.tolist()
+    registry = [metrics_registry.get(c) for c in valid_cols if c in metrics_registry.BY_NAME]
     
-    # "Good" metrics: High value = Green, Low value = Red (RdYlGn)
-    # Includes: Up counts, SMA counts, Net Highs, AD Ratio
-    sentiment_positive_cols = style_good + style_diverging
-    sentiment_positive_valid = [c for c in sentiment_positive_cols if c in valid_cols]
-    
-    # "Bad" metrics: High value = Red, Low value = Green (RdYlGn_r)
-    # Includes: Down counts, Negative counts
-    sentiment_negative_valid = [c for c in style_bad if c in valid_cols]
+    # "Good" and diverging metrics: High value = Green, Low value = Red (RdYlGn)
+    # "Bad" metrics: High value = Red, Low value = Green (RdYlGn reversed)
+    # Colours come from one vectorised lookup per column against the precomputed scales
+    styles = pd.DataFrame("", index=display_df.index, columns=valid_cols)
+    for m in registry:
+        if not m.sentiment:
+            continue
+        values = display_df[m.name].to_numpy(dtype=float)
+        if isinstance(scales, dict) and m.name in scales:
+            lo, hi = scales[m.name][lo_stat], scales[m.name][hi_stat]
+        elif isinstance(scales, pl.DataFrame) and f"{m.name}|{lo_stat}" in scales.columns:
+            lo, hi = scales[f"{m.name}|{lo_stat}"].to_numpy(), scales[f"{m.name}|{hi_stat}"].to_numpy()
+        else:
+            # Visible range, or no precomputed scale for this metric yet
+            finite = values[np.isfinite(values)]
+            lo, hi = (finite.min(), finite.max()) if len(finite) else (0, 0)
+        styles[m.name] = color_scales.cell_styles(values, lo, hi, reverse=m.sentiment == "bad")
 
     # Formatting subsets
-    fmt_2f = ["Advance/Decline Ratio", "Net New 52-Week Highs as % of Total Stocks"]
-    fmt_2f_valid = [c for c in fmt_2f if c in valid_cols]
-    fmt_0f_valid = [c for c in valid_cols if c not in fmt_2f]
+    fmt_2f_valid = [m.name for m in registry if m.format in ("float", "pct")]
+    fmt_0f_valid = [c for c in valid_cols if c not in fmt_2f_valid]
 
     st_style = display_df.style\
-        .background_gradient(cmap="RdYlGn", subset=sentiment_positive_valid, axis=0)\
-        .background_gradient(cmap="RdYlGn_r", subset=sentiment_negative_valid, axis=0)\
+        .apply(lambda _: styles, axis=None)\
         .format("{:.2f}", subset=fmt_2f_valid)\
         .format("{:,.0f}", subset=fmt_0f_valid)
     
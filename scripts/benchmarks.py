@@ -0,0 +1,211 @@
+import polars as pl
+import numpy as np
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import date, timedelta
+
+from calculate_metrics import (
+    DISPLAY_START,
+    calculate_breadth_aggregates,
+    calculate_segment_aggregates,
+    calculate_stock_indicators,
+    prepare_master,
+)
+from metrics_registry import INDICATORS
+from process_data import process_chunk
+import export_data
+import raw_archive
+import synthetic_bhavcopies
+
+INDICATOR_COLUMNS = list(INDICATORS)
+
+def synthetic_master(symbols=3000, days=1000, seed=0):
+    """
+    In-memory master frame (symbols x days rows) of random-walk prices on 2-decimal ticks,
+    shuffled so the benchmark pays for the sort like a real concatenated history does.
+    """
+    rng = np.random.default_rng(seed)
+    walk = np.exp(np.cumsum(rng.normal(0, 0.02, (symbols, days)), axis=1))
+    close = np.round(walk * rng.lognormal(4, 1, (symbols, 1)), 2).ravel()
+    dates = [date(2015, 1, 1) + timedelta(days=i) for i in range(days)]
+
+    df = pl.DataFrame({
+        "Date": np.tile(np.array(dates, dtype="datetime64[D]"), symbols),
+        "Symbol": np.repeat([f"SYM{i:05d}" for i in range(symbols)], days),
+        "Series": "EQ",
+        "Open": close,
+        "High": np.round(close * 1.01, 2),
+        "Low": np.round(close * 0.99, 2),
+        "Close": close,
+        "PrevClose": close,
+        "Volume": rng.integers(100, 1_000_000, symbols * days).astype(np.float64),
+        "Turnover": close,
+    })
+    return df.sample(fraction=1.0, shuffle=True, seed=seed)
+
+def timed(fn, repeats, *args):
+    """Best-of-repeats seconds of fn(*args) and its last result."""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def bench_indicators(symbols, days, repeats):
+    """Original over("Symbol") evaluation vs the sort-once contiguous path, with an equality check."""
+    df = synthetic_master(symbols, days)
+    print(f"calculate_stock_indicators on {len(df):,} rows ({symbols} symbols x {days} days), best of {repeats}")
+
+    t_over, r_over = timed(lambda: calculate_stock_indicators(df, method="over", indicators=INDICATOR_COLUMNS), repeats)
+    t_cont, r_cont = timed(lambda: calculate_stock_indicators(df, method="contiguous", indicators=INDICATOR_COLUMNS), repeats)
+
+    key = ["Symbol", "Date"]
+    same = r_over.sort(key).select(key + INDICATOR_COLUMNS).equals(r_cont.sort(key).select(key + INDICATOR_COLUMNS))
+    print(f"  over       {t_over:8.3f}s")
+    print(f"  contiguous {t_cont:8.3f}s  ({t_over / t_cont:.2f}x)")
+    print(f"  identical indicators: {same}")
+    return same
+
+# Scale suite: synthetic bhavcopies on disk through the real pipeline functions.
+# Each scale's files are generated once (same seed, same bytes) and reused by later runs.
+BENCH_DIR = os.path.join(tempfile.gettempdir(), "breadth-bench")
+DEFAULT_SCALES = ["2000x1", "2000x3", "5000x3", "10000x3"]
+
+def bench_files(symbols, years, seed=0, root=BENCH_DIR):
+    """Synthetic bhavcopies for one scale, ending in DISPLAY_START's year so every step has output."""
+    out = os.path.join(root, f"{symbols}x{years}-seed{seed}")
+    marker = os.path.join(out, ".complete")
+    if not os.path.exists(marker):
+        shutil.rmtree(out, ignore_errors=True)
+        print(f"Generating {symbols} symbols x {years} year(s) in {out}...")
+        start = date(DISPLAY_START.year - years + 1, 1, 1)
+        synthetic_bhavcopies.generate(out, symbols, years, start=start, seed=seed)
+        open(marker, "w").close()
+    return sorted(glob.glob(os.path.join(out, "*.csv")))
+
+def bench_archive(files):
+    """The same bhavcopies as monthly raw_archive zips next to them (built once), for the archived-read step."""
+    root = os.path.join(os.path.dirname(files[0]), "archive")
+    marker = os.path.join(root, ".complete")
+    if not os.path.exists(marker):
+        shutil.rmtree(root, ignore_errors=True)
+        raw_archive.import_files(files, raw_archive.RawArchive(root))
+        open(marker, "w").close()
+    return raw_archive.RawArchive(root)
+
+def _export_fresh(df_agg, root):
+    # A new directory per repeat, so every shard is written rather than skipped as unchanged
+    return export_data.export_breadth(df_agg, out_dir=tempfile.mkdtemp(dir=root))
+
+def bench_scale(symbols, years, repeats, seed=0):
+    """Best-of-repeats seconds for each pipeline step at one scale; returns result rows."""
+    files = bench_files(symbols, years, seed)
+    steps = []
+
+    # Parsing is measured against the rows it produces (rows_in would be a file count)
+    t, df = timed(lambda: process_chunk(files), repeats)
+    steps.append(("process_chunk", t, len(df), len(df)))
+    archive = bench_archive(files)
+    t, archived = timed(lambda: process_chunk(archive.members(), archive), repeats)
+    steps.append(("process_chunk_archive", t, len(archived), len(archived)))
+    del archived
+    df = prepare_master(df.unique(subset=["Date", "Symbol", "Series"], maintain_order=True))
+
+    t, df_ind = timed(lambda: calculate_stock_indicators(df), repeats)
+    steps.append(("calculate_stock_indicators", t, len(df), len(df_ind)))
+    # df_ind is passed, not captured, so the del below releases it
+    t, df_agg = timed(calculate_breadth_aggregates, repeats, df_ind)
+    steps.append(("calculate_breadth_aggregates", t, len(df_ind), len(df_agg)))
+    t, df_seg = timed(calculate_segment_aggregates, repeats, df_ind)
+    steps.append(("calculate_segment_aggregates", t, len(df_ind), len(df_seg)))
+    del df_ind
+
+    with tempfile.TemporaryDirectory() as root:
+        t, _ = timed(lambda: _export_fresh(df_agg, root), repeats)
+    steps.append(("export_breadth", t, len(df_agg), len(df_agg)))
+
+    scale = f"{symbols}x{years}"
+    return [
+        {"scale": scale, "symbols": symbols, "years": years, "step": name, "seconds": round(sec, 4), "rows_in": rows_in, "rows_out": rows_out}
+        for name, sec, rows_in, rows_out in steps
+    ]
+
+def environment():
+    """What a result depends on besides the code, so runs on different machines are not compared blindly."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "polars": pl.__version__,
+        "numpy": np.__version__,
+        "polars_threads": pl.thread_pool_size(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.platform(),
+    }
+
+def print_results(results, baseline=None):
+    """Table of step timings; with a baseline, the ratio to the same (scale, step) there (<1 is faster)."""
+    before = {(r["scale"], r["step"]): r["seconds"] for r in (baseline or {}).get("results", [])}
+    print(f"  {'scale':<10} {'step':<30} {'rows in':>12} {'seconds':>9} {'Mrows/s':>8}" + (f" {'vs base':>8}" if baseline else ""))
+    for r in results:
+        rate = r["rows_in"] / r["seconds"] / 1e6 if r["seconds"] else float("inf")
+        line = f"  {r['scale']:<10} {r['step']:<30} {r['rows_in']:>12,} {r['seconds']:9.3f} {rate:8.2f}"
+        if baseline:
+            base = before.get((r["scale"], r["step"]))
+            line += f" {r['seconds'] / base:8.2f}" if base else f" {'-':>8}"
+        print(line)
+
+def bench_suite(scales, repeats, output=None, baseline=None):
+    results = []
+    for scale in scales:
+        symbols, years = (int(x) for x in scale.split("x"))
+        results.extend(bench_scale(symbols, years, repeats))
+
+    run = {"environment": environment(), "repeats": repeats, "results": results}
+    if baseline:
+        with open(baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("machine") != run["environment"]["machine"]:
+            print("Warning: the baseline was recorded on a different machine.")
+    print(f"Pipeline steps, best of {repeats}:")
+    print_results(results, baseline)
+    if output:
+        with open(output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Results written to {output}.")
+    return run
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks for the breadth pipeline.")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("indicators", help="over(\"Symbol\") vs contiguous window evaluation")
+    p.add_argument("--symbols", type=int, default=3000)
+    p.add_argument("--days", type=int, default=1000)
+    p.add_argument("--repeats", type=int, default=3)
+
+    p = sub.add_parser("suite", help="process / indicators / aggregates / export over synthetic bhavcopies at several scales")
+    p.add_argument("--scales", nargs="+", default=DEFAULT_SCALES, metavar="SYMBOLSxYEARS",
+                   help=f"Scales to run (default: {' '.join(DEFAULT_SCALES)})")
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--output", metavar="PATH", help="Write the results as JSON")
+    p.add_argument("--baseline", metavar="PATH", help="Results JSON of an earlier run to compare against")
+
+    args = parser.parse_args()
+    if args.bench == "suite":
+        bench_suite(args.scales, args.repeats, args.output, args.baseline)
+    elif args.bench == "indicators":
+        ok = bench_indicators(args.symbols, args.days, args.repeats)
+        raise SystemExit(0 if ok else 1)
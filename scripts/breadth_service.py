@@ -0,0 +1,250 @@
+import polars as pl
+import pyarrow as pa
+import os
+import json
+import gzip
+import hashlib
+import argparse
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from calculate_metrics import OUTPUT_IPC, SEGMENTS_OUTPUT_IPC
+import constituents
+import export_data
+import return_distribution
+
+# Local read-only query service over the breadth metrics, so a front end asks for a date range and
+# the metrics it shows instead of loading and filtering the whole history:
+#   GET /meta                                        date range, columns and segments
+#   GET /breadth?start=2024-01-01&end=2024-06-30&metric=Net%20New%20Highs&metric=...&segment=ALL
+#   GET /constituents?date=2024-05-10&metric=No%20of%20stocks%20above%20200%20day%20SMA
+#   GET /distribution?measure=PctChange1D&threshold=0.03&threshold=0.07&op=%3E%3D&start=...&end=...
+# /breadth answers in the shard format of export_data.py ({"columns": [...], "data": [one array per
+# column]}), oldest date first. The range is two binary searches on the sorted Date column of the
+# memory-mapped Arrow IPC outputs; only the requested columns of that slice are serialised.
+# /constituents lists the stocks behind a count on one date, from the index in constituents.py.
+# /distribution counts stocks past any thresholds per date, from return_distribution.py.
+# Responses carry an ETag derived from the query and the version of the files its route reads, so a
+# repeated request is a 304 until those files change.
+HOST = os.environ.get("BREADTH_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("BREADTH_API_PORT", "8765"))
+# Browsers calling the service directly (NEXT_PUBLIC_BREADTH_API_URL) need CORS
+ALLOW_ORIGIN = os.environ.get("BREADTH_API_ALLOW_ORIGIN", "*")
+GZIP_MIN_BYTES = 1024
+
+
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def read_mapped(path):
+    """Memory-map an uncompressed Arrow IPC file (same as app.py); pages are read when a slice touches them."""
+    return pl.from_arrow(pa.ipc.open_file(pa.memory_map(path)).read_all(), rechunk=False)
+
+class BreadthStore:
+    """
+    The mapped metrics and per-segment frames, re-mapped when the pipeline replaces a file
+    (its mtime is the data version, as in app.py).
+    """
+    def __init__(self, metrics_path=OUTPUT_IPC, segments_path=SEGMENTS_OUTPUT_IPC):
+        self.paths = {"metrics": metrics_path, "segments": segments_path}
+        self.lock = threading.Lock()
+        self.loaded = {}     # name -> (version, frame)
+        self.segments = {}   # (version, segment) -> frame
+
+    def _version(self, name):
+        try:
+            return os.stat(self.paths[name]).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _frame(self, name):
+        version = self._version(name)
+        if version is None:
+            return None, None
+        with self.lock:
+            cached = self.loaded.get(name)
+            if cached is None or cached[0] != version:
+                cached = self.loaded[name] = (version, read_mapped(self.paths[name]))
+                if name == "segments":
+                    self.segments.clear()
+            return cached
+
+    def frame(self, segment="ALL"):
+        """(data version, Date-sorted frame) for a segment; raises QueryError if it is not there."""
+        version, df = self._frame("metrics")
+        if df is None:
+            raise QueryError(503, f"{self.paths['metrics']} not found. Run the pipeline first.")
+        if segment == "ALL":
+            return f"{version}", df
+
+        seg_version, segments = self._frame("segments")
+        if segments is None:
+            raise QueryError(404, f"Unknown segment: {segment}")
+        with self.lock:
+            key = (seg_version, segment)
+            if key not in self.segments:
+                self.segments[key] = segments.filter(pl.col("Segment") == segment).drop("Segment")
+            part = self.segments[key]
+        if part.is_empty():
+            raise QueryError(404, f"Unknown segment: {segment}")
+        return f"{seg_version}", part
+
+    def segment_names(self):
+        _, segments = self._frame("segments")
+        names = [] if segments is None else [s for s in segments["Segment"].unique().sort().to_list() if s != "ALL"]
+        return ["ALL"] + names
+
+
+def _date_param(params, name):
+    values = params.get(name)
+    if not values:
+        return None
+    try:
+        return date.fromisoformat(values[0])
+    except ValueError:
+        raise QueryError(400, f"{name} must be YYYY-MM-DD, got {values[0]!r}")
+
+def query(df, start=None, end=None, metrics=None):
+    """Rows of df with Date in [start, end] (binary search) and only the requested metric columns."""
+    lo = df["Date"].search_sorted(start, side="left") if start else 0
+    hi = df["Date"].search_sorted(end, side="right") if end else len(df)
+    columns = ["Date"]
+    if metrics:
+        unknown = [m for m in metrics if m not in df.columns]
+        if unknown:
+            raise QueryError(400, f"Unknown metric(s): {unknown}")
+        columns += [m for m in metrics if m != "Date"]
+    else:
+        columns = df.columns
+    return df.slice(lo, max(hi - lo, 0)).select(columns)
+
+def constituents_of(params):
+    """{"date", "metric", "constituents": {condition metric: [symbols]}} for /constituents."""
+    day = _date_param(params, "date")
+    metric = params.get("metric", [None])[0]
+    if day is None or not metric:
+        raise QueryError(400, "date and metric are required")
+    try:
+        found = constituents.lookup(metric, day)
+    except KeyError as e:
+        raise QueryError(400, str(e.args[0]))
+    if found is None:
+        raise QueryError(404, f"No constituent index for {day}")
+    return {"date": day.isoformat(), "metric": metric, "constituents": found}
+
+def distribution_of(params):
+    """Columnar Date + one count column per threshold for /distribution."""
+    measure = params.get("measure", [None])[0]
+    op = params.get("op", [">="])[0]
+    try:
+        thresholds = [float(t) for t in params.get("threshold", [])]
+    except ValueError:
+        raise QueryError(400, "threshold must be a number")
+    if not measure or not thresholds:
+        raise QueryError(400, "measure and at least one threshold are required")
+    try:
+        df = return_distribution.counts(measure, thresholds, op, _date_param(params, "start"), _date_param(params, "end"))
+    except (KeyError, ValueError) as e:
+        raise QueryError(400, str(e.args[0]))
+    except FileNotFoundError as e:
+        raise QueryError(503, str(e))
+    return columnar(df)
+
+def columnar(df):
+    return {"columns": df.columns, "data": [export_data.column_values(df[c]) for c in df.columns]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    store = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        try:
+            segment = params.get("segment", ["ALL"])[0]
+            version, df = self._version(url.path, params, segment)
+            # Same data version and same query give the same body, so the tag is known before building it
+            tag = '"' + hashlib.sha1(f"{version}\0{url.path}\0{sorted(params.items())}".encode()).hexdigest() + '"'
+            if tag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+                self._send(304, None, tag)
+                return
+
+            if url.path == "/meta":
+                body = {
+                    "version": version,
+                    "segment": segment,
+                    "rows": len(df),
+                    "start": df["Date"][0].isoformat() if len(df) else None,
+                    "end": df["Date"][-1].isoformat() if len(df) else None,
+                    "columns": [{"name": n, "type": export_data.column_type(t)} for n, t in df.schema.items()],
+                    "segments": self.store.segment_names(),
+                }
+            elif url.path == "/constituents":
+                body = constituents_of(params)
+            elif url.path == "/distribution":
+                body = distribution_of(params)
+            elif url.path == "/breadth":
+                rows = query(df, _date_param(params, "start"), _date_param(params, "end"), params.get("metric"))
+                body = columnar(rows)
+            else:
+                raise QueryError(404, f"Unknown path: {url.path}")
+        except QueryError as e:
+            self._send(e.status, {"error": str(e)})
+            return
+        self._send(200, body, tag)
+
+    def _version(self, path, params, segment):
+        """
+        (data version, frame) for a route, the version taken from the files that route reads: the
+        metrics or segments IPC for /meta and /breadth, the symbol dictionary and the date's year
+        file for /constituents, the distribution year files for /distribution (frame None for those).
+        """
+        if path == "/constituents":
+            day = _date_param(params, "date")
+            return (constituents.version(day) if day else None), None
+        if path == "/distribution":
+            return return_distribution.version(), None
+        return self.store.frame(segment)
+
+    def _send(self, status, body, tag=None):
+        payload = b"" if body is None else json.dumps(body, separators=(",", ":"), allow_nan=False).encode()
+        self.send_response(status)
+        if tag:
+            self.send_header("ETag", tag)
+            # Cacheable, but revalidated every time: a new pipeline run changes the tag
+            self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
+        self.send_header("Access-Control-Expose-Headers", "ETag")
+        if payload:
+            if len(payload) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+                payload = gzip.compress(payload, compresslevel=5)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def serve(host=HOST, port=PORT):
+    Handler.store = BreadthStore()
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"Serving breadth queries on http://{host}:{port} (GET /meta, /breadth, /constituents, /distribution)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only HTTP query service over the breadth metrics.")
+    parser.add_argument("--host", default=HOST, help=f"Bind address (default: {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"Port (default: {PORT})")
+    args = parser.parse_args()
+    serve(args.host, args.port)
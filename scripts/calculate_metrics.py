@@ -1,137 +1,356 @@
 import polars as pl
 import os
-from datetime import datetime
+import argparse
+from datetime import datetime, timedelta
+
+import master_store
+import metrics_registry
+import export_data
+import color_scales
+import constituents
+import return_distribution
+import instrumentation
+from instrumentation import peak_rss_mb, profiled
 
-INPUT_FILE = "data/master_bhavcopy.parquet"
 OUTPUT_FILE = "data/market_breadth_metrics.parquet"
+SEGMENTS_OUTPUT_FILE = "data/market_breadth_segments.parquet"
+# Uncompressed Arrow IPC copies that app.py memory-maps
+OUTPUT_IPC = "data/market_breadth_metrics.arrow"
+SEGMENTS_OUTPUT_IPC = "data/market_breadth_segments.arrow"
+
+# Optional membership map for segmented breadth: CSV with Segment,Symbol columns
+# (one row per index / sector membership; a symbol may belong to several segments)
+SEGMENTS_FILE = "data/segments.csv"
+# Every date is also split into turnover-ranked buckets on the 20 day average turnover; Q1 is the most liquid
+LIQUIDITY_INDICATOR = "AvgTurnover20"
+LIQUIDITY_BUCKETS = 5
+
+# Breadth is reported from DISPLAY_START onwards; the longest window (252 rows for 52W high/low)
+# needs roughly a year of history before that, so load a little more than a year of warm-up.
+DISPLAY_START = datetime(2022, 1, 1)
+WARMUP_DAYS = 400
+
+# Streaming recompute (--stream): cap on the whole process's peak RSS, in MB
+MEMORY_CAP_MB = int(os.environ.get("MEMORY_CAP_MB", "1024"))
+# Sorting and with_columns hold a few copies of a chunk at once
+CHUNK_HEADROOM = 4
+
+def _fixed_point_sum(ind):
+    return (pl.col(ind.column) * ind.scale).round().cast(pl.Int64).rolling_sum(window_size=ind.window)
 
-def calculate_stock_indicators(df):
+def _fixed_point_mean(sums, ind):
     """
-    Calculates rolling indicators for each stock.
-    Returns the original DF with added columns.
+    Rolling mean from an exact integer window sum. Polars' float rolling_mean carries rounding from
+    the start of the series, so the same window could give a different last bit depending on how
+    much history was loaded; an integer sum over the window does not.
     """
-    print("Calculating rolling indicators (SMAs, Returns)...")
-    
+    divisor = ind.window * ind.scale
+    # NumPy division is correctly rounded (see master_store._paise_to_rupees)
+    return sums.map_batches(
+        lambda s: pl.Series(s.name, s.cast(pl.Float64).to_numpy() / divisor, nan_to_null=True),
+        return_dtype=pl.Float64,
+    )
+
+def _indicators_over(df, indicators):
+    """Original evaluation: sort by (Symbol, Date), then one over("Symbol") partition per expression."""
     # Sort just in case
     df = df.sort(["Symbol", "Date"])
     
-    # Window operations needed:
-    # 1. 5-day Return: (Close / Close_lag_5) - 1
-    # 2. SMAs: 20, 50, 200
-    # 3. New Highs/Lows: Rolling Max/Min 252 days (1 year approx)
-    
     # We use 'over("Symbol")' to partition operations
+    exprs = []
+    for ind in indicators:
+        col = pl.col(ind.column)
+        if ind.op == "pct_change":
+            expr = col / col.shift(ind.window).over("Symbol") - 1
+        elif ind.op == "rolling_mean":
+            expr = _fixed_point_mean(_fixed_point_sum(ind).over("Symbol"), ind)
+        else:
+            expr = getattr(col, ind.op)(window_size=ind.window).over("Symbol")
+        exprs.append(expr.alias(ind.name))
+    return df.with_columns(exprs)
+
+def _indicators_contiguous(df, indicators):
+    """
+    Sort once on a packed (symbol id, date) integer key, so every symbol is one contiguous run,
+    and evaluate the windows over those runs instead of re-partitioning by Symbol per expression.
+    """
+    # u32 dictionary id per symbol (free when Symbol is already Categorical)
+    df = df.with_columns(pl.col("Symbol").cast(pl.Categorical).to_physical().alias("_sym"))
+    # One u64 sort key is far cheaper to sort than (Utf8, Date)
+    df = df.sort(pl.col("_sym").cast(pl.UInt64) * (1 << 32) + pl.col("Date").cast(pl.Int32).cast(pl.UInt64))
+
+    # Group offsets: position of each row inside its symbol's run
+    row = pl.int_range(pl.len(), dtype=pl.Int64)
+    run_start = pl.when(pl.col("_sym").ne_missing(pl.col("_sym").shift(1))).then(row)
+    df = df.with_columns(
+        pl.col("_sym").set_sorted(),
+        (row - run_start.fill_null(strategy="forward")).alias("_pos"),
+    )
+
+    def in_run(expr, rows):
+        # A whole-column window is only valid once it no longer reaches back into the previous symbol
+        return pl.when(pl.col("_pos") >= rows - 1).then(expr)
+
+    # Every window is exact on the whole sorted column (integer sums, max/min, shifts), masked at run starts
+    exprs = []
+    for ind in indicators:
+        col = pl.col(ind.column)
+        if ind.op == "pct_change":
+            expr = col / in_run(col.shift(ind.window), ind.window + 1) - 1
+        elif ind.op == "rolling_mean":
+            expr = _fixed_point_mean(in_run(_fixed_point_sum(ind), ind.window), ind)
+        else:
+            expr = in_run(getattr(col, ind.op)(window_size=ind.window), ind.window)
+        exprs.append(expr.alias(ind.name))
+    return df.with_columns(exprs).drop(["_sym", "_pos"])
+
+def default_indicators():
+    """Indicators a pipeline run computes: what the displayed metrics need plus the liquidity ranking."""
+    return metrics_registry.required_indicators() + [LIQUIDITY_INDICATOR]
+
+@profiled("indicators")
+def calculate_stock_indicators(df, method="contiguous", indicators=None):
+    """
+    Calculates rolling indicators for each stock.
+    Returns the original DF with added columns.
+    indicators: names from metrics_registry.INDICATORS (default: default_indicators()).
+    method="contiguous" (default) sorts once and evaluates over contiguous symbol runs;
+    method="over" is the original per-expression over("Symbol"). Both give identical values,
+    though "contiguous" orders symbols by dictionary id rather than alphabetically.
+    """
+    print("Calculating rolling indicators (SMAs, Returns)...")
     
-    df = df.with_columns([
-        # Returns
-        (pl.col("Close") / pl.col("Close").shift(1).over("Symbol") - 1).alias("PctChange1D"),
-        (pl.col("Close") / pl.col("Close").shift(5).over("Symbol") - 1).alias("PctChange5D"),
-        
-        # SMAs
-        pl.col("Close").rolling_mean(window_size=20).over("Symbol").alias("SMA20"),
-        pl.col("Close").rolling_mean(window_size=50).over("Symbol").alias("SMA50"),
-        pl.col("Close").rolling_mean(window_size=200).over("Symbol").alias("SMA200"),
-        
-        # 52 Week High/Low (approx 252 trading days)
-        pl.col("High").rolling_max(window_size=252).over("Symbol").alias("High52W"),
-        pl.col("Low").rolling_min(window_size=252).over("Symbol").alias("Low52W"),
-        
-        # Volume Spike
-        pl.col("Volume").rolling_mean(window_size=20).over("Symbol").alias("AvgVol20")
-    ])
+    if indicators is None:
+        indicators = default_indicators()
+    specs = [metrics_registry.INDICATORS[name] for name in indicators]
+    
+    if method == "over":
+        df = _indicators_over(df, specs)
+    elif method == "contiguous":
+        df = _indicators_contiguous(df, specs)
+    else:
+        raise ValueError(f"Unknown indicator method: {method}")
     
     # Derived Boolean Flags
-    df = df.with_columns([
-        (pl.col("High") >= pl.col("High52W")).alias("IsNew52W_High"),
-        (pl.col("Low") <= pl.col("Low52W")).alias("IsNew52W_Low")
-    ])
+    if "High52W" in indicators and "Low52W" in indicators:
+        df = df.with_columns([
+            (pl.col("High") >= pl.col("High52W")).alias("IsNew52W_High"),
+            (pl.col("Low") <= pl.col("Low52W")).alias("IsNew52W_Low")
+        ])
     
     return df
 
-def calculate_breadth_aggregates(df):
+@profiled("aggregate")
+def calculate_breadth_aggregates(df, metrics=None):
     """
     Aggregates daily statistics across the market.
+    metrics: names from metrics_registry.METRICS (default: every displayed metric), evaluated
+    in one fused group_by("Date").agg pass.
     """
     print("Aggregating daily market breadth...")
     
-    # Filter for active trading days only? ensure date links
-    
-    # Conditions
-    # 1. Up 4.5%
-    # 2. Down 4.5%
-    # 3. Up 20% in 5D
-    # 4. Down 20% in 5D
-    # 5. Above SMA 20, 50, 200
-    # 6. Positive/Negative
-    # 7. New Highs/Lows (Close > High52W prev day? using High/Low)
-    #    Strictly speaking, "New High" is when High >= High52W. 
-    #    Or commonly, High > Prev_High52W. 
-    #    Let's use High == High52W for simplicity, or High >= rolling_max(252)
-    
-    # Aggregate by Date
-    daily_stats = df.group_by("Date").agg([
-        pl.len().alias("TotalTraded"),
-        
-        # 1. Stocks up 4.5%+
-        (pl.col("PctChange1D") >= 0.045).sum().alias("No. of stocks up 4.5%+ in the current day"),
-        
-        # 2. Stocks down 4.5%+
-        (pl.col("PctChange1D") <= -0.045).sum().alias("No. of stocs down 4.5%+ in the current day"),
-        
-        # 3. Up 20% in 5 days
-        (pl.col("PctChange5D") >= 0.20).sum().alias("No. of stocks up 20%+ in 5 days"),
-        
-        # 4. Down 20% in 5 days
-        (pl.col("PctChange5D") <= -0.20).sum().alias("No. of stocks down 20%+ in 5 days"),
-        
-        # 5. SMA Counts
-        (pl.col("Close") > pl.col("SMA200")).sum().alias("No of stocks above 200 day SMA"),
-        (pl.col("Close") > pl.col("SMA50")).sum().alias("No of stocks above 50 day SMA"),
-        (pl.col("Close") > pl.col("SMA20").fill_null(0)).sum().alias("No of stocks above 20 day SMA"),
-        
-        # 6. Market Breadth
-        (pl.col("PctChange1D") > 0).sum().alias("No of stocks which are positive"),
-        (pl.col("PctChange1D") < 0).sum().alias("No of stocks which are negative"),
-        
-        # 7. Highs/Lows
-        pl.col("IsNew52W_High").sum().alias("New52W_Highs"),
-        pl.col("IsNew52W_Low").sum().alias("New52W_Lows")
-    ])
-    
-    # Post-aggregation metrics
-    daily_stats = daily_stats.with_columns([
-        (pl.col("No of stocks which are positive") / pl.col("No of stocks which are negative")).alias("Advance/Decline Ratio"),
-        (pl.col("New52W_Highs").cast(pl.Int64) - pl.col("New52W_Lows").cast(pl.Int64)).alias("Net New Highs")
-    ])
+    # Filter for display (User wants to see 2022 onwards only)
+    df = df.filter(pl.col("Date") >= DISPLAY_START)
     
-    # Select and Reorder columns precisely
-    final_cols = [
-        "Date",
-        "No. of stocks up 4.5%+ in the current day",
-        "No. of stocs down 4.5%+ in the current day",
-        "No. of stocks up 20%+ in 5 days",
-        "No. of stocks down 20%+ in 5 days",
-        "No of stocks above 200 day SMA",
-        "No of stocks above 50 day SMA",
-        "No of stocks above 20 day SMA",
-        "No of stocks which are positive",
-        "No of stocks which are negative",
-        "Advance/Decline Ratio",
-        "Net New Highs",
-        "TotalTraded"
-    ]
+    aggregate = metrics_registry.build_aggregation(metrics)
+    return aggregate(df).sort("Date")
+
+def load_segments(path=SEGMENTS_FILE):
+    """Segment membership map (Segment, Symbol), or None if there is no membership file."""
+    if not os.path.exists(path):
+        return None
+    membership = pl.read_csv(path, columns=["Segment", "Symbol"], schema_overrides={"Segment": pl.Utf8, "Symbol": pl.Utf8})
+    return membership.with_columns(pl.col("Segment").str.strip_chars(), pl.col("Symbol").str.strip_chars()).unique()
+
+@profiled("segments")
+def calculate_segment_aggregates(df, membership=None, metrics=None):
+    """
+    Breadth per (Date, Segment) in long format, from the same indicator frame as the market-wide
+    aggregates. Segments: ALL (the whole universe), the turnover-ranked liquidity buckets and every
+    segment in the membership map. The segment frames are stacked lazily and aggregated in one
+    group_by(["Date", "Segment"]) pass.
+    """
+    print("Aggregating segment breadth...")
+    lf = df.lazy().filter(pl.col("Date") >= DISPLAY_START)
+    columns = df.columns + ["Segment"]
+
+    frames = [lf.with_columns(pl.lit("ALL").alias("Segment"))]
+
+    # Rank on the day's stocks that have a full turnover window; ties share a bucket
+    turnover = pl.col(LIQUIDITY_INDICATOR)
+    rank = turnover.rank("min", descending=True).over("Date")
+    bucket = (rank - 1) * LIQUIDITY_BUCKETS // turnover.count().over("Date") + 1
+    frames.append(
+        lf.filter(turnover.is_not_null())
+        .with_columns(pl.format("Liquidity Q{}", bucket).alias("Segment"))
+    )
+
+    if membership is not None:
+        membership = membership.with_columns(pl.col("Symbol").cast(df.schema["Symbol"]))
+        frames.append(lf.join(membership.lazy(), on="Symbol").select(columns))
+
+    aggregate = metrics_registry.build_aggregation(metrics, by=["Date", "Segment"])
+    return instrumentation.collect(aggregate(pl.concat([f.select(columns) for f in frames])).sort(["Date", "Segment"]), "segments")
+
+def check_compact(df):
+    """
+    Precision check for COMPACT_SCHEMA, run on a full-schema master:
+    1. prices must survive the paise round trip bit for bit
+    2. indicators + aggregates on the compact in-memory frame must give identical breadth counts
+    Returns True if both hold.
+    """
+    if master_store.is_compact(df.schema):
+        print("The store is already compact. Rebuild it without COMPACT_SCHEMA to run the check.")
+        return False
+
+    compact = master_store.decode_prices(master_store.to_compact(df))
+    ok = True
+    for col in master_store.PRICE_COLUMNS:
+        changed = df[col].ne_missing(compact[col]).sum()
+        ok = ok and changed == 0
+        print(f"  {col:<45} {'exact' if changed == 0 else f'{changed} values changed'}")
+
+    full_agg = calculate_breadth_aggregates(calculate_stock_indicators(df))
+    compact_agg = calculate_breadth_aggregates(calculate_stock_indicators(compact))
+
+    print(f"Compact schema precision check over {len(full_agg)} dates:")
+    if full_agg["Date"].to_list() != compact_agg["Date"].to_list():
+        print("Date index differs between representations.")
+        return False
+
+    for col in full_agg.columns:
+        mismatches = full_agg[col].ne_missing(compact_agg[col]).sum()
+        ok = ok and mismatches == 0
+        print(f"  {col:<45} {'OK' if mismatches == 0 else f'{mismatches} dates differ'}")
+    print("Breadth counts unchanged." if ok else "Breadth counts DIFFER.")
+    return ok
+
+def prepare_master(df):
+    """Master rows (as stored or as just parsed) in the in-memory representation selected by COMPACT_SCHEMA."""
+    df = master_store.to_compact(df) if master_store.COMPACT else master_store.to_full(df)
+    return master_store.decode_prices(df)
+
+@profiled("load_master")
+def load_master(start=None, end=None):
+    """Load the master for [start, end] in the in-memory representation selected by COMPACT_SCHEMA."""
+    return prepare_master(instrumentation.collect(master_store.scan_master(start=start, end=end), "scan_master"))
+
+def _carry_tail(df, rows):
+    """Last `rows` rows of every symbol: all the history the next chunk's windows can reach back to."""
+    tail = df.sort(["Symbol", "Date"]).group_by("Symbol", maintain_order=True).tail(rows)
+    return tail.select(df.columns)
+
+def stream_metrics(start, memory_cap_mb=MEMORY_CAP_MB, metrics=None):
+    """
+    Out-of-core recompute. Walks the store in date-range chunks sized to fit memory_cap_mb and
+    carries the last lookback rows of every symbol into the next chunk, so each window sees exactly
+    the rows it would in the in-memory run. Only the per-chunk aggregates are kept.
+    Rolling means are exact window sums (see _fixed_point_mean), so chunking never changes them.
+    Returns (market aggregates, segment aggregates).
+    """
+    indicators = metrics_registry.required_indicators(metrics) + [LIQUIDITY_INDICATOR]
+    membership = load_segments()
+    carry_rows = metrics_registry.lookback(indicators)
+
+    # Rows per date and the symbol count from a Date/Symbol-only scan, so chunks are planned without loading prices
+    lf = master_store.scan_master(start=start)
+    counts = lf.group_by("Date").agg(pl.len().alias("rows")).sort("Date").collect()
+    if counts.is_empty():
+        return None, None
+    dates, rows = counts["Date"].to_list(), counts["rows"].to_list()
+    symbols = lf.select(pl.col("Symbol").n_unique()).collect().item()
+
+    # In-memory bytes per row once the indicator (and sort helper) columns are attached
+    sample = load_master(start=dates[0], end=dates[0])
+    row_bytes = sample.estimated_size() / len(sample) + 8 * (len(indicators) + 2)
+    budget_rows = (memory_cap_mb - peak_rss_mb()) * 1024 * 1024 / CHUNK_HEADROOM / row_bytes
+    # The carry can grow to carry_rows for every symbol in the range; reserve that up front
+    chunk_budget = budget_rows - symbols * carry_rows
+    if chunk_budget < max(rows):
+        raise MemoryError(f"A memory cap of {memory_cap_mb} MB cannot hold one trading day plus the carry. Raise MEMORY_CAP_MB.")
+
+    parts, segment_parts = [], []
+    carry = None
+    i = 0
+    while i < len(dates):
+        held = 0 if carry is None else len(carry)
+        j, chunk_rows = i + 1, rows[i]
+        while j < len(dates) and chunk_rows + rows[j] <= chunk_budget:
+            chunk_rows += rows[j]
+            j += 1
+
+        chunk = load_master(start=dates[i], end=dates[j - 1])
+        if carry is not None:
+            chunk = pl.concat([carry, chunk])
+        df_ind = calculate_stock_indicators(chunk, indicators=indicators)
+        df_ind = df_ind.filter(pl.col("Date") >= dates[i])
+        parts.append(calculate_breadth_aggregates(df_ind, metrics))
+        segment_parts.append(calculate_segment_aggregates(df_ind, membership, metrics))
+        # The drill-down index and distributions are written per chunk; the first chunk starts them over
+        constituents.update(df_ind, start=DISPLAY_START, replace=i == 0)
+        return_distribution.update(df_ind, start=DISPLAY_START, replace=i == 0)
+        del df_ind
+        carry = _carry_tail(chunk, carry_rows)
+        del chunk
+
+        print(f"  {dates[i]} .. {dates[j - 1]}: {chunk_rows} rows (+{held} carried), peak RSS {peak_rss_mb():.0f} MB")
+        i = j
+
+    return pl.concat(parts).sort("Date"), pl.concat(segment_parts).sort(["Date", "Segment"])
+
+def _write_ipc(df, path):
+    # Written aside and renamed, so a dashboard holding the old file mapped never sees a partial write
+    tmp_path = path + ".tmp"
+    df.write_ipc(tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+@profiled("save_outputs")
+def save_outputs(df_agg, df_seg=None):
+    # Save Parquet
+    print(f"Saving metrics to {OUTPUT_FILE}...")
+    with instrumentation.step("write_metrics", rows_in=len(df_agg)):
+        df_agg.write_parquet(OUTPUT_FILE)
+        _write_ipc(df_agg, OUTPUT_IPC)
     
-    # Filter for display (User wants to see 2022 onwards only)
-    daily_stats = daily_stats.filter(pl.col("Date") >= datetime(2022, 1, 1))
+    # Year-sharded columnar export for Frontend (Next.js)
+    print(f"Exporting dashboard shards to {export_data.EXPORT_DIR}...")
+    export_data.export_breadth(df_agg)
+
+    if df_seg is not None:
+        print(f"Saving segment metrics to {SEGMENTS_OUTPUT_FILE}...")
+        with instrumentation.step("write_segments", rows_in=len(df_seg)):
+            df_seg.write_parquet(SEGMENTS_OUTPUT_FILE)
+            _write_ipc(df_seg, SEGMENTS_OUTPUT_IPC)
 
-    return daily_stats.select(final_cols).sort("Date")
+    # Heatmap colour scales for app.py
+    color_scales.save_scales(df_agg, df_seg)
 
-def main():
-    if not os.path.exists(INPUT_FILE):
-        print(f"Input {INPUT_FILE} not found. Run process_data.py first.")
+def main(check=False, stream=False, memory_cap_mb=MEMORY_CAP_MB):
+    if not master_store.exists():
+        print(f"Input {master_store.MASTER_DIR} not found. Run process_data.py first.")
         return
 
-    df = pl.read_parquet(INPUT_FILE)
+    # Predicate pushdown: only partitions / row groups from the warm-up start onwards are read
+    start = DISPLAY_START - timedelta(days=WARMUP_DAYS)
+    if check:
+        df = master_store.scan_master(start=start).collect()
+        print(f"Loaded {len(df)} rows.")
+        return check_compact(df)
+
+    if stream:
+        print(f"Streaming recompute under a {memory_cap_mb} MB cap...")
+        df_agg, df_seg = stream_metrics(start, memory_cap_mb)
+        save_outputs(df_agg, df_seg)
+        peak = peak_rss_mb()
+        print(f"Peak RSS {peak:.0f} MB (cap {memory_cap_mb} MB).")
+        if peak > memory_cap_mb:
+            print("Memory cap EXCEEDED.")
+            return False
+        print("Done.")
+        return True
+
+    # In-memory representation follows COMPACT_SCHEMA regardless of how the store was written
+    df = load_master(start=start)
     print(f"Loaded {len(df)} rows.")
     
     # 1. Calc Indicators
@@ -140,16 +359,24 @@ def main():
     # 2. Aggregates
     df_agg = calculate_breadth_aggregates(df_ind)
     
-    # Save Parquet
-    print(f"Saving metrics to {OUTPUT_FILE}...")
-    df_agg.write_parquet(OUTPUT_FILE)
-    
-    # Save JSON for Frontend (Next.js)
-    json_path = "data/market_breadth.json"
-    print(f"Exporting JSON to {json_path}...")
-    df_agg.write_json(json_path)
+    # 3. Per-segment aggregates from the same indicator columns
+    df_seg = calculate_segment_aggregates(df_ind, load_segments())
+
+    # 4. Which stocks make up each count (data/constituents), and the per-date return
+    #    distributions for counts at other thresholds (data/return_distribution)
+    constituents.update(df_ind, start=DISPLAY_START, replace=True)
+    return_distribution.update(df_ind, start=DISPLAY_START, replace=True)
     
+    save_outputs(df_agg, df_seg)
     print("Done.")
+    return True
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Compute market breadth metrics from the master store.")
+    parser.add_argument("--check-compact", action="store_true", help="Verify COMPACT_SCHEMA leaves every breadth count unchanged")
+    parser.add_argument("--stream", action="store_true", help="Recompute in date-range chunks under a memory cap")
+    parser.add_argument("--memory-cap-mb", type=int, default=MEMORY_CAP_MB,
+                        help="Peak RSS cap for --stream (default: MEMORY_CAP_MB env or 1024)")
+    args = parser.parse_args()
+    ok = main(check=args.check_compact, stream=args.stream, memory_cap_mb=args.memory_cap_mb)
+    raise SystemExit(0 if ok is not False else 1)
@@ -0,0 +1,115 @@
+import polars as pl
+import numpy as np
+import json
+import os
+
+import metrics_registry
+from instrumentation import profiled
+
+# Precomputed heatmap normalisation for app.py, per segment and metric:
+#   data/color_scales.json          global min / max / quantiles over the whole history
+#   data/color_scales_rolling.arrow trailing ROLLING_WINDOW-day min / max / quantiles per date
+# The dashboard maps values through a fixed lookup table instead of letting pandas Styler
+# compute a gradient per rerun, so the same value gets the same colour in every view.
+SCALES_FILE = "data/color_scales.json"
+ROLLING_SCALES_FILE = "data/color_scales_rolling.arrow"
+ROLLING_WINDOW = 252
+QUANTILES = {"q05": 0.05, "q50": 0.50, "q95": 0.95}
+
+# ColorBrewer RdYlGn (11 classes, low -> high), the map background_gradient used
+RDYLGN = [
+    "#a50026", "#d73027", "#f46d43", "#fdae61", "#fee08b", "#ffffbf",
+    "#d9ef8b", "#a6d96a", "#66bd63", "#1a9850", "#006837",
+]
+LUT_SIZE = 256
+# Same dark / light text switch as pandas Styler.background_gradient
+TEXT_COLOR_THRESHOLD = 0.408
+
+def scale_columns(columns):
+    """Coloured heatmap columns: displayed metrics with a colour direction."""
+    return [m.name for m in metrics_registry.METRICS if m.display and m.sentiment and m.name in columns]
+
+def _finite(c):
+    # An A/D ratio on a day with no decliners is inf; keep it out of the scale
+    col = pl.col(c).cast(pl.Float64)
+    return pl.when(col.is_finite()).then(col).alias(c)
+
+def _long(df_agg, df_seg=None):
+    return df_seg if df_seg is not None else df_agg.with_columns(pl.lit("ALL").alias("Segment"))
+
+def global_scales(df):
+    """{segment: {metric: {min, max, q05, q50, q95}}} over every date of a (Date, Segment, metrics...) frame."""
+    columns = scale_columns(df.columns)
+    exprs = []
+    for c in columns:
+        exprs += [pl.col(c).min().alias(f"{c}|min"), pl.col(c).max().alias(f"{c}|max")]
+        exprs += [pl.col(c).quantile(q, interpolation="linear").alias(f"{c}|{name}") for name, q in QUANTILES.items()]
+    stats = df.with_columns([_finite(c) for c in columns]).group_by("Segment").agg(exprs).sort("Segment")
+
+    scales = {}
+    for row in stats.iter_rows(named=True):
+        scales[row["Segment"]] = {
+            c: {stat: row[f"{c}|{stat}"] for stat in ["min", "max", *QUANTILES]} for c in columns
+        }
+    return scales
+
+def rolling_scales(df, window=ROLLING_WINDOW):
+    """Per (Segment, Date) trailing-window stats; columns are named "<metric>|<stat>"."""
+    columns = scale_columns(df.columns)
+    exprs = []
+    for c in columns:
+        col = pl.col(c)
+        exprs += [
+            col.rolling_min(window, min_samples=1).over("Segment").alias(f"{c}|min"),
+            col.rolling_max(window, min_samples=1).over("Segment").alias(f"{c}|max"),
+        ]
+        exprs += [
+            col.rolling_quantile(q, interpolation="linear", window_size=window, min_samples=1).over("Segment").alias(f"{c}|{name}")
+            for name, q in QUANTILES.items()
+        ]
+    df = df.with_columns([_finite(c) for c in columns]).sort(["Segment", "Date"])
+    return df.select(["Segment", "Date", *exprs])
+
+@profiled("color_scales")
+def save_scales(df_agg, df_seg=None):
+    df = _long(df_agg, df_seg)
+    with open(SCALES_FILE + ".tmp", "w") as f:
+        json.dump({"rolling_window": ROLLING_WINDOW, "segments": global_scales(df)}, f, indent=1)
+    os.replace(SCALES_FILE + ".tmp", SCALES_FILE)
+
+    tmp_path = ROLLING_SCALES_FILE + ".tmp"
+    rolling_scales(df).write_ipc(tmp_path, compression="uncompressed")
+    os.replace(tmp_path, ROLLING_SCALES_FILE)
+
+def _build_lut(size=LUT_SIZE):
+    anchors = np.array([[int(h[i:i + 2], 16) for i in (1, 3, 5)] for h in RDYLGN], dtype=float) / 255
+    t = np.linspace(0, 1, size)
+    rgb = np.stack([np.interp(t, np.linspace(0, 1, len(anchors)), anchors[:, ch]) for ch in range(3)], axis=1)
+
+    # WCAG relative luminance, as in pandas' background_gradient
+    linear = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    luminance = linear @ np.array([0.2126, 0.7152, 0.0722])
+
+    hexes = ["#{:02x}{:02x}{:02x}".format(*px) for px in np.rint(rgb * 255).astype(int)]
+    text = np.where(luminance < TEXT_COLOR_THRESHOLD, "#f1f1f1", "#000000")
+    return np.array([f"background-color: {h}; color: {t}" for h, t in zip(hexes, text)], dtype=object)
+
+LUT = _build_lut()
+
+def cell_styles(values, lo, hi, reverse=False):
+    """
+    CSS per cell for a column of values, scaled between lo and hi (scalars or per-row arrays).
+    reverse=True puts high values at the red end ("bad" metrics). Missing values get no style.
+    """
+    values = np.asarray(values, dtype=float)
+    lo = np.asarray(lo, dtype=float)
+    hi = np.asarray(hi, dtype=float)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    with np.errstate(invalid="ignore"):
+        t = np.clip((values - lo) / span, 0, 1)
+    if reverse:
+        t = 1 - t
+    valid = np.isfinite(t)
+    styles = LUT[np.rint(np.where(valid, t, 0) * (LUT_SIZE - 1)).astype(int)]
+    styles[~valid] = ""
+    return styles
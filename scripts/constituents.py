@@ -0,0 +1,158 @@
+import polars as pl
+import os
+import json
+import argparse
+from datetime import date
+
+import metrics_registry
+from instrumentation import profiled
+
+# Drill-down index behind the breadth counts: for every date and every counted condition
+# (metrics_registry metrics with a `condition`), the sorted ids of the symbols that met it.
+#   data/constituents/symbols.json  symbol dictionary; ids are append-only, so they never change meaning
+#   data/constituents/2024.parquet  one row per date, one List[UInt32] column per condition
+# "Which stocks were above SMA200 on 2024-05-10" reads one column of one year file.
+CONSTITUENTS_DIR = "data/constituents"
+SYMBOLS_FILE = "symbols.json"
+
+def condition_metrics():
+    """Metrics that count a per-stock condition, in registry order (hidden ones included)."""
+    return [m for m in metrics_registry.METRICS if m.condition is not None]
+
+def components(name):
+    """
+    Condition metrics behind a breadth column: itself for a counted metric, or the counted metrics a
+    derived one is built from ("Net New Highs" -> New52W_Highs, New52W_Lows).
+    """
+    metric = metrics_registry.get(name)
+    if metric.condition is not None:
+        return [metric.name]
+    if metric.is_derived:
+        return [m.name for m in metrics_registry.resolve([name]) if m.condition is not None]
+    return []
+
+def load_symbols(out_dir=CONSTITUENTS_DIR):
+    path = os.path.join(out_dir, SYMBOLS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def _save_symbols(symbols, out_dir):
+    path = os.path.join(out_dir, SYMBOLS_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(symbols, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+def _year_path(year, out_dir):
+    return os.path.join(out_dir, f"{year}.parquet")
+
+@profiled("constituents")
+def update(df_ind, start=None, replace=False, out_dir=CONSTITUENTS_DIR):
+    """
+    Write the index for every date >= start in an indicator frame, replacing those dates if already
+    stored. replace=True drops every stored year first (full recompute). Returns the year files written.
+    """
+    df = df_ind if start is None else df_ind.filter(pl.col("Date") >= start)
+    os.makedirs(out_dir, exist_ok=True)
+    if replace:
+        for f in os.listdir(out_dir):
+            if f.endswith(".parquet"):
+                os.remove(os.path.join(out_dir, f))
+    if df.is_empty():
+        return []
+
+    # Extend the dictionary with symbols seen for the first time
+    symbols = load_symbols(out_dir)
+    known = set(symbols)
+    new = sorted(set(df["Symbol"].cast(pl.Utf8).unique().to_list()) - known)
+    if new:
+        symbols = symbols + new
+        _save_symbols(symbols, out_dir)
+    ids = pl.DataFrame({"Symbol": symbols, "SymbolId": pl.int_range(len(symbols), dtype=pl.UInt32, eager=True)})
+
+    metrics = [m for m in condition_metrics() if set(m.requires) <= set(df.columns)]
+    index = (
+        df.select(["Date", pl.col("Symbol").cast(pl.Utf8), *[m.condition.fill_null(False).alias(m.name) for m in metrics]])
+        .join(ids, on="Symbol", how="left")
+        .group_by("Date")
+        .agg([pl.col("SymbolId").filter(pl.col(m.name)).sort().alias(m.name) for m in metrics])
+        .sort("Date")
+    )
+
+    written = []
+    for (year,), part in index.group_by(pl.col("Date").dt.year(), maintain_order=True):
+        path = _year_path(year, out_dir)
+        if os.path.exists(path):
+            stored = pl.read_parquet(path).filter(pl.col("Date").is_in(part["Date"].implode()).not_())
+            part = pl.concat([stored, part], how="diagonal_relaxed").sort("Date")
+        part.write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        written.append(path)
+    return written
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def version(day, out_dir=CONSTITUENTS_DIR):
+    """Data version of a lookup on `day`: mtimes of the symbol dictionary and that year's file."""
+    return _mtime(os.path.join(out_dir, SYMBOLS_FILE)), _mtime(_year_path(day.year, out_dir))
+
+def lookup(name, day, out_dir=CONSTITUENTS_DIR):
+    """
+    {condition metric: [symbols]} behind breadth column `name` on `day` (a date), or None if the
+    date is not indexed. Only the matching column(s) of that year's file are read.
+    """
+    path = _year_path(day.year, out_dir)
+    if not os.path.exists(path):
+        return None
+    columns = components(name)
+    if not columns:
+        raise KeyError(f"{name} is not a count of a per-stock condition")
+    row = pl.read_parquet(path, columns=["Date", *columns]).filter(pl.col("Date") == day)
+    if row.is_empty():
+        return None
+    symbols = load_symbols(out_dir)
+    return {c: [symbols[i] for i in row[c][0]] for c in columns}
+
+def check(df_agg, out_dir=CONSTITUENTS_DIR):
+    """Every stored list length equals the published count for that date. Returns True if all agree."""
+    stored = [pl.read_parquet(os.path.join(out_dir, f)) for f in sorted(os.listdir(out_dir)) if f.endswith(".parquet")]
+    if not stored:
+        print("No constituent index found.")
+        return False
+    index = pl.concat(stored, how="diagonal_relaxed")
+    counted = [m.name for m in condition_metrics() if m.name in df_agg.columns and m.name in index.columns]
+    joined = index.select(["Date", *[pl.col(c).list.len().alias(c) for c in counted]]).join(
+        df_agg.select(["Date", *counted]), on="Date", suffix="_published"
+    )
+    ok = len(joined) == len(df_agg)
+    for c in counted:
+        mismatches = joined.filter(pl.col(c) != pl.col(f"{c}_published")).height
+        ok &= mismatches == 0
+        print(f"  {c:<45} {'OK' if mismatches == 0 else f'{mismatches} dates differ'}")
+    print("Index matches the published counts." if ok else "Index DIFFERS from the published counts.")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stocks behind a breadth count on a given date.")
+    parser.add_argument("metric", nargs="?", help='Breadth column, e.g. "No of stocks above 200 day SMA"')
+    parser.add_argument("date", nargs="?", type=date.fromisoformat, help="YYYY-MM-DD")
+    parser.add_argument("--check", action="store_true", help="Compare list lengths with the published metrics")
+    args = parser.parse_args()
+
+    if args.check:
+        from calculate_metrics import OUTPUT_FILE
+        raise SystemExit(0 if check(pl.read_parquet(OUTPUT_FILE)) else 1)
+    if not args.metric or not args.date:
+        parser.error("metric and date are required unless --check is given")
+    found = lookup(args.metric, args.date)
+    if found is None:
+        print(f"No index for {args.date}.")
+        raise SystemExit(1)
+    for column, symbols in found.items():
+        print(f"{column} on {args.date}: {len(symbols)} stocks")
+        print("  " + " ".join(symbols))
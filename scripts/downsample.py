@@ -0,0 +1,74 @@
+import polars as pl
+import numpy as np
+
+# Coarser levels of the breadth table for long-range charts, written next to the year shards by
+# export_data.py:
+#   weekly / monthly  mean of every column per calendar week / month, dated on the period's last trading day
+#   lttb<N>           per metric, the N points Largest-Triangle-Three-Buckets keeps. Peaks and troughs
+#                     survive, where averaging flattens them
+# A chart asks for the finest level whose points in its date range fit its width, so render time
+# stays the same however long the range is.
+AGGREGATE_LEVELS = {"weekly": "1w", "monthly": "1mo"}
+# Point budgets: a dashboard card and a full-width chart
+LTTB_POINTS = (300, 1000)
+
+def period_means(df, every):
+    """
+    Mean of every column per calendar period (polars duration string), dated on the period's last date.
+    Integer columns stay integer (rounded); non-finite floats (A/D ratio with no decliners) are skipped.
+    """
+    aggs = []
+    for name, dtype in df.schema.items():
+        if name == "Date":
+            continue
+        if dtype.is_integer():
+            aggs.append(pl.col(name).mean().round().cast(dtype))
+        else:
+            aggs.append(pl.when(pl.col(name).is_finite()).then(pl.col(name)).mean().alias(name))
+    return (
+        df.sort("Date")
+        .group_by(pl.col("Date").dt.truncate(every).alias("_period"), maintain_order=True)
+        .agg([pl.col("Date").last(), *aggs])
+        .drop("_period")
+    )
+
+def lttb(x, y, points):
+    """
+    Indices of the `points` samples Largest-Triangle-Three-Buckets keeps from (x, y), first and last
+    included. The interior is cut into points - 2 buckets; from each, the sample forming the largest
+    triangle with the previously kept one and the next bucket's average is kept.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for b in range(points - 2):
+        lo, hi = edges[b], edges[b + 1]
+        next_lo, next_hi = (edges[b + 1], edges[b + 2]) if b + 2 < len(edges) else (n - 1, n)
+        cx, cy = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[b + 1] = a
+    return keep
+
+def lttb_series(df, points):
+    """
+    {column: frame of the kept rows} for every metric column, x being the date. Each frame holds Date,
+    the metric and TotalTraded (the dashboards chart counts as % of it). None if the history already fits.
+    """
+    if len(df) <= points:
+        return None
+    df = df.sort("Date")
+    series = {}
+    for name in df.columns:
+        if name == "Date":
+            continue
+        columns = ["Date", name] + (["TotalTraded"] if "TotalTraded" in df.columns and name != "TotalTraded" else [])
+        part = df.select(columns).filter(pl.col(name).is_not_null() & pl.col(name).cast(pl.Float64).is_finite())
+        x = part["Date"].cast(pl.Int32).to_numpy().astype(np.float64)
+        y = part[name].cast(pl.Float64).to_numpy()
+        series[name] = part[lttb(x, y, points)]
+    return series
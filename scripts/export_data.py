@@ -0,0 +1,154 @@
+import polars as pl
+import json
+import math
+import os
+import hashlib
+import argparse
+
+from instrumentation import profiled
+import downsample
+
+# Year-sharded columnar export of the breadth metrics for the Next.js dashboard:
+#   data/breadth/manifest.json  column dictionary (name + type) and one entry per shard
+#   data/breadth/2024.json      {"year", "columns": [ids into the dictionary], "data": [one array per column]}
+# A shard is only rewritten when its content changes, so a daily run touches the current year's
+# shard and the manifest. The workflow copies the directory to web/public/breadth.
+# Coarser levels for long-range charts (downsample.py) cover the whole history, one file each:
+#   data/breadth/weekly.json    same layout as a shard, one row per week ("level" instead of "year")
+#   data/breadth/lttb300.json   {"level", "points", "series": {metric: {"columns", "data"}}}
+EXPORT_DIR = "data/breadth"
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+
+# EXPORT_ARROW=1 also writes an uncompressed Arrow IPC file per shard (2024.arrow)
+EXPORT_ARROW = os.environ.get("EXPORT_ARROW") == "1"
+
+def column_type(dtype):
+    if dtype == pl.Date:
+        return "date"
+    if dtype.is_integer():
+        return "int"
+    if dtype.is_float():
+        return "float"
+    raise TypeError(f"Cannot export a {dtype} column")
+
+def column_values(s):
+    if s.dtype == pl.Date:
+        return [d.isoformat() if d is not None else None for d in s.to_list()]
+    if s.dtype.is_float():
+        # JSON has no NaN / Infinity (e.g. an A/D ratio on a day with no decliners)
+        return [v if v is not None and math.isfinite(v) else None for v in s.to_list()]
+    return s.to_list()
+
+def _write_if_changed(path, text):
+    """Write text atomically unless the file already holds it. Returns True if written."""
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+@profiled("export")
+def export_breadth(df_agg, out_dir=EXPORT_DIR, arrow=EXPORT_ARROW):
+    """
+    Export the full metrics table as year shards plus a manifest.
+    Returns the paths that were (re)written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    df_agg = df_agg.sort("Date")
+    dictionary = [{"name": name, "type": column_type(dtype)} for name, dtype in df_agg.schema.items()]
+
+    written = []
+    shards = []
+    for (year,), part in df_agg.group_by(pl.col("Date").dt.year().alias("year"), maintain_order=True):
+        payload = {
+            "year": year,
+            "columns": list(range(len(dictionary))),
+            "data": [column_values(part[c]) for c in part.columns],
+        }
+        text = json.dumps(payload, separators=(",", ":"), allow_nan=False)
+        shard = {
+            "year": year,
+            "file": f"{year}.json",
+            "rows": len(part),
+            "start": part["Date"][0].isoformat(),
+            "end": part["Date"][-1].isoformat(),
+            "sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        }
+        path = os.path.join(out_dir, shard["file"])
+        changed = _write_if_changed(path, text)
+        if changed:
+            written.append(path)
+
+        if arrow:
+            shard["arrow"] = f"{year}.arrow"
+            arrow_path = os.path.join(out_dir, shard["arrow"])
+            if changed or not os.path.exists(arrow_path):
+                part.write_ipc(arrow_path, compression="uncompressed")
+                written.append(arrow_path)
+        shards.append(shard)
+
+    levels = []
+    for level, payload in _levels(df_agg, dictionary):
+        path = os.path.join(out_dir, level["file"])
+        if _write_if_changed(path, json.dumps(payload, separators=(",", ":"), allow_nan=False)):
+            written.append(path)
+        levels.append(level)
+
+    # Shards for years no longer in the table (and levels no longer written)
+    keep = {name for s in shards for name in (s["file"], s.get("arrow"))} | {level["file"] for level in levels}
+    for f in os.listdir(out_dir):
+        if f != MANIFEST_NAME and f.endswith((".json", ".arrow")) and f not in keep:
+            os.remove(os.path.join(out_dir, f))
+
+    manifest = {"version": FORMAT_VERSION, "columns": dictionary, "shards": shards, "levels": levels}
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if _write_if_changed(manifest_path, json.dumps(manifest, indent=2) + "\n"):
+        written.append(manifest_path)
+    return written
+
+def _levels(df_agg, dictionary):
+    """(manifest entry, file payload) for every downsampled level, finest first."""
+    ids = {c["name"]: i for i, c in enumerate(dictionary)}
+    for name, every in downsample.AGGREGATE_LEVELS.items():
+        part = downsample.period_means(df_agg, every)
+        payload = {"level": name, "columns": [ids[c] for c in part.columns], "data": [column_values(part[c]) for c in part.columns]}
+        yield {"name": name, "kind": "aggregate", "file": f"{name}.json", "rows": len(part)}, payload
+
+    for points in downsample.LTTB_POINTS:
+        series = downsample.lttb_series(df_agg, points)
+        if series is None:
+            # The daily series already fits this budget
+            continue
+        name = f"lttb{points}"
+        payload = {
+            "level": name,
+            "points": points,
+            "series": {
+                metric: {"columns": [ids[c] for c in part.columns], "data": [column_values(part[c]) for c in part.columns]}
+                for metric, part in series.items()
+            },
+        }
+        yield {"name": name, "kind": "lttb", "file": f"{name}.json", "rows": points}, payload
+
+def main(from_json=None, arrow=EXPORT_ARROW):
+    if from_json:
+        # One-off conversion of a row-oriented market_breadth.json
+        df_agg = pl.read_json(from_json).with_columns(pl.col("Date").str.to_date())
+    else:
+        from calculate_metrics import OUTPUT_FILE
+        df_agg = pl.read_parquet(OUTPUT_FILE)
+
+    written = export_breadth(df_agg, arrow=arrow)
+    print(f"Exported {len(df_agg)} dates to {EXPORT_DIR} ({len(written)} files changed).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the year-sharded breadth export for the dashboard.")
+    parser.add_argument("--from-json", metavar="PATH", help="Convert a row-oriented market_breadth.json instead of the metrics parquet")
+    parser.add_argument("--arrow", action="store_true", default=EXPORT_ARROW, help="Also write Arrow IPC shards")
+    args = parser.parse_args()
+    main(from_json=args.from_json, arrow=args.arrow)
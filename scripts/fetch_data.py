@@ -1,15 +1,32 @@
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
-from datetime import datetime, timedelta, date
 import os
+import threading
 import time
-import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+from trading_calendar import TradingCalendar, date_from_filename
+from raw_archive import RawArchive
+import instrumentation
+
 # Configuration
 START_DATE = datetime(2021, 1, 1) # Warm-up for 52-week highs
 END_DATE = datetime.now()
-DATA_DIR = "data/raw_bhavcopies"
+DATA_DIR = "data/raw_bhavcopies"   # loose CSVs from before the archive (see raw_archive.py import)
+STREAM_CHUNK_BYTES = 1 << 16
+
+# Base URLs can be pointed at a local stand-in server for testing
+ARCHIVE_URL = os.environ.get("BHAVCOPY_ARCHIVE_URL", "https://archives.nseindia.com/products/content")
+HOMEPAGE_URL = os.environ.get("NSE_HOMEPAGE_URL", "https://www.nseindia.com")
+
+# Concurrency / rate limiting
+MAX_WORKERS = int(os.environ.get("FETCH_WORKERS", "4"))
+RATE_LIMIT = float(os.environ.get("FETCH_RATE", "1.0"))   # sustained requests per second
+RATE_BURST = int(os.environ.get("FETCH_BURST", "4"))      # bucket capacity
+MIN_RATE = 0.1                                            # floor for adaptive backoff
+BACKOFF_SECONDS = 10                                      # pause after a 403/429
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
@@ -24,102 +41,229 @@ HEADERS = {
 
 SESSION = requests.Session()
 SESSION.headers.update(HEADERS)
+# Size the connection pool to the worker count so threads reuse keep-alive connections
+_adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+
+class RateLimitedError(Exception):
+    """Raised on 403/429 so tenacity retries the date after the limiter has backed off."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all download workers.
+    Halves its rate on 403/429 and creeps back towards the configured rate on success.
+    """
+    def __init__(self, rate, capacity, min_rate=MIN_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def backoff(self, retry_after=None):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            pause = retry_after if retry_after is not None else BACKOFF_SECONDS
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.updated = max(self.updated, self.paused_until)
+
+    def success(self):
+        with self.lock:
+            # Additive increase: recover 10% of the configured rate per success
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+
+LIMITER = TokenBucket(RATE_LIMIT, RATE_BURST)
+CALENDAR = TradingCalendar()
+# Downloads go into the monthly archives (raw_archive.py), not loose files
+ARCHIVE = RawArchive()
 
 def get_bhavcopy_url(date_obj):
     """Generate the URL for the secular bhavcopy CSV."""
     # format: sec_bhavdata_full_DDMMYYYY.csv
     date_str = date_obj.strftime("%d%m%Y")
-    return f"https://archives.nseindia.com/products/content/sec_bhavdata_full_{date_str}.csv", f"sec_bhavdata_full_{date_str}.csv"
+    return f"{ARCHIVE_URL}/sec_bhavdata_full_{date_str}.csv", f"sec_bhavdata_full_{date_str}.csv"
 
-# Retry on connection errors or 5xx server errors
-@retry(
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=4, max=20),
-    retry=retry_if_exception_type((requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError))
-)
-def download_file(date_obj):
-    url, filename = get_bhavcopy_url(date_obj)
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def classify_date(date_obj):
+    """
+    Decide whether a date needs a request at all.
+    Returns a skip message, or None if the date is unknown or expected to have data.
+    """
+    _, filename = get_bhavcopy_url(date_obj)
     local_path = os.path.join(DATA_DIR, filename)
 
+    if filename in ARCHIVE:
+        CALENDAR.record_trading_day(date_obj)
+        return f"Skipped {filename} (Archived)"
     if os.path.exists(local_path):
         # Validate file size is not empty (sometimes failed downloads leave 0kb files)
         if os.path.getsize(local_path) > 0:
+            CALENDAR.record_trading_day(date_obj)
             return f"Skipped {filename} (Exists)"
         else:
             print(f"Removed empty file {local_path}")
             os.remove(local_path)
 
-    # Optimized Weekend Skeeping:
-    # Only check weekends if they are recent (last 30 days) to catch special sessions like Budget Day.
-    # Skip older weekends to save time (NSE doesn't have data for them anyway).
+    status = CALENDAR.status(date_obj)
+    if status == "holiday":
+        return f"Skipped {date_obj.date()} (Holiday)"
+    if status == "trading":
+        # Known trading day whose file went missing locally - fetch it again
+        return None
+
+    # Unknown date. Old weekends are never trading days except for special sessions,
+    # which would already be in the calendar, so only probe recent ones.
     is_weekend = date_obj.weekday() >= 5
     is_recent = (datetime.now() - date_obj).days < 30
-    
+
     if is_weekend and not is_recent:
-         return f"Skipped {date_obj.date()} (Weekend, Old)"
+        return f"Skipped {date_obj.date()} (Weekend, Old)"
+    return None
 
-    try:
-        # NSE often blocks if no cookies are set. Visiting homepage first once might help, 
-        # but for archives usually direct link works if headers are good.
-        
-        response = SESSION.get(url, timeout=15)
-        
+# Retry on connection errors, 5xx server errors and rate limiting
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=4, max=20),
+    retry=retry_if_exception_type((requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError, RateLimitedError))
+)
+def download_file(date_obj):
+    """
+    Download the bhavcopy for one date.
+    Returns (status, message) where status is one of downloaded/skipped/missing/failed.
+    """
+    url, filename = get_bhavcopy_url(date_obj)
+
+    skip_reason = classify_date(date_obj)
+    if skip_reason is not None:
+        return "skipped", skip_reason
+
+    LIMITER.acquire()
+    # Streamed: the body is spooled in chunks while other workers download, then appended to the
+    # month's archive under that month's lock (no loose file)
+    with SESSION.get(url, timeout=15, stream=True) as response:
         if response.status_code == 200:
-            with open(local_path, "wb") as f:
-                f.write(response.content)
-            return f"Downloaded {filename}"
+            try:
+                ARCHIVE.add(filename, response.iter_content(STREAM_CHUNK_BYTES))
+            except ValueError:
+                return "failed", f"Failed {filename} (empty response)"
+            LIMITER.success()
+            CALENDAR.record_trading_day(date_obj)
+            return "downloaded", f"Downloaded {filename}"
         elif response.status_code == 404:
-            return f"Data not found for {date_obj.date()} (Holiday?)"
-        elif response.status_code == 403:
-            # If forbidden, we might be blocked. Renew session?
-            print("403 Forbidden - sleeping longer...")
-            time.sleep(10)
-            return f"Failed {filename} status 403" 
+            LIMITER.success()
+            confirmed = CALENDAR.record_holiday(date_obj)
+            return "missing", f"Data not found for {date_obj.date()} ({'Holiday' if confirmed else 'Holiday? Will retry'})"
+        elif response.status_code in (403, 429):
+            # We are being throttled. Slow every worker down, then let tenacity retry this date.
+            print(f"{response.status_code} for {filename} - backing off...")
+            LIMITER.backoff(_retry_after(response))
+            raise RateLimitedError(f"{filename} status {response.status_code}")
         else:
-            return f"Failed {filename} status {response.status_code}"
-            
-    except Exception as e:
-        raise e # Let tenacity handle it
+            return "failed", f"Failed {filename} status {response.status_code}"
+
+def download_dates(dates, max_workers=MAX_WORKERS):
+    """
+    Download all dates on a bounded thread pool sharing SESSION and LIMITER.
+    Returns a summary dict of date lists keyed by status.
+    """
+    summary = {"downloaded": [], "skipped": [], "missing": [], "failed": []}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(download_file, d): d for d in dates}
+        for fut in as_completed(futures):
+            d = futures[fut]
+            try:
+                status, msg = fut.result()
+                print(msg)
+            except Exception as e:
+                status = "failed"
+                print(f"FATAL Failed {d.date()}: {e}")
+            summary[status].append(d.date())
+
+    for dates_list in summary.values():
+        dates_list.sort()
+    return summary
+
+def print_summary(summary, elapsed):
+    print(f"Run summary ({elapsed:.1f}s):")
+    for status, dates_list in summary.items():
+        print(f"  {status:<10} {len(dates_list)}")
+    if summary["failed"]:
+        print("  Failed dates: " + ", ".join(str(d) for d in summary["failed"]))
 
 def main():
     print("Initializing robust download...")
-    
-    # Establish a clean session visit
-    try:
-        SESSION.get("https://www.nseindia.com", timeout=10)
-    except:
-        pass
 
     dates = []
     curr = START_DATE
     while curr <= END_DATE:
         dates.append(curr)
         curr += timedelta(days=1)
-    
-    print(f"Targeting {len(dates)} days...")
-    
-    # Sequential Execution for Safety
-    # NSE blocks aggressive parallel requests. 
-    # We will use a simple loop with randomized sleep.
-    
-    count = 0
+
+    # Learn trading days from files already on disk, then drop every date the
+    # calendar (or the disk) already answers so we only pay for real requests.
+    CALENDAR.sync_with_files(DATA_DIR)
+    for name in ARCHIVE.names():
+        CALENDAR.record_trading_day(date_from_filename(name))
+    pending, skipped = [], []
     for d in dates:
+        (pending if classify_date(d) is None else skipped).append(d)
+
+    print(f"Targeting {len(pending)} of {len(dates)} days with {MAX_WORKERS} workers at {RATE_LIMIT} req/s...")
+
+    # Establish a clean session visit (only worth a request if something is to be downloaded)
+    if pending:
         try:
-            res = download_file(d)
-            print(res)
-            
-            # If we actually downloaded (not skipped), sleep to be polite
-            if "Downloaded" in res:
-                time.sleep(random.uniform(1.0, 3.0)) 
-                count += 1
-            else:
-                 # If skipped (weekend/exists), minimal sleep
-                pass 
-                
-        except Exception as e:
-            print(f"FATAL Failed {d.date()}: {e}")
-            
+            SESSION.get(HOMEPAGE_URL, timeout=10)
+        except Exception:
+            pass
+
+    # NSE blocks aggressive parallel requests, so all workers draw from
+    # one token bucket that backs off on 403/429.
+    started = time.monotonic()
+    try:
+        with instrumentation.step("download", rows_in=len(pending)) as record:
+            summary = download_dates(pending)
+            record.rows_out = len(summary["downloaded"])
+    finally:
+        CALENDAR.save()
+    summary["skipped"] = sorted(summary["skipped"] + [d.date() for d in skipped])
+    print_summary(summary, time.monotonic() - started)
+
     print("Download process completed.")
+    return summary
 
 if __name__ == "__main__":
     main()
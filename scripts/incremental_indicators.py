@@ -0,0 +1,410 @@
+import polars as pl
+import os
+import math
+import pickle
+import argparse
+from collections import deque
+from datetime import timedelta
+
+from trading_calendar import date_from_filename
+
+from calculate_metrics import (
+    DISPLAY_START,
+    WARMUP_DAYS,
+    OUTPUT_FILE,
+    SEGMENTS_OUTPUT_FILE,
+    calculate_stock_indicators,
+    calculate_breadth_aggregates,
+    calculate_segment_aggregates,
+    default_indicators,
+    load_master,
+    load_segments,
+    prepare_master,
+    save_outputs,
+)
+import metrics_registry
+import master_store
+import process_data
+import constituents
+import return_distribution
+import instrumentation
+
+STATE_FILE = "data/indicator_state.pkl"
+# Bump when a kernel's dump() layout changes, so old state files are rebuilt instead of misread
+STATE_VERSION = 5
+
+# The same indicators calculate_stock_indicators() computes for a pipeline run
+INDICATORS = [metrics_registry.INDICATORS[name] for name in default_indicators()]
+INPUT_COLUMNS = sorted({ind.column for ind in INDICATORS})
+# Longest window any indicator looks back over; older rows can never matter again
+MAX_WINDOW = metrics_registry.lookback([ind.name for ind in INDICATORS])
+
+
+def _pct_change(close, base):
+    """close / base - 1 with the same null / zero-division results Polars gives."""
+    if close is None or base is None:
+        return None
+    if base == 0:
+        if close == 0 or math.isnan(close):
+            return math.nan
+        return math.copysign(math.inf, close) * math.copysign(1.0, base)
+    return close / base - 1
+
+
+class Lag:
+    """Percentage change against the value `lag` rows back (Polars shift semantics)."""
+    __slots__ = ("values",)
+
+    def __init__(self, lag):
+        self.values = deque(maxlen=lag)
+
+    def push(self, value):
+        base = self.values[0] if len(self.values) == self.values.maxlen else None
+        self.values.append(value)
+        return _pct_change(value, base)
+
+    def dump(self):
+        return list(self.values)
+
+    def restore(self, data):
+        self.values.extend(data)
+
+
+class RollingMean:
+    """
+    Ring buffer mean over the last `window` rows, summed in fixed point like calculate_metrics.py.
+    Same null rule as Polars rolling_sum: null until the window is full and while it holds a null.
+    """
+    __slots__ = ("window", "scale", "values", "nulls", "total")
+
+    def __init__(self, window, scale):
+        self.window = window
+        self.scale = scale
+        self.values = deque(maxlen=window)
+        self.nulls = 0
+        self.total = 0
+
+    def push(self, value):
+        if len(self.values) == self.window:
+            leaving = self.values[0]
+            if leaving is None:
+                self.nulls -= 1
+            else:
+                self.total -= leaving
+        if value is None:
+            self.nulls += 1
+        else:
+            value = int(round(value * self.scale))
+            self.total += value
+        self.values.append(value)
+        if len(self.values) < self.window or self.nulls:
+            return None
+        # int / int is correctly rounded, the same as the NumPy division of the exact float sum
+        return self.total / (self.window * self.scale)
+
+    def dump(self):
+        return list(self.values), self.nulls, self.total
+
+    def restore(self, data):
+        values, self.nulls, self.total = data
+        self.values.extend(values)
+
+
+class RollingExtreme:
+    """
+    Monotonic deque giving the rolling max (or min) of the last `window` rows in O(1) amortised.
+    Same null rule as RollingMean.
+    """
+    __slots__ = ("window", "is_max", "candidates", "null_rows", "rows")
+
+    def __init__(self, window, is_max):
+        self.window = window
+        self.is_max = is_max
+        self.candidates = deque()  # (row, key) with keys strictly decreasing
+        self.null_rows = deque()
+        self.rows = 0
+
+    def push(self, value):
+        row = self.rows
+        self.rows += 1
+        first = row - self.window + 1
+        while self.candidates and self.candidates[0][0] < first:
+            self.candidates.popleft()
+        while self.null_rows and self.null_rows[0] < first:
+            self.null_rows.popleft()
+
+        if value is None:
+            self.null_rows.append(row)
+        else:
+            key = value if self.is_max else -value
+            while self.candidates and self.candidates[-1][1] <= key:
+                self.candidates.pop()
+            self.candidates.append((row, key))
+
+        if self.rows < self.window or self.null_rows:
+            return None
+        key = self.candidates[0][1]
+        return key if self.is_max else -key
+
+    def dump(self):
+        return list(self.candidates), list(self.null_rows), self.rows
+
+    def restore(self, data):
+        candidates, null_rows, self.rows = data
+        self.candidates.extend(candidates)
+        self.null_rows.extend(null_rows)
+
+
+def _indicator_signature():
+    # A changed window or fixed-point scale makes the stored running sums meaningless
+    return [(ind.name, ind.op, ind.column, ind.window, ind.scale) for ind in INDICATORS]
+
+def _ingested(through):
+    """{file name: sha256} of the ingest manifest entries for dates up to `through`."""
+    entries = {}
+    for name, fp in process_data.load_manifest().items():
+        day = date_from_filename(name)
+        if day is not None and day <= through:
+            entries[name] = fp["sha256"]
+    return entries
+
+def _kernel(ind):
+    if ind.op == "pct_change":
+        return Lag(ind.window)
+    if ind.op == "rolling_mean":
+        return RollingMean(ind.window, ind.scale)
+    if ind.op in ("rolling_max", "rolling_min"):
+        return RollingExtreme(ind.window, is_max=ind.op == "rolling_max")
+    raise ValueError(f"No incremental kernel for {ind.op}")
+
+
+class SymbolState:
+    """Everything needed to produce one symbol's next indicator row from its next bhavcopy row."""
+    __slots__ = ("kernels",)
+
+    def __init__(self):
+        self.kernels = [_kernel(ind) for ind in INDICATORS]
+
+    def advance(self, row):
+        return tuple(k.push(row[ind.column]) for ind, k in zip(INDICATORS, self.kernels))
+
+    def dump(self):
+        return [k.dump() for k in self.kernels]
+
+    @classmethod
+    def restore(cls, data):
+        state = cls()
+        for k, d in zip(state.kernels, data):
+            k.restore(d)
+        return state
+
+
+class IncrementalEngine:
+    """
+    Per-symbol rolling state persisted between runs, so a new trading day costs O(symbols)
+    instead of recomputing every window over the full history.
+    """
+    def __init__(self):
+        self.symbols = {}
+        self.last_date = None
+        # Ingest manifest hashes of the dates the state covers, to notice backfills and corrections
+        self.ingested = {}
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        """Saved state, or None if it was built for a different set of indicators or kernel layout."""
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+        if payload.get("version") != STATE_VERSION or payload.get("indicators") != _indicator_signature():
+            return None
+        engine = cls()
+        engine.last_date = payload["last_date"]
+        engine.ingested = payload["ingested"]
+        engine.symbols = {sym: SymbolState.restore(data) for sym, data in payload["symbols"].items()}
+        return engine
+
+    def save(self, path=STATE_FILE):
+        # Plain builtins only, so the state loads no matter which entry point pickled it
+        self.ingested = _ingested(self.last_date)
+        payload = {
+            "version": STATE_VERSION,
+            "indicators": _indicator_signature(),
+            "last_date": self.last_date,
+            "ingested": self.ingested,
+            "symbols": {sym: state.dump() for sym, state in self.symbols.items()},
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def changed_dates(self):
+        """
+        Dates up to last_date whose bhavcopy was parsed (first time or with a new hash) after the
+        state was saved: backfills and corrections process_data merged into already-covered history.
+        """
+        current = _ingested(self.last_date)
+        return sorted({date_from_filename(name) for name, sha256 in current.items() if self.ingested.get(name) != sha256})
+
+    def _feed(self, df):
+        out = []
+        for row in df.select(["Date", "Symbol", *INPUT_COLUMNS]).iter_rows(named=True):
+            state = self.symbols.get(row["Symbol"])
+            if state is None:
+                state = self.symbols[row["Symbol"]] = SymbolState()
+            out.append((*row.values(), *state.advance(row)))
+        return out
+
+    def bootstrap(self, history):
+        """Build state from history. Only the last MAX_WINDOW rows per symbol can still matter."""
+        self.symbols = {}
+        tail = (
+            history.sort(["Symbol", "Date"])
+            .group_by("Symbol", maintain_order=True)
+            .tail(MAX_WINDOW)
+        )
+        self._feed(tail)
+        self.last_date = history["Date"].max()
+
+    def advance_day(self, day_df):
+        """Advance every symbol that traded on one new date and return that date's indicator rows."""
+        out = self._feed(day_df.sort("Symbol"))
+        self.last_date = day_df["Date"].max()
+        schema = {"Date": pl.Date, "Symbol": pl.Utf8}
+        schema.update({c: pl.Float64 for c in INPUT_COLUMNS})
+        schema.update({ind.name: pl.Float64 for ind in INDICATORS})
+        return pl.DataFrame(out, schema=schema, orient="row")
+
+    def advance(self, new_rows):
+        """Advance through every date in new_rows in order; returns the stacked indicator rows."""
+        days = [self.advance_day(day) for _, day in new_rows.group_by("Date", maintain_order=True)]
+        return pl.concat(days) if days else None
+
+
+def rebuild():
+    """Full recompute of the metrics, then seed the incremental state from the same history."""
+    df = load_master(start=DISPLAY_START - timedelta(days=WARMUP_DAYS))
+    print(f"Loaded {len(df)} rows.")
+    df_ind = calculate_stock_indicators(df)
+    constituents.update(df_ind, start=DISPLAY_START, replace=True)
+    return_distribution.update(df_ind, start=DISPLAY_START, replace=True)
+    save_outputs(calculate_breadth_aggregates(df_ind), calculate_segment_aggregates(df_ind, load_segments()))
+    del df_ind
+
+    with instrumentation.step("bootstrap_state", rows_in=len(df)):
+        engine = IncrementalEngine()
+        engine.bootstrap(df)
+        engine.save()
+    print(f"Indicator state for {len(engine.symbols)} symbols saved to {STATE_FILE}.")
+
+def _replace_dates(path, new, key):
+    """Stored rows of `path` with new's dates replaced by new, sorted by `key`."""
+    existing = pl.read_parquet(path).filter(~pl.col("Date").is_in(new["Date"].unique().implode()))
+    return pl.concat([existing, new]).sort(key)
+
+def run(new_rows=None):
+    """
+    Append aggregate rows for dates newer than the saved state.
+    new_rows: master rows already in memory (e.g. handed over by the pipeline runner) instead of
+    reading them back from the store.
+    Files parsed for dates the state has already passed (backfills, corrected re-downloads) cannot be
+    replayed into the rolling state, so they trigger a full rebuild.
+    """
+    if not all(os.path.exists(p) for p in (STATE_FILE, OUTPUT_FILE, SEGMENTS_OUTPUT_FILE)):
+        print("No indicator state yet. Bootstrapping from a full recompute...")
+        rebuild()
+        return
+
+    with instrumentation.step("load_state"):
+        engine = IncrementalEngine.load()
+    if engine is None:
+        print("Indicator set or state format changed since the state was saved. Rebuilding...")
+        rebuild()
+        return
+    changed = engine.changed_dates()
+    if changed:
+        print(f"{len(changed)} date(s) up to {engine.last_date} were backfilled or corrected "
+              f"since the metrics ran (earliest {changed[0]}). Rebuilding...")
+        rebuild()
+        return
+    start = engine.last_date + timedelta(days=1)
+    if new_rows is not None:
+        new_rows = prepare_master(new_rows).filter(pl.col("Date") >= start)
+        # The hand-off only covers files parsed this run; dates stored by an earlier run whose
+        # metrics never ran (Date-only scan) mean the store has to be read after all
+        stored = master_store.scan_master(start=start).select(pl.col("Date").unique()).collect()["Date"]
+        if stored.is_in(new_rows["Date"].unique().implode()).all():
+            print(f"Using {len(new_rows)} new rows handed over in memory.")
+        else:
+            new_rows = None
+    if new_rows is None:
+        new_rows = load_master(start=start)
+    new_rows = new_rows.sort("Date")
+    if new_rows.is_empty():
+        print(f"Metrics are up to date ({engine.last_date}).")
+        return
+
+    print(f"Advancing {len(engine.symbols)} symbols through {new_rows['Date'].n_unique()} new day(s)...")
+    with instrumentation.step("advance", rows_in=len(new_rows)) as record:
+        new_ind = engine.advance(new_rows)
+        record.rows_out = len(new_ind)
+    df_agg = _replace_dates(OUTPUT_FILE, calculate_breadth_aggregates(new_ind), "Date")
+    df_seg = _replace_dates(SEGMENTS_OUTPUT_FILE, calculate_segment_aggregates(new_ind, load_segments()), ["Date", "Segment"])
+
+    # The indexes first: the metrics files are the version readers key on, so they are written last
+    constituents.update(new_ind, start=DISPLAY_START)
+    return_distribution.update(new_ind, start=DISPLAY_START)
+    save_outputs(df_agg, df_seg)
+    with instrumentation.step("save_state"):
+        engine.save()
+    print("Done.")
+
+def verify(days=20):
+    """
+    Seed the engine with everything but the last `days` dates, advance through those dates
+    incrementally and check the aggregates equal a full recompute. Returns True on an exact match.
+    """
+    df = load_master(start=DISPLAY_START - timedelta(days=WARMUP_DAYS))
+    dates = df["Date"].unique().sort()
+    split = dates[-days] if len(dates) >= days else dates[0]
+
+    engine = IncrementalEngine()
+    engine.bootstrap(df.filter(pl.col("Date") < split))
+    inc_ind = engine.advance(df.filter(pl.col("Date") >= split).sort("Date"))
+    full_ind = calculate_stock_indicators(df).filter(pl.col("Date") >= split)
+
+    membership = load_segments()
+    incremental = calculate_breadth_aggregates(inc_ind)
+    full = calculate_breadth_aggregates(full_ind)
+    segments_ok = calculate_segment_aggregates(inc_ind, membership).equals(
+        calculate_segment_aggregates(full_ind.with_columns(pl.col("Symbol").cast(pl.Utf8)), membership)
+    )
+
+    print(f"Incremental vs full recompute over {len(full)} dates from {split}:")
+    if full["Date"].to_list() != incremental["Date"].to_list():
+        print("Date index differs.")
+        return False
+
+    ok = True
+    for col in full.columns:
+        mismatches = full[col].ne_missing(incremental[col]).sum()
+        ok = ok and mismatches == 0
+        print(f"  {col:<45} {'OK' if mismatches == 0 else f'{mismatches} dates differ'}")
+    print(f"  {'Segment aggregates':<45} {'OK' if segments_ok else 'differ'}")
+    ok = ok and segments_ok
+    print("Exact match." if ok else "MISMATCH against full recompute.")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append new days to the breadth metrics from persisted rolling state.")
+    parser.add_argument("--rebuild", action="store_true", help="Full recompute and re-seed the state")
+    parser.add_argument("--verify", type=int, nargs="?", const=20, metavar="DAYS",
+                        help="Check the last DAYS incremental rows against a full recompute")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(0 if verify(args.verify) else 1)
+    elif args.rebuild:
+        rebuild()
+    else:
+        run()
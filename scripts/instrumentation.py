@@ -0,0 +1,268 @@
+import polars as pl
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+# Per-stage profiling for the pipeline. Every step records wall time, CPU time, RSS, rows in / out
+# and bytes read / written; pipeline.py writes the run to:
+#   data/run_report.json    the latest run, one entry per stage and sub-step
+#   data/run_reports.parquet one row per step for the last HISTORY_RUNS runs, for regression tracking
+# Steps nest: a sub-step opened inside the "metrics" stage is recorded as "metrics/indicators".
+REPORT_FILE = "data/run_report.json"
+HISTORY_FILE = "data/run_reports.parquet"
+HISTORY_RUNS = 365
+
+# PROFILE_POLARS=1 (or pipeline.py run --profile-polars) dumps the optimized plan of every
+# instrumented lazy query to data/profiles/, plus per-node timings where Polars has LazyFrame.profile
+PROFILE_POLARS = os.environ.get("PROFILE_POLARS") == "1"
+PROFILE_DIR = "data/profiles"
+
+# A step is this much slower than the median of earlier runs before `compare` flags it
+REGRESSION_RATIO = 1.5
+
+_steps = []   # finished steps of the current run, in completion order
+_stack = []   # names of the steps currently open
+_run = {}
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def rss_mb():
+    """Current resident set size (None where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+def _io_bytes():
+    """
+    (read, written) bytes through read()/write() syscalls so far, files and sockets alike.
+    Memory-mapped reads (Polars' parquet / IPC scans) are not counted. None off Linux.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class Step:
+    """One timed step. Callers fill rows_in / rows_out; everything else is measured."""
+    def __init__(self, name):
+        self.name = "/".join(_stack + [name])
+        self.depth = len(_stack)
+        self.seq = len(_steps) + len(_stack)  # start order, so a report lists parents before children
+        self.status = "ok"
+        self.rows_in = None
+        self.rows_out = None
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.rss_mb = None
+        self.peak_rss_mb = None
+        self.peak_rss_growth_mb = 0.0
+        self.bytes_read = None
+        self.bytes_written = None
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def start_run():
+    """Forget the steps of any earlier run in this process."""
+    _steps.clear()
+    _stack.clear()
+    _run.clear()
+    _run.update(started=datetime.now().isoformat(timespec="seconds"), clock=time.perf_counter())
+
+@contextmanager
+def step(name, rows_in=None):
+    """Time the enclosed block as a (sub-)step. Yields the Step so the block can set rows_out."""
+    record = Step(name)
+    record.rows_in = rows_in
+    io_before = _io_bytes()
+    peak_before = peak_rss_mb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    _stack.append(name)
+    try:
+        yield record
+    except BaseException:
+        record.status = "failed"
+        raise
+    finally:
+        _stack.pop()
+        record.wall_s = time.perf_counter() - started
+        # process_time covers every thread, so a parallel Polars step can show cpu_s > wall_s
+        record.cpu_s = time.process_time() - cpu_before
+        record.rss_mb = rss_mb()
+        record.peak_rss_mb = peak_rss_mb()
+        # Non-zero only for the step that pushed the process high-water mark up
+        record.peak_rss_growth_mb = record.peak_rss_mb - peak_before
+        io_after = _io_bytes()
+        if io_before is not None and io_after is not None:
+            record.bytes_read = io_after[0] - io_before[0]
+            record.bytes_written = io_after[1] - io_before[1]
+        _steps.append(record)
+
+def skipped(name):
+    """Record a step that did not run (e.g. a pipeline stage with unchanged inputs)."""
+    record = Step(name)
+    record.status = "skipped"
+    _steps.append(record)
+    return record
+
+def rows_of(value):
+    """Row count of a DataFrame (or of the first frame in a tuple); None for anything else."""
+    if isinstance(value, pl.DataFrame):
+        return len(value)
+    if isinstance(value, tuple) and value and isinstance(value[0], pl.DataFrame):
+        return len(value[0])
+    return None
+
+def profiled(name):
+    """
+    Decorator form of step(). rows_in / rows_out are taken from a DataFrame first argument and
+    a DataFrame (or tuple starting with one) return value.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with step(name, rows_in=rows_of(args[0]) if args else None) as record:
+                result = fn(*args, **kwargs)
+                record.rows_out = rows_of(result)
+                return result
+        return wrapper
+    return decorate
+
+def collect(lf, name):
+    """
+    lf.collect(), and with PROFILE_POLARS the query plan (and node timings, where supported)
+    saved under PROFILE_DIR as <step path>.<name>.
+    """
+    if not PROFILE_POLARS:
+        return lf.collect()
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, ".".join(_stack + [name]))
+    with open(base + ".plan.txt", "w") as f:
+        f.write(lf.explain() + "\n")
+    if hasattr(lf, "profile"):
+        df, timings = lf.profile()
+        timings.write_parquet(base + ".timings.parquet")
+        return df
+    with step(f"collect:{name}") as record:
+        df = lf.collect()
+        record.rows_out = len(df)
+    return df
+
+def report():
+    """The current run as a dict: run metadata plus every recorded step."""
+    return {
+        "started": _run.get("started"),
+        "wall_s": round(time.perf_counter() - _run["clock"], 3) if _run else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "polars_version": pl.__version__,
+        "polars_threads": pl.thread_pool_size(),
+        "steps": [s.to_dict() for s in _steps],
+    }
+
+def write_report(path=REPORT_FILE, history_path=HISTORY_FILE):
+    """Write the latest-run JSON and append its steps to the parquet history."""
+    run = report()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(run, f, indent=2)
+    os.replace(tmp_path, path)
+
+    if not run["steps"]:
+        return run
+    rows = pl.DataFrame(run["steps"], infer_schema_length=None).with_columns(
+        pl.lit(run["started"]).str.to_datetime().alias("run_started")
+    )
+    if os.path.exists(history_path):
+        history = pl.read_parquet(history_path)
+        keep = history["run_started"].unique().sort().tail(HISTORY_RUNS - 1).implode()
+        rows = pl.concat([history.filter(pl.col("run_started").is_in(keep)), rows], how="diagonal_relaxed")
+    tmp_path = history_path + ".tmp"
+    rows.write_parquet(tmp_path)
+    os.replace(tmp_path, history_path)
+    return run
+
+def print_steps(steps=None):
+    steps = [s.to_dict() for s in _steps] if steps is None else steps
+    print(f"  {'step':<36} {'status':<8} {'wall s':>8} {'cpu s':>8} {'peak MB':>8} {'rows out':>10} {'MB read':>8} {'MB written':>10}")
+    mb = lambda b: f"{b / 1e6:.1f}" if b is not None else "-"
+    for s in sorted(steps, key=lambda s: s["seq"]):
+        rows = f"{s['rows_out']:,}" if s["rows_out"] is not None else "-"
+        peak = f"{s['peak_rss_mb']:.0f}" if s["peak_rss_mb"] is not None else "-"
+        print(
+            f"  {'  ' * s['depth'] + s['name'].split('/')[-1]:<36} {s['status']:<8} {s['wall_s']:8.2f} {s['cpu_s']:8.2f}"
+            f" {peak:>8} {rows:>10} {mb(s['bytes_read']):>8} {mb(s['bytes_written']):>10}"
+        )
+
+def compare(history_path=HISTORY_FILE, runs=30):
+    """
+    Wall time of every step of the latest run against its median over up to `runs` earlier runs.
+    Returns the names of steps slower than REGRESSION_RATIO x their median.
+    """
+    if not os.path.exists(history_path):
+        print(f"No run history at {history_path}. Run scripts/pipeline.py first.")
+        return []
+    history = pl.read_parquet(history_path).filter(pl.col("status") == "ok")
+    starts = history["run_started"].unique().sort()
+    if len(starts) < 2:
+        print("Only one run recorded so far; nothing to compare against.")
+        return []
+    latest, earlier = starts[-1], starts.slice(max(len(starts) - 1 - runs, 0), min(runs, len(starts) - 1))
+
+    baseline = (
+        history.filter(pl.col("run_started").is_in(earlier.implode()))
+        .group_by("name")
+        .agg(pl.col("wall_s").median().alias("median_s"))
+    )
+    table = (
+        history.filter(pl.col("run_started") == latest)
+        .join(baseline, on="name", how="left")
+        .with_columns((pl.col("wall_s") / pl.col("median_s")).alias("ratio"))
+        .sort("seq")
+    )
+
+    print(f"Run {latest} against the median of {len(earlier)} earlier run(s):")
+    print(f"  {'step':<36} {'wall s':>8} {'median s':>9} {'ratio':>6}")
+    regressions = []
+    for row in table.iter_rows(named=True):
+        flag = ""
+        # Sub-second steps are dominated by noise
+        if row["ratio"] is not None and row["ratio"] > REGRESSION_RATIO and row["wall_s"] >= 1.0:
+            flag = "  SLOWER"
+            regressions.append(row["name"])
+        median = f"{row['median_s']:9.2f}" if row["median_s"] is not None else f"{'-':>9}"
+        ratio = f"{row['ratio']:6.2f}" if row["ratio"] is not None else f"{'new':>6}"
+        print(f"  {'  ' * row['depth'] + row['name'].split('/')[-1]:<36} {row['wall_s']:8.2f} {median} {ratio}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the pipeline run reports.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("show", help=f"Print the latest run report ({REPORT_FILE})")
+    p = sub.add_parser("compare", help="Compare the latest run with the median of earlier runs")
+    p.add_argument("--runs", type=int, default=30, help="Earlier runs in the baseline (default 30)")
+
+    args = parser.parse_args()
+    if args.command == "show":
+        with open(REPORT_FILE) as f:
+            run = json.load(f)
+        print(f"Run {run['started']}: {run['wall_s']:.1f}s, peak RSS {run['peak_rss_mb']:.0f} MB")
+        print_steps(run["steps"])
+    elif args.command == "compare":
+        raise SystemExit(1 if compare(runs=args.runs) else 0)
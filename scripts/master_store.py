@@ -0,0 +1,139 @@
+import polars as pl
+import os
+import shutil
+from datetime import datetime
+
+# Hive-style layout: data/master_bhavcopy/year=2024/month=03/data.parquet
+MASTER_DIR = "data/master_bhavcopy"
+LEGACY_FILE = "data/master_bhavcopy.parquet"
+ROW_GROUP_SIZE = 50_000
+
+# Opt-in compact representation (COMPACT_SCHEMA=1), for the stored parquet and the in-memory frame:
+# - Symbol as Categorical (one shared dictionary, u32 keys for over("Symbol") hashing)
+# - Series as Enum
+# - prices as Int32 paise and Volume as Int64
+# Prices are fixed point rather than Float32 on purpose. paise / 100 decodes to exactly the Float64
+# the CSV parse produced, so breadth counts are bit-for-bit unchanged. Float32 moves prices sitting on
+# the 4.5% / SMA thresholds across them (see calculate_metrics.py --check-compact).
+COMPACT = os.environ.get("COMPACT_SCHEMA") == "1"
+SERIES_ENUM = pl.Enum(["EQ", "BE"])
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "PrevClose"]
+
+def is_compact(schema):
+    return schema["Close"] == pl.Int32
+
+def _paise_to_rupees(s):
+    # Polars divides by a constant via its reciprocal, which is off by an ulp for ~13% of prices.
+    # NumPy's true division is correctly rounded, so it reproduces the parsed CSV value exactly.
+    return pl.Series(s.name, s.cast(pl.Float64).to_numpy() / 100, nan_to_null=True)
+
+def _decode(c):
+    return pl.col(c).map_batches(_paise_to_rupees, return_dtype=pl.Float64)
+
+def to_compact(df):
+    """Convert a master frame to the compact storage schema (no-op if it already is)."""
+    if is_compact(df.collect_schema()):
+        return df
+    return df.with_columns(
+        pl.col("Symbol").cast(pl.Categorical),
+        pl.col("Series").cast(SERIES_ENUM),
+        *[(pl.col(c) * 100).round().cast(pl.Int32) for c in PRICE_COLUMNS],
+        pl.col("Volume").round().cast(pl.Int64),
+        pl.col("Turnover").cast(pl.Float32),
+    )
+
+def to_full(df):
+    """Convert a master frame back to the original Utf8 / Float64 schema (no-op if it already is)."""
+    if not is_compact(df.collect_schema()):
+        return df
+    return df.with_columns(
+        pl.col("Symbol").cast(pl.Utf8),
+        pl.col("Series").cast(pl.Utf8),
+        *[_decode(c) for c in PRICE_COLUMNS],
+        pl.col("Volume").cast(pl.Float64),
+        pl.col("Turnover").cast(pl.Float64),
+    )
+
+def decode_prices(df):
+    """Float64 rupee prices for the indicator maths, keeping the compact Symbol/Series/Volume types."""
+    if not is_compact(df.collect_schema()):
+        return df
+    return df.with_columns([_decode(c) for c in PRICE_COLUMNS])
+
+def stored_is_compact():
+    """Schema of the stored master (None if there is no store yet)."""
+    for root, _, files in os.walk(MASTER_DIR):
+        for f in files:
+            if f.endswith(".parquet"):
+                return is_compact(pl.read_parquet_schema(os.path.join(root, f)))
+    return None
+
+def partition_path(year, month):
+    return os.path.join(MASTER_DIR, f"year={year}", f"month={month:02d}", "data.parquet")
+
+def exists():
+    return os.path.isdir(MASTER_DIR) and any(
+        f.endswith(".parquet") for _, _, files in os.walk(MASTER_DIR) for f in files
+    )
+
+def _write_partition(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Sorted by Date then Symbol so each row group has tight Date/Symbol min-max statistics
+    df = df.sort(["Date", "Symbol"])
+    tmp_path = path + ".tmp"
+    df.write_parquet(tmp_path, statistics=True, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+def write_partitions(df, replace=False):
+    """
+    Merge df into the store, rewriting only the year/month partitions it touches.
+    Dates present in df replace the same dates already stored.
+    With replace=True the whole store is rebuilt from df.
+    """
+    if replace and os.path.isdir(MASTER_DIR):
+        shutil.rmtree(MASTER_DIR)
+
+    keyed = df.with_columns(
+        pl.col("Date").dt.year().alias("_year"),
+        pl.col("Date").dt.month().alias("_month"),
+    )
+    written = []
+    for (year, month), part in keyed.group_by(["_year", "_month"]):
+        part = part.drop(["_year", "_month"])
+        path = partition_path(year, month)
+        if os.path.exists(path):
+            existing = pl.read_parquet(path)
+            existing = to_compact(existing) if is_compact(part.schema) else to_full(existing)
+            existing = existing.filter(~pl.col("Date").is_in(part["Date"].unique().implode()))
+            part = pl.concat([existing, part])
+        _write_partition(part, path)
+        written.append(path)
+    return sorted(written)
+
+def scan_master(start=None, end=None):
+    """
+    Lazily scan the partitioned master, pruning partitions and row groups outside [start, end].
+    """
+    lf = pl.scan_parquet(os.path.join(MASTER_DIR, "**", "*.parquet"), hive_partitioning=True)
+    if start is not None:
+        start = start.date() if isinstance(start, datetime) else start
+        lf = lf.filter((pl.col("year") >= start.year) & (pl.col("Date") >= start))
+    if end is not None:
+        end = end.date() if isinstance(end, datetime) else end
+        lf = lf.filter((pl.col("year") <= end.year) & (pl.col("Date") <= end))
+    return lf.drop(["year", "month"])
+
+def migrate_single_file(legacy_file=LEGACY_FILE):
+    """One-shot migration of the old monolithic master_bhavcopy.parquet into the partitioned store."""
+    print(f"Migrating {legacy_file} into {MASTER_DIR}...")
+    df = pl.read_parquet(legacy_file)
+    if COMPACT:
+        df = to_compact(df)
+    written = write_partitions(df, replace=True)
+
+    migrated_rows = scan_master().select(pl.len()).collect().item()
+    if migrated_rows != len(df):
+        raise RuntimeError(f"Migration row count mismatch: {migrated_rows} != {len(df)}")
+
+    os.replace(legacy_file, legacy_file + ".migrated")
+    print(f"Wrote {len(written)} partitions ({migrated_rows} rows). Old file kept as {legacy_file}.migrated")
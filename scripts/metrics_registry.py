@@ -0,0 +1,172 @@
+import polars as pl
+import json
+import os
+from dataclasses import dataclass
+
+# Single declaration of every per-stock indicator and every breadth metric.
+# calculate_metrics.py compiles the selected metrics into one group_by("Date").agg plan and only
+# computes the indicators they depend on; app.py and the web METRIC_CONFIG read names, colours
+# and formats from here instead of repeating the column names.
+
+WEB_CONFIG_FILE = "web/src/lib/metric_config.json"
+
+
+@dataclass(eq=False)
+class Indicator:
+    """A per-stock window indicator, evaluated per symbol in date order."""
+    name: str
+    op: str        # "pct_change" | "rolling_mean" | "rolling_max" | "rolling_min"
+    column: str
+    window: int    # lag for pct_change, rows for rolling ops
+    scale: int = 100   # rolling_mean: sums run on round(value * scale) integers (paise for prices)
+
+
+@dataclass(eq=False)
+class Metric:
+    """
+    One breadth column.
+    Base metrics aggregate stock rows per date: `condition` is counted, or `agg` is used as is.
+    Derived metrics (`formula`) combine other metrics after aggregation.
+    """
+    name: str
+    condition: pl.Expr = None
+    agg: pl.Expr = None
+    formula: pl.Expr = None
+    requires: tuple = ()                  # indicator names (base) or metric names (derived)
+    sentiment: str = None                 # good / bad / diverging - colour direction in the dashboards
+    format: str = "int"                   # int / float / pct
+    display: bool = True                  # False for helper columns that are not exported
+
+    @property
+    def is_derived(self):
+        return self.formula is not None
+
+    def aggregation(self):
+        expr = self.agg if self.agg is not None else self.condition.sum()
+        return expr.alias(self.name)
+
+
+INDICATORS = {i.name: i for i in [
+    Indicator("PctChange1D", "pct_change", "Close", 1),
+    Indicator("PctChange5D", "pct_change", "Close", 5),
+    Indicator("PctChange20D", "pct_change", "Close", 20),
+    Indicator("SMA20", "rolling_mean", "Close", 20),
+    Indicator("SMA50", "rolling_mean", "Close", 50),
+    Indicator("SMA100", "rolling_mean", "Close", 100),
+    Indicator("SMA200", "rolling_mean", "Close", 200),
+    # 52 Week High/Low (approx 252 trading days)
+    Indicator("High52W", "rolling_max", "High", 252),
+    Indicator("Low52W", "rolling_min", "Low", 252),
+    # Volume Spike
+    Indicator("AvgVol20", "rolling_mean", "Volume", 20, scale=1),
+    # Liquidity ranking for the segmented breadth. Turnover is TURNOVER_LACS (lakhs of rupees), so the
+    # sums run on hundredths of a lakh; whole lakhs would round every stock under 0.5 lakh/day to 0
+    Indicator("AvgTurnover20", "rolling_mean", "Turnover", 20),
+]}
+
+_c = pl.col
+
+METRICS = [
+    Metric("No. of stocks up 4.5%+ in the current day", _c("PctChange1D") >= 0.045, requires=("PctChange1D",), sentiment="good"),
+    Metric("No. of stocs down 4.5%+ in the current day", _c("PctChange1D") <= -0.045, requires=("PctChange1D",), sentiment="bad"),
+    Metric("No. of stocks up 20%+ in 5 days", _c("PctChange5D") >= 0.20, requires=("PctChange5D",), sentiment="good"),
+    Metric("No. of stocks down 20%+ in 5 days", _c("PctChange5D") <= -0.20, requires=("PctChange5D",), sentiment="bad"),
+    Metric("No of stocks above 200 day SMA", _c("Close") > _c("SMA200"), requires=("SMA200",), sentiment="good"),
+    Metric("No of stocks above 50 day SMA", _c("Close") > _c("SMA50"), requires=("SMA50",), sentiment="good"),
+    Metric("No of stocks above 20 day SMA", _c("Close") > _c("SMA20").fill_null(0), requires=("SMA20",), sentiment="good"),
+    Metric("No of stocks which are positive", _c("PctChange1D") > 0, requires=("PctChange1D",), sentiment="good"),
+    Metric("No of stocks which are negative", _c("PctChange1D") < 0, requires=("PctChange1D",), sentiment="bad"),
+
+    # Strictly speaking, "New High" is when High >= High52W (the window includes today)
+    Metric("New52W_Highs", _c("High") >= _c("High52W"), requires=("High52W",), display=False),
+    Metric("New52W_Lows", _c("Low") <= _c("Low52W"), requires=("Low52W",), display=False),
+
+    Metric("Advance/Decline Ratio",
+           formula=_c("No of stocks which are positive") / _c("No of stocks which are negative"),
+           requires=("No of stocks which are positive", "No of stocks which are negative"),
+           sentiment="diverging", format="float"),
+    Metric("Net New Highs",
+           formula=_c("New52W_Highs").cast(pl.Int64) - _c("New52W_Lows").cast(pl.Int64),
+           requires=("New52W_Highs", "New52W_Lows"), sentiment="diverging"),
+    Metric("Net New 52-Week Highs as % of Total Stocks",
+           formula=(_c("New52W_Highs").cast(pl.Int64) - _c("New52W_Lows").cast(pl.Int64)) / _c("TotalTraded") * 100,
+           requires=("New52W_Highs", "New52W_Lows", "TotalTraded"), sentiment="diverging", format="pct"),
+
+    # In-house metrics
+    Metric("No of stocks above 100 day SMA", _c("Close") > _c("SMA100"), requires=("SMA100",), sentiment="good"),
+    Metric("No. of stocks up 10%+ in 20 days", _c("PctChange20D") >= 0.10, requires=("PctChange20D",), sentiment="good"),
+
+    Metric("TotalTraded", agg=pl.len()),
+]
+
+BY_NAME = {m.name: m for m in METRICS}
+
+
+def get(name):
+    try:
+        return BY_NAME[name]
+    except KeyError:
+        raise KeyError(f"Unknown breadth metric: {name}") from None
+
+def resolve(names=None):
+    """
+    The selected metrics plus every metric they depend on, in registry order.
+    names=None selects every displayed metric.
+    """
+    wanted = set()
+    stack = [m.name for m in METRICS if m.display] if names is None else list(names)
+    while stack:
+        m = get(stack.pop())
+        if m.name in wanted:
+            continue
+        wanted.add(m.name)
+        if m.is_derived:
+            stack.extend(m.requires)
+    return [m for m in METRICS if m.name in wanted]
+
+def required_indicators(names=None):
+    """Indicator names needed by the selected metrics."""
+    needed = {r for m in resolve(names) if not m.is_derived for r in m.requires}
+    return [name for name in INDICATORS if name in needed]
+
+def lookback(indicators):
+    """Rows per symbol an indicator value can depend on (the current row included)."""
+    return max(INDICATORS[name].window + (INDICATORS[name].op == "pct_change") for name in indicators)
+
+def output_columns(names=None):
+    """Exported column order: the selected displayed metrics in registry order."""
+    selected = set(names) if names is not None else None
+    return [m.name for m in METRICS if m.display and (selected is None or m.name in selected)]
+
+def build_aggregation(names=None, by="Date"):
+    """
+    Compile the selected metrics into one fused group_by(by).agg pass plus the derived columns.
+    Returns a function frame -> aggregated frame.
+    """
+    metrics = resolve(names)
+    base = [m.aggregation() for m in metrics if not m.is_derived]
+    derived = [m for m in metrics if m.is_derived]
+    columns = output_columns(names)
+    keys = [by] if isinstance(by, str) else list(by)
+
+    def run(df):
+        out = df.group_by(keys).agg(base)
+        # Registry order guarantees a derived metric comes after everything it uses
+        for m in derived:
+            out = out.with_columns(m.formula.alias(m.name))
+        return out.select(keys + columns)
+    return run
+
+def web_config():
+    """METRIC_CONFIG for the Next.js dashboard: every displayed metric that has a colour direction."""
+    return {m.name: {"type": m.sentiment, "format": m.format} for m in METRICS if m.display and m.sentiment}
+
+def write_web_config(path=WEB_CONFIG_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(web_config(), f, indent=2)
+        f.write("\n")
+
+if __name__ == "__main__":
+    write_web_config()
+    print(f"Wrote {WEB_CONFIG_FILE}")
@@ -0,0 +1,196 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+
+import fetch_data
+import process_data
+import raw_archive
+import incremental_indicators
+import master_store
+import metrics_registry
+import export_data
+import calculate_metrics
+import instrumentation
+
+# Single-process runner for the nightly pipeline: fetch -> process -> metrics -> publish.
+# Stages hand their output to the next one in memory (the newly parsed rows go straight to the
+# incremental metrics) and are skipped when the fingerprint of their inputs matches the last
+# successful run, so a night without new data costs one calendar check and a few stat() calls.
+# Every stage and its sub-steps are profiled into data/run_report.json (see instrumentation.py).
+STATE_FILE = "data/pipeline_state.json"
+PUBLISH_DIR = "web/public/breadth"
+
+
+def _content_fingerprint(paths, memo):
+    """
+    Hash of (path, content hash) for every path; a missing file hashes as missing.
+    Content hashes rather than mtimes, so a fresh CI checkout of unchanged data still matches.
+    memo (path -> process_data.file_fingerprint entry) avoids re-hashing files whose size and mtime match.
+    """
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        if not os.path.exists(path):
+            memo.pop(path, None)
+            h.update(f"{path}\0missing\n".encode())
+            continue
+        memo[path] = process_data.file_fingerprint(path, memo.get(path))
+        h.update(f"{path}\0{memo[path]['sha256']}\n".encode())
+    return h.hexdigest()
+
+def _files(root, suffix):
+    return [os.path.join(d, f) for d, _, files in os.walk(root) for f in files if f.endswith(suffix)]
+
+def _registry_signature():
+    # A changed metric or indicator definition must recompute even if the store did not change
+    return ";".join(
+        [f"{i.name}:{i.op}:{i.column}:{i.window}:{i.scale}" for i in metrics_registry.INDICATORS.values()]
+        + [m.name for m in metrics_registry.METRICS]
+    )
+
+
+class Stage:
+    def __init__(self, name, run, fingerprint=None, outputs=()):
+        self.name = name
+        self.run = run                  # fn(results, options) -> output handed to later stages
+        self.fingerprint = fingerprint  # fn(memo) -> str, or None to always run
+        self.outputs = outputs          # files that must exist for a skip to be valid
+
+
+def _fetch(results, options):
+    return fetch_data.main()
+
+def _process(results, options):
+    return process_data.main(full=options.full)
+
+def _metrics(results, options):
+    if options.full:
+        incremental_indicators.rebuild()
+        return None
+    return incremental_indicators.run(new_rows=results.get("process"))
+
+def _publish(results, options):
+    """Mirror the year-sharded export into the Next.js public folder, copying only changed files."""
+    os.makedirs(PUBLISH_DIR, exist_ok=True)
+    source = set(os.listdir(export_data.EXPORT_DIR))
+    copied = []
+    for name in sorted(source):
+        src, dst = os.path.join(export_data.EXPORT_DIR, name), os.path.join(PUBLISH_DIR, name)
+        if os.path.exists(dst):
+            with open(src, "rb") as a, open(dst, "rb") as b:
+                if a.read() == b.read():
+                    continue
+        shutil.copyfile(src, dst)
+        copied.append(name)
+    for name in set(os.listdir(PUBLISH_DIR)) - source:
+        os.remove(os.path.join(PUBLISH_DIR, name))
+    print(f"Published {len(copied)} changed file(s) to {PUBLISH_DIR}.")
+    return copied
+
+
+STAGES = [
+    Stage("fetch", _fetch),
+    Stage(
+        "process", _process,
+        fingerprint=lambda memo: _content_fingerprint(
+            _files(fetch_data.DATA_DIR, ".csv") + _files(raw_archive.ARCHIVE_DIR, ".zip"), memo
+        ),
+        outputs=(process_data.MANIFEST_FILE,),
+    ),
+    Stage(
+        "metrics", _metrics,
+        fingerprint=lambda memo: _content_fingerprint(
+            _files(master_store.MASTER_DIR, ".parquet") + [calculate_metrics.SEGMENTS_FILE], memo
+        ) + _registry_signature(),
+        outputs=(calculate_metrics.OUTPUT_FILE, calculate_metrics.SEGMENTS_OUTPUT_FILE, incremental_indicators.STATE_FILE),
+    ),
+    Stage(
+        "publish", _publish,
+        fingerprint=lambda memo: _content_fingerprint(_files(export_data.EXPORT_DIR, ""), memo),
+        outputs=(os.path.join(PUBLISH_DIR, export_data.MANIFEST_NAME),),
+    ),
+]
+STAGE_NAMES = [s.name for s in STAGES]
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path=STATE_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def selected_stages(from_stage=None, only_stage=None):
+    if only_stage:
+        return [s for s in STAGES if s.name == only_stage]
+    start = STAGE_NAMES.index(from_stage) if from_stage else 0
+    return STAGES[start:]
+
+def run(from_stage=None, only_stage=None, force=False, full=False, profile_polars=False):
+    """
+    Run the selected stages in order. --from-stage / --only-stage always run the named stage;
+    later stages still skip if their inputs turn out unchanged.
+    """
+    options = argparse.Namespace(full=full)
+    state = load_state()
+    memo = state.setdefault("files", {})
+    results = {}
+    instrumentation.PROFILE_POLARS = instrumentation.PROFILE_POLARS or profile_polars
+    instrumentation.start_run()
+
+    try:
+        for i, stage in enumerate(selected_stages(from_stage, only_stage)):
+            explicit = force or full or (i == 0 and (from_stage or only_stage))
+            fingerprint = stage.fingerprint(memo) if stage.fingerprint else None
+            previous = state.setdefault("stages", {}).get(stage.name, {})
+            if (
+                not explicit
+                and fingerprint is not None
+                and previous.get("fingerprint") == fingerprint
+                and all(os.path.exists(p) for p in stage.outputs)
+            ):
+                print(f"[{stage.name}] inputs unchanged since {previous.get('finished')}, skipping.")
+                instrumentation.skipped(stage.name)
+                continue
+
+            print(f"[{stage.name}] running...")
+            with instrumentation.step(stage.name) as record:
+                results[stage.name] = stage.run(results, options)
+                record.rows_out = instrumentation.rows_of(results[stage.name])
+
+            # The fingerprint describes the inputs this run consumed (taken before the stage ran)
+            state["stages"][stage.name] = {
+                "fingerprint": fingerprint,
+                "finished": datetime.now().isoformat(timespec="seconds"),
+                "seconds": round(record.wall_s, 3),
+            }
+            save_state(state)
+    finally:
+        # Failed runs are reported too; the failing stage is marked "failed"
+        run_report = instrumentation.write_report()
+        print(f"Pipeline finished in {run_report['wall_s']:.1f}s (report: {instrumentation.REPORT_FILE}):")
+        instrumentation.print_steps()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the market breadth pipeline in one process.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="Run the pipeline stages (fetch, process, metrics, publish)")
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--from-stage", choices=STAGE_NAMES, help="Start at this stage (it always runs)")
+    group.add_argument("--only-stage", choices=STAGE_NAMES, help="Run just this stage (it always runs)")
+    p.add_argument("--force", action="store_true", help="Run every selected stage even if its inputs are unchanged")
+    p.add_argument("--full", action="store_true", help="Backfill: re-parse every file and recompute all metrics")
+    p.add_argument("--profile-polars", action="store_true", help=f"Dump lazy query plans to {instrumentation.PROFILE_DIR}")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(from_stage=args.from_stage, only_stage=args.only_stage, force=args.force, full=args.full,
+            profile_polars=args.profile_polars)
@@ -1,95 +1,165 @@
 import polars as pl
 import os
 import glob
-from datetime import datetime
+import json
+import hashlib
+import argparse
+
+import master_store
+import instrumentation
+import validation
+import raw_archive
+from trading_calendar import date_from_filename
 
 DATA_DIR = "data/raw_bhavcopies"
-OUTPUT_FILE = "data/master_bhavcopy.parquet"
+MANIFEST_FILE = "data/ingest_manifest.json"
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+def file_fingerprint(path, previous=None):
+    """
+    Size + content hash of a raw file.
+    If size and mtime match the previous entry the file is trusted unchanged and not re-hashed.
+    """
+    stat = os.stat(path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime:
+        return previous
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": h.hexdigest()}
+
+def raw_files(archive):
+    """
+    Every raw bhavcopy: archived members plus loose CSVs. Manifest entries are keyed by file name,
+    so a file imported into the archive is not parsed again, and the archived copy wins over a leftover loose one.
+    """
+    members = archive.members()
+    archived = {os.path.basename(m) for m in members}
+    loose = [f for f in glob.glob(os.path.join(DATA_DIR, "*.csv")) if os.path.basename(f) not in archived]
+    return sorted(loose) + members
+
+def find_new_files(files, manifest, archive=None):
+    """
+    Split files into those whose (name, size, hash) are already in the manifest and those that need parsing.
+    Returns (changed_files, fingerprints) where fingerprints covers every file.
+    Archive members take their fingerprint from the archive index instead of being read.
+    """
+    changed = []
+    fingerprints = {}
+    for f in files:
+        name = os.path.basename(f)
+        previous = manifest.get(name)
+        fp = archive.fingerprint(f) if raw_archive.is_member(f) else file_fingerprint(f, previous)
+        fingerprints[name] = fp
+        if previous is None or previous.get("size") != fp["size"] or previous.get("sha256") != fp["sha256"]:
+            changed.append(f)
+    return changed, fingerprints
+
+# Files per pl.collect_all call. Each batch is parsed in parallel on the Polars thread pool.
+PARSE_BATCH_SIZE = 64
 
-def process_chunk(files):
+def _num(col):
+    # Handle potential whitespace or dashes in numeric columns
+    return pl.col(col).str.strip_chars().cast(pl.Float64, strict=False)
+
+def latin1_to_utf8(data):
+    """
+    Bhavcopies are latin1 (a few symbols carry a byte outside ASCII); Polars reads UTF-8, so those
+    files are transcoded losslessly. Most files are pure ASCII and pass through untouched.
     """
-    Reads a list of CSV files and returns a combined polars DataFrame.
+    return data if data.isascii() else data.decode("latin1").encode("utf8")
+
+def scan_bhavcopy(f):
     """
-    schema = {
-        "SYMBOL": pl.Utf8, 
-        " SERIES": pl.Utf8, # Note the space in original CSV header usually " SERIES" or "SERIES"
-        " DATE1": pl.Utf8,  # " DATE1"
-        " PREV_CLOSE": pl.Float64,
-        " OPEN_PRICE": pl.Float64,
-        " HIGH_PRICE": pl.Float64,
-        " LOW_PRICE": pl.Float64,
-        " CLOSE_PRICE": pl.Float64,
-        " LAST_PRICE": pl.Float64,
-        " AVG_PRICE": pl.Float64,
-        " TTL_TRD_QNTY": pl.Int64, 
-        " TURNOVER_LACS": pl.Float64,
-        " NO_OF_TRADES": pl.Int64,
-        " DELIV_QTY": pl.Utf8, # Often has failures to parse if not handled, keep as utf8 then cast
-        " DELIV_PER": pl.Utf8
-    }
-
-    # Iterate and read carefully
+    Build the full parse for one bhavcopy (a path or its bytes) as a single lazy plan:
+    header normalisation, EQ/BE filter, date parse and numeric casts.
+    Returns None if the file lacks the critical columns.
+    """
+    if not isinstance(f, (bytes, bytearray)):
+        with open(f, "rb") as fh:
+            f = fh.read()
+    # Everything is read as text (infer_schema_length=0) and cast explicitly below.
+    # Headers usually carry leading spaces (" SERIES", " DATE1"), so strip them on read.
+    lf = pl.scan_csv(
+        latin1_to_utf8(f),
+        ignore_errors=True,
+        infer_schema_length=0,
+        with_column_names=lambda cols: [c.strip() for c in cols],
+    )
+
+    # Check if critical columns exist (only the header is read here)
+    columns = lf.collect_schema().names()
+    if "SERIES" not in columns or "SYMBOL" not in columns:
+        return None
+
+    return (
+        lf
+        # Filter for Equity only (EQ, BE)
+        .filter(pl.col("SERIES").str.strip_chars().is_in(["EQ", "BE"]))
+        .select([
+            pl.col("DATE1").str.strptime(pl.Date, "%d-%b-%Y").alias("Date"),
+            pl.col("SYMBOL").str.strip_chars().alias("Symbol"),
+            pl.col("SERIES").str.strip_chars().alias("Series"),
+            _num("OPEN_PRICE").alias("Open"),
+            _num("HIGH_PRICE").alias("High"),
+            _num("LOW_PRICE").alias("Low"),
+            _num("CLOSE_PRICE").alias("Close"),
+            _num("PREV_CLOSE").alias("PrevClose"),
+            _num("TTL_TRD_QNTY").alias("Volume"),
+            _num("TURNOVER_LACS").alias("Turnover"),
+        ])
+    )
+
+def _plan(f, archive):
+    # Archive members are inflated in memory and parsed from bytes; nothing is extracted to disk
+    source = archive.read(f) if raw_archive.is_member(f) else f
+    return scan_bhavcopy(source)
+
+def process_chunk(files, archive=None):
+    """
+    Reads a list of CSV files (or raw_archive members) and returns a combined polars DataFrame.
+    Files are parsed in parallel batches; a file that fails is reported and skipped.
+    Plans are built batch by batch, so at most one batch of archive members is held in memory.
+    """
+    members = [f for f in files if raw_archive.is_member(f)]
+    if members and archive is None:
+        archive = raw_archive.archive_of(members[0])
+
     dfs = []
-    
-    # We need to inspect one file to be sure of headers, but typically sec_bhavdata_full has:
-    # SYMBOL, SERIES, DATE1, PREV_CLOSE, OPEN_PRICE, HIGH_PRICE, LOW_PRICE, CLOSE_PRICE, LAST_PRICE, AVG_PRICE, TTL_TRD_QNTY, TURNOVER_LACS, NO_OF_TRADES, DELIV_QTY, DELIV_PER
-    # There might be leading spaces in headers.
-        
-    for i, f in enumerate(files):
-        try:
-            # Lazy read is risky with varying headers, so eager read with robust settings
-            # Using latin1 to avoid utf-8 errors
-            df = pl.read_csv(f, ignore_errors=True, infer_schema_length=0, encoding="latin1") 
-            
-            # Normalize headers: strip whitespace
-            df.columns = [c.strip() for c in df.columns]
-            
-            # Check if critical columns exist
-            if "SERIES" not in df.columns or "SYMBOL" not in df.columns:
+    for i in range(0, len(files), PARSE_BATCH_SIZE):
+        batch = []
+        for f in files[i:i + PARSE_BATCH_SIZE]:
+            try:
+                lf = _plan(f, archive)
+            except Exception as e:
+                print(f"Error processing {f}: {e}")
+                continue
+            if lf is None:
                 print(f"Skipping {f}: Missing columns")
                 continue
-
-            # Cleanup String Columns
-            df = df.with_columns([
-                pl.col("SERIES").str.strip_chars(), 
-                pl.col("SYMBOL").str.strip_chars()
-            ])
-
-            # Filter for Equity only (EQ, BE)
-            df = df.filter(pl.col("SERIES").is_in(["EQ", "BE"]))
-            
-            # Parse Date
-            df = df.with_columns(
-                pl.col("DATE1").str.strptime(pl.Date, "%d-%b-%Y").alias("Date")
-            )
-            
-            # Cast numerics
-            cols_to_float = ["OPEN_PRICE", "HIGH_PRICE", "LOW_PRICE", "CLOSE_PRICE", "PREV_CLOSE"]
-            for c in cols_to_float:
-                # Handle potential whitespace or dashes in numeric columns
-                df = df.with_columns(pl.col(c).str.strip_chars().cast(pl.Float64, strict=False))
-                
-            # Select relevant columns 
-            df = df.select([
-                pl.col("Date"),
-                pl.col("SYMBOL").alias("Symbol"),
-                pl.col("SERIES").alias("Series"),
-                pl.col("OPEN_PRICE").alias("Open"),
-                pl.col("HIGH_PRICE").alias("High"),
-                pl.col("LOW_PRICE").alias("Low"),
-                pl.col("CLOSE_PRICE").alias("Close"),
-                pl.col("PREV_CLOSE").alias("PrevClose"),
-                pl.col("TTL_TRD_QNTY").str.strip_chars().cast(pl.Float64, strict=False).alias("Volume"),
-                pl.col("TURNOVER_LACS").str.strip_chars().cast(pl.Float64, strict=False).alias("Turnover")
-            ])
-            
-            # if i % 100 == 0:
-            #     print(f"Processed {i}/{len(files)}: {f} -> {len(df)} rows")
-            
-            dfs.append(df)
-        except Exception as e:
-            print(f"Error processing {f}: {e}")
-            continue
+            batch.append((f, lf))
+        try:
+            dfs.extend(pl.collect_all([lf for _, lf in batch]))
+        except Exception:
+            # One bad file fails the whole batch - redo it file by file to isolate the culprit
+            for f, lf in batch:
+                try:
+                    dfs.append(lf.collect())
+                except Exception as e:
+                    print(f"Error processing {f}: {e}")
 
     if not dfs:
         return None
@@ -97,30 +167,80 @@ def process_chunk(files):
     return pl.concat(dfs)
 
 
-def main():
+def main(full=False):
+    """Returns the newly parsed rows written to the master (None if nothing changed)."""
+    # One-shot upgrade from the old single-file master
+    if os.path.exists(master_store.LEGACY_FILE) and not master_store.exists():
+        master_store.migrate_single_file()
+
     print("Looking for CSV files...")
-    files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
+    archive = raw_archive.RawArchive()
+    files = raw_files(archive)
     print(f"Found {len(files)} files.")
     
     if len(files) == 0:
         print("No files found. Run fetch_data.py first.")
         return
 
-    # Process in chunks to avoid memory explosion if 3 years is huge (though 3 years daily is manageable in RAM usually ~1GB)
+    # Incremental mode: only parse files the manifest hasn't seen (or whose content changed)
+    # and merge them into the partitioned master. --full (or a missing master) rebuilds from scratch.
+    full = full or not master_store.exists()
+    if not full and master_store.stored_is_compact() != master_store.COMPACT:
+        # Partitions must share one schema, so switching COMPACT_SCHEMA rewrites everything
+        print("COMPACT_SCHEMA changed since the master was written. Rebuilding.")
+        full = True
+    manifest = {} if full else load_manifest()
+    with instrumentation.step("fingerprint", rows_in=len(files)) as record:
+        changed, fingerprints = find_new_files(files, manifest, archive)
+        record.rows_out = len(changed)
+
+    # Refresh mtimes of touched-but-identical files so they aren't re-hashed next run
+    for name, fp in fingerprints.items():
+        if name in manifest:
+            manifest[name] = fp
+
+    if not changed:
+        save_manifest(manifest)
+        print("No new or changed files. Master is up to date.")
+        return
+    print(f"{'Full rebuild' if full else 'Incremental update'}: parsing {len(changed)} files...")
+
     # 3 years * 2000 stocks * 250 days = 1.5M rows. Tiny for Polars.
+    with instrumentation.step("parse") as record:
+        df_new = process_chunk(changed, archive)
+        record.rows_out = instrumentation.rows_of(df_new)
     
-    df = process_chunk(files)
-    
-    if df is not None:
-        # Sort
-        df = df.sort(["Date", "Symbol"])
-        
-        # Deduplicate (in case overlapping files downloaded)
-        df = df.unique(subset=["Date", "Symbol", "Series"])
-        
-        print(f"Saving {df.shape[0]} rows to {OUTPUT_FILE}...")
-        df.write_parquet(OUTPUT_FILE)
+    if df_new is not None:
+        parsed_dates = set(df_new["Date"].unique().to_list())
+
+        # Null / inconsistent prices and duplicate keys (overlapping downloads) go to the quarantine file
+        df_new, quarantined = validation.validate(df_new, validation.load_corporate_actions())
+        validation.save_quarantine(quarantined, parsed_dates, replace=full)
+        if master_store.COMPACT:
+            df_new = master_store.to_compact(df_new)
+
+        # Only the year/month partitions touched by the batch are rewritten;
+        # dates it covers (re-downloaded / corrected files) replace what was stored.
+        print(f"Saving {df_new.shape[0]} rows to {master_store.MASTER_DIR}...")
+        with instrumentation.step("write_partitions", rows_in=len(df_new)):
+            written = master_store.write_partitions(df_new, replace=full)
+        print(f"Wrote {len(written)} partition(s).")
+
+        # Only record files that made it into the master; failed parses are retried next run
+        for f in changed:
+            name = os.path.basename(f)
+            if date_from_filename(name) in parsed_dates:
+                manifest[name] = fingerprints[name]
+        save_manifest(manifest)
         print("Done.")
+    return df_new
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Parse raw bhavcopies into the master parquet.")
+    parser.add_argument("--full", action="store_true", help="Re-parse every file instead of only new/changed ones")
+    parser.add_argument("--migrate", action="store_true", help="Only migrate the legacy single-file master into partitions")
+    args = parser.parse_args()
+    if args.migrate:
+        master_store.migrate_single_file()
+    else:
+        main(full=args.full)
@@ -0,0 +1,352 @@
+import os
+import glob
+import json
+import zlib
+import struct
+import hashlib
+import argparse
+import threading
+import zipfile
+import tempfile
+from collections import defaultdict
+
+from trading_calendar import date_from_filename
+
+# Raw bhavcopies are kept in one compressed archive per month instead of one loose CSV per day:
+#   data/raw_archive/2024-05.zip         members sec_bhavdata_full_DDMMYYYY.csv, deflate-compressed
+#   data/raw_archive/2024-05.index.json  member -> local header offset, sizes, CRC-32 and SHA-256
+# The zips are ordinary archives (unzip and zipfile read them). The index lets a reader seek straight
+# to a member and inflate it in memory, and hands process_data the content hash without reading data.
+# A member is addressed like a file inside its zip (data/raw_archive/2024-05.zip/sec_bhavdata_full_10052024.csv),
+# so code keyed on os.path.basename treats loose files and members alike.
+# A streamed file is spooled (memory, then disk past SPOOL_BYTES) before its month is locked, so
+# concurrent downloads only queue for the short zip append; a new date is appended to its month's
+# zip in place, so a day's fetch costs that day's bytes, not the month's.
+ARCHIVE_DIR = "data/raw_archive"
+COMPRESS_LEVEL = 6
+READ_CHUNK_BYTES = 1 << 16
+SPOOL_BYTES = 8 << 20
+
+# Local file header: signature, version, flags, method, time, date, crc, sizes, name and extra lengths
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_SIGNATURE = b"PK\x03\x04"
+# Append journal (2024-05.zip.journal): offset of the old central directory, then its bytes
+_JOURNAL = struct.Struct("<Q")
+
+def is_member(path):
+    return os.path.dirname(path).endswith(".zip")
+
+def month_of(name):
+    day = date_from_filename(name)
+    if day is None:
+        raise ValueError(f"Not a bhavcopy file name: {name}")
+    return f"{day:%Y-%m}"
+
+def archive_of(path):
+    """The RawArchive a member path belongs to."""
+    return RawArchive(os.path.dirname(os.path.dirname(path)))
+
+def file_chunks(path, size=READ_CHUNK_BYTES):
+    """A loose file as byte chunks, for add()."""
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+def _spool(name, data):
+    """bytes as they are; an iterable of chunks read into a spooled temp file, rewound."""
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    for chunk in data:
+        spool.write(chunk)
+    if not spool.tell():
+        spool.close()
+        raise ValueError(f"{name}: no data")
+    spool.seek(0)
+    return spool
+
+def _entry(info, sha256):
+    return {
+        "offset": info.header_offset,
+        "method": info.compress_type,
+        "size": info.file_size,
+        "compressed_size": info.compress_size,
+        "crc32": info.CRC,
+        "sha256": sha256,
+    }
+
+def _write_member(zf, name, data):
+    """Compress one member from bytes or a spooled file. Returns its index entry."""
+    chunks = [data] if isinstance(data, (bytes, bytearray)) else iter(lambda: data.read(READ_CHUNK_BYTES), b"")
+    sha256 = hashlib.sha256()
+    with zf.open(name, "w") as dst:
+        for chunk in chunks:
+            dst.write(chunk)
+            sha256.update(chunk)
+    info = zf.getinfo(name)
+    if info.file_size == 0:
+        raise ValueError(f"{name}: no data")
+    return _entry(info, sha256.hexdigest())
+
+
+class RawArchive:
+    """
+    The monthly archives under root and their indexes. A new date is appended to the month's zip
+    in place after journalling its central directory; a failed or interrupted append is undone from
+    the journal (here, or on the next load). Replacing a stored date rewrites the month to a temp
+    file and swaps it in. An index whose recorded zip size no longer matches is rebuilt from the zip.
+    """
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.month_locks = defaultdict(threading.Lock)   # one writer per month's zip and index
+        self.months = {}   # "2024-05" -> {member name: entry}
+        for journal in sorted(glob.glob(os.path.join(root, "*.zip.journal"))):
+            self._recover(os.path.basename(journal)[:-len(".zip.journal")])
+        for path in sorted(glob.glob(os.path.join(root, "*.zip"))):
+            month = os.path.basename(path)[:-len(".zip")]
+            self.months[month] = self._load_index(month)
+
+    def _zip_path(self, month):
+        return os.path.join(self.root, f"{month}.zip")
+
+    def _index_path(self, month):
+        return os.path.join(self.root, f"{month}.index.json")
+
+    def _load_index(self, month):
+        path = self._index_path(month)
+        if os.path.exists(path):
+            with open(path) as f:
+                index = json.load(f)
+            if index.get("zip_size") == os.path.getsize(self._zip_path(month)):
+                return index["members"]
+        print(f"Rebuilding index of {self._zip_path(month)}...")
+        return self._write_index(month, {})
+
+    def _write_index(self, month, known):
+        """Index every member of a month's zip from its central directory; SHA-256s are reused from known."""
+        members = {}
+        with zipfile.ZipFile(self._zip_path(month)) as zf:
+            for info in zf.infolist():
+                sha256 = known.get(info.filename, {}).get("sha256") or hashlib.sha256(zf.read(info)).hexdigest()
+                members[info.filename] = _entry(info, sha256)
+        return self._save_index(month, members)
+
+    def _save_index(self, month, members):
+        path = self._index_path(month)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"zip_size": os.path.getsize(self._zip_path(month)), "members": members}, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        return members
+
+    def names(self):
+        return sorted(name for members in self.months.values() for name in members)
+
+    def members(self):
+        """Member paths of every archived bhavcopy, ordered by month then name."""
+        return [os.path.join(self._zip_path(month), name) for month in sorted(self.months) for name in sorted(self.months[month])]
+
+    def __contains__(self, name):
+        try:
+            return name in self.months.get(month_of(name), {})
+        except ValueError:
+            return False
+
+    def entry(self, path):
+        name = os.path.basename(path)
+        return self.months.get(month_of(name), {}).get(name)
+
+    def fingerprint(self, path):
+        """Same shape as process_data.file_fingerprint, straight from the index."""
+        entry = self.entry(path)
+        return {"size": entry["size"], "sha256": entry["sha256"]}
+
+    def add(self, name, data):
+        """
+        Store one bhavcopy (bytes or an iterable of byte chunks, e.g. a streamed response), replacing
+        an earlier copy of the same date. Returns its member path.
+        """
+        return self.add_many({name: data})[0]
+
+    def add_many(self, files):
+        """
+        Store {name: bytes or byte chunks}. Chunks are spooled first, without holding a lock; then
+        each month is locked on its own while new dates are appended to its zip (a month with a
+        date already stored is rewritten once). Raises ValueError for an empty file, leaving that
+        month as it was. Returns the member paths.
+        """
+        by_month = defaultdict(dict)
+        for name, data in files.items():
+            by_month[month_of(name)][name] = data
+
+        os.makedirs(self.root, exist_ok=True)
+        added = []
+        for month, items in sorted(by_month.items()):
+            spooled = {}
+            try:
+                for name, data in items.items():
+                    spooled[name] = _spool(name, data)
+                with self.lock:
+                    month_lock = self.month_locks[month]
+                with month_lock:
+                    path = self._zip_path(month)
+                    members = dict(self.months.get(month, {})) if os.path.exists(path) else {}
+                    if members and not set(members) & set(spooled):
+                        members.update(self._append(month, spooled))
+                    else:
+                        members = self._rewrite(month, spooled, members)
+                    self.months[month] = self._save_index(month, members)
+            finally:
+                for data in spooled.values():
+                    if not isinstance(data, (bytes, bytearray)):
+                        data.close()
+            added.extend(os.path.join(path, name) for name in sorted(items))
+        return added
+
+    def _append(self, month, items):
+        """
+        Write new members onto the end of the month's zip. zipfile appends over the old central
+        directory, so that is journalled first and restored if anything fails.
+        """
+        path = self._zip_path(month)
+        journal = path + ".journal"
+        entries = {}
+        try:
+            with zipfile.ZipFile(path, "a", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as zf:
+                with open(path, "rb") as f:
+                    f.seek(zf.start_dir)
+                    tail = f.read()
+                with open(journal + ".tmp", "wb") as f:
+                    f.write(_JOURNAL.pack(zf.start_dir) + tail)
+                os.replace(journal + ".tmp", journal)
+                for name in sorted(items):
+                    entries[name] = _write_member(zf, name, items[name])
+        except BaseException:
+            self._recover(month)
+            raise
+        os.remove(journal)
+        return entries
+
+    def _recover(self, month):
+        """Undo an append: cut the zip back to its old central directory and put that back."""
+        path = self._zip_path(month)
+        journal = path + ".journal"
+        if not os.path.exists(journal):
+            return
+        with open(journal, "rb") as f:
+            (offset,) = _JOURNAL.unpack(f.read(_JOURNAL.size))
+            tail = f.read()
+        print(f"Restoring {path} from {journal}...")
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(tail)
+        os.remove(journal)
+
+    def _rewrite(self, month, items, known):
+        """
+        Write the month's zip afresh to a temp file and swap it in: a new month, or dates replacing
+        stored members (the others are carried over). Returns the month's index entries.
+        """
+        path = self._zip_path(month)
+        tmp_path = path + ".tmp"
+        members = {}
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as dst:
+                if known:
+                    with zipfile.ZipFile(path) as src:
+                        for info in src.infolist():
+                            if info.filename not in items:
+                                data = src.read(info)
+                                dst.writestr(info, data)
+                                sha256 = known.get(info.filename, {}).get("sha256") or hashlib.sha256(data).hexdigest()
+                                members[info.filename] = _entry(dst.getinfo(info.filename), sha256)
+                for name in sorted(items):
+                    members[name] = _write_member(dst, name, items[name])
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        return members
+
+    def read(self, path):
+        """
+        Bytes of one member, inflated in memory: seek to its local header via the index, skip the
+        name and extra field, inflate and check the CRC-32. Nothing is extracted to disk.
+        """
+        entry = self.entry(path)
+        if entry is None:
+            raise FileNotFoundError(path)
+        with open(os.path.dirname(path), "rb") as f:
+            f.seek(entry["offset"])
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            if header[0] != _LOCAL_SIGNATURE:
+                raise ValueError(f"{path}: no local header at offset {entry['offset']}")
+            f.seek(header[9] + header[10], os.SEEK_CUR)
+            raw = f.read(entry["compressed_size"])
+        data = zlib.decompress(raw, -zlib.MAX_WBITS) if entry["method"] == zipfile.ZIP_DEFLATED else raw
+        if zlib.crc32(data) != entry["crc32"]:
+            raise ValueError(f"{path}: CRC-32 mismatch")
+        return data
+
+    def verify(self):
+        """Read every member and compare it with its indexed SHA-256. Returns the member paths that fail."""
+        bad = []
+        for path in self.members():
+            try:
+                ok = hashlib.sha256(self.read(path)).hexdigest() == self.entry(path)["sha256"]
+            except (OSError, ValueError, zlib.error):
+                ok = False
+            if not ok:
+                bad.append(path)
+        return bad
+
+    def stats(self):
+        entries = [e for members in self.months.values() for e in members.values()]
+        stored = sum(os.path.getsize(self._zip_path(m)) for m in self.months)
+        return {"archives": len(self.months), "members": len(entries), "raw_bytes": sum(e["size"] for e in entries), "stored_bytes": stored}
+
+
+def import_files(paths, archive, remove=False):
+    """Move loose bhavcopies into the archive, streamed from disk month by month. Returns the number imported."""
+    by_month = defaultdict(list)
+    for path in paths:
+        if date_from_filename(path) is not None and os.path.getsize(path) > 0:
+            by_month[month_of(os.path.basename(path))].append(path)
+
+    for month, month_paths in sorted(by_month.items()):
+        files = {os.path.basename(path): file_chunks(path) for path in month_paths}
+        archive.add_many(files)
+        if remove:
+            for path in month_paths:
+                os.remove(path)
+        print(f"  {month}: {len(files)} file(s)")
+    return sum(len(p) for p in by_month.values())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly compressed archive of raw bhavcopies.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("import", help="Archive the loose CSVs in data/raw_bhavcopies")
+    p.add_argument("--source", default="data/raw_bhavcopies")
+    p.add_argument("--remove", action="store_true", help="Delete each loose file once its month is archived")
+    sub.add_parser("verify", help="Check every member against its indexed checksum")
+    sub.add_parser("stats", help="Member count and compression")
+    args = parser.parse_args()
+
+    archive = RawArchive()
+    if args.command == "import":
+        paths = sorted(glob.glob(os.path.join(args.source, "*.csv")))
+        print(f"Archiving {len(paths)} files from {args.source} into {ARCHIVE_DIR}...")
+        print(f"Imported {import_files(paths, archive, remove=args.remove)} files.")
+    elif args.command == "verify":
+        bad = archive.verify()
+        for path in bad:
+            print(f"  FAILED {path}")
+        print(f"{len(archive.names()) - len(bad)} of {len(archive.names())} members verified.")
+        raise SystemExit(1 if bad else 0)
+    else:
+        s = archive.stats()
+        ratio = s["raw_bytes"] / s["stored_bytes"] if s["stored_bytes"] else 0
+        print(f"{s['members']} bhavcopies in {s['archives']} archive(s): "
+              f"{s['raw_bytes'] / 1e6:.1f} MB raw, {s['stored_bytes'] / 1e6:.1f} MB stored ({ratio:.1f}x)")
@@ -0,0 +1,209 @@
+import polars as pl
+import numpy as np
+import os
+import argparse
+import threading
+from datetime import date
+
+from instrumentation import profiled
+
+# Per-date distribution of the return and trend measures the breadth thresholds are applied to, so
+# "how many stocks were up 3%+ (or 7%+, or 20% above SMA50)" is answered from stored data instead of
+# re-running the indicators:
+#   data/return_distribution/2024.parquet  one row per date, one List[Float64] column per measure,
+#                                          each list the day's values sorted ascending (nulls dropped)
+# A count is a binary search in the day's sorted list, every date and threshold searched together;
+# the stored values are the same float64 the metrics compare, so a threshold the pipeline uses
+# reproduces its published count exactly.
+DISTRIBUTION_DIR = "data/return_distribution"
+
+MEASURES = {
+    "PctChange1D": pl.col("PctChange1D"),
+    "PctChange5D": pl.col("PctChange5D"),
+    "PctChange20D": pl.col("PctChange20D"),
+    # Distance from the moving average: 0.05 is 5% above it
+    "DistSMA20": pl.col("Close") / pl.col("SMA20") - 1,
+    "DistSMA50": pl.col("Close") / pl.col("SMA50") - 1,
+    "DistSMA100": pl.col("Close") / pl.col("SMA100") - 1,
+    "DistSMA200": pl.col("Close") / pl.col("SMA200") - 1,
+}
+# Which requires which indicator columns, so a frame without some indicators still writes the rest
+REQUIRES = {
+    "DistSMA20": ("Close", "SMA20"),
+    "DistSMA50": ("Close", "SMA50"),
+    "DistSMA100": ("Close", "SMA100"),
+    "DistSMA200": ("Close", "SMA200"),
+}
+OPS = (">=", ">", "<=", "<")
+
+# Published metrics that are a threshold on one measure, for check().
+# "above 20 day SMA" is not here: it counts stocks without an SMA20 as above it (fill_null(0)).
+PUBLISHED = {
+    "No. of stocks up 4.5%+ in the current day": ("PctChange1D", ">=", 0.045),
+    "No. of stocs down 4.5%+ in the current day": ("PctChange1D", "<=", -0.045),
+    "No. of stocks up 20%+ in 5 days": ("PctChange5D", ">=", 0.20),
+    "No. of stocks down 20%+ in 5 days": ("PctChange5D", "<=", -0.20),
+    "No of stocks which are positive": ("PctChange1D", ">", 0),
+    "No of stocks which are negative": ("PctChange1D", "<", 0),
+    "No of stocks above 200 day SMA": ("DistSMA200", ">", 0),
+    "No of stocks above 100 day SMA": ("DistSMA100", ">", 0),
+    "No of stocks above 50 day SMA": ("DistSMA50", ">", 0),
+    "No. of stocks up 10%+ in 20 days": ("PctChange20D", ">=", 0.10),
+}
+
+def _year_path(year, out_dir):
+    return os.path.join(out_dir, f"{year}.parquet")
+
+def _year_files(out_dir):
+    if not os.path.isdir(out_dir):
+        return []
+    return sorted(os.path.join(out_dir, f) for f in os.listdir(out_dir) if f.endswith(".parquet"))
+
+@profiled("return_distribution")
+def update(df_ind, start=None, replace=False, out_dir=DISTRIBUTION_DIR):
+    """
+    Write the sorted distributions for every date >= start in an indicator frame, replacing those
+    dates if already stored. replace=True drops every stored year first (full recompute).
+    Returns the year files written.
+    """
+    df = df_ind if start is None else df_ind.filter(pl.col("Date") >= start)
+    os.makedirs(out_dir, exist_ok=True)
+    if replace:
+        for path in _year_files(out_dir):
+            os.remove(path)
+    if df.is_empty():
+        return []
+
+    measures = [m for m in MEASURES if set(REQUIRES.get(m, (m,))) <= set(df.columns)]
+    # NaN (e.g. 0 / 0 on a zero close) is kept: Polars orders it above every threshold, so the
+    # published counts include it in ">=" / ">" and it has to be here too. It sorts last.
+    index = (
+        df.select(["Date", *[MEASURES[m].alias(m) for m in measures]])
+        .group_by("Date")
+        .agg([pl.col(m).drop_nulls().sort() for m in measures])
+        .sort("Date")
+    )
+
+    written = []
+    for (year,), part in index.group_by(pl.col("Date").dt.year(), maintain_order=True):
+        path = _year_path(year, out_dir)
+        if os.path.exists(path):
+            stored = pl.read_parquet(path).filter(pl.col("Date").is_in(part["Date"].implode()).not_())
+            part = pl.concat([stored, part], how="diagonal_relaxed").sort("Date")
+        part.write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        written.append(path)
+    return written
+
+
+class Distribution:
+    """
+    One measure over every stored date: the sorted lists concatenated into one float64 array,
+    with offsets[i]:offsets[i + 1] the slice of dates[i]. A trailing +inf keeps every search probe,
+    even one at an empty last date, inside the array.
+    """
+    def __init__(self, measure, out_dir=DISTRIBUTION_DIR):
+        if measure not in MEASURES:
+            raise KeyError(f"Unknown measure: {measure} (one of {', '.join(MEASURES)})")
+        files = _year_files(out_dir)
+        if not files:
+            raise FileNotFoundError(f"No return distribution in {out_dir}. Run the metrics first.")
+        df = pl.concat([pl.read_parquet(f, columns=["Date", measure]) for f in files], how="diagonal_relaxed")
+        lengths = df[measure].list.len().fill_null(0).to_numpy()
+        self.measure = measure
+        self.dates = df["Date"].to_numpy()
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.values = np.append(df[measure].explode().drop_nulls().to_numpy(), np.inf)
+
+    def date_range(self, start=None, end=None):
+        """Index range [lo, hi) of the dates in [start, end], by binary search."""
+        lo = np.searchsorted(self.dates, np.datetime64(start, "D"), side="left") if start else 0
+        hi = np.searchsorted(self.dates, np.datetime64(end, "D"), side="right") if end else len(self.dates)
+        return lo, max(hi, lo)
+
+    def count(self, thresholds, op=">=", start=None, end=None):
+        """
+        Number of stocks whose value is `op` each threshold, per date in [start, end].
+        Returns (dates, counts) with counts shaped (dates, thresholds). Every (date, threshold) pair
+        is a binary search within that date's slice; all pairs take each halving step together.
+        """
+        if op not in OPS:
+            raise ValueError(f"op must be one of {OPS}, got {op!r}")
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        lo, hi = self.date_range(start, end)
+        starts, ends = self.offsets[lo:hi, None], self.offsets[lo + 1:hi + 1, None]
+        # x >= t and x < t split at the first value >= t; x > t and x <= t at the first value > t.
+        # Both comparisons are False for NaN, so the trailing NaNs land above every threshold, as in Polars.
+        before = np.less if op in (">=", "<") else np.less_equal
+        # Branch-free lower bound: base moves past half of the remaining size when the value there
+        # is before the threshold. The remaining size depends only on the date, not the threshold.
+        base = np.repeat(starts, len(thresholds), axis=1)
+        size = ends - starts
+        while (size > 1).any():
+            half = size // 2
+            base += half * before(self.values[base + half], thresholds)
+            size -= half
+        # A date with no values has nothing left to compare
+        base += (size > 0) & before(self.values[base], thresholds)
+        if op in (">=", ">"):
+            return self.dates[lo:hi], ends - base
+        return self.dates[lo:hi], base - starts
+
+_LOADED = {}
+_LOCK = threading.Lock()
+
+def version(out_dir=DISTRIBUTION_DIR):
+    """Data version of the stored distributions: every year file with its mtime."""
+    return tuple((f, os.stat(f).st_mtime_ns) for f in _year_files(out_dir))
+
+def load(measure, out_dir=DISTRIBUTION_DIR):
+    """Cached Distribution, reloaded when a year file changes (so a long-running service stays current)."""
+    current = version(out_dir)
+    with _LOCK:
+        cached = _LOADED.get((out_dir, measure))
+        if cached is None or cached[0] != current:
+            cached = _LOADED[(out_dir, measure)] = (current, Distribution(measure, out_dir))
+        return cached[1]
+
+def counts(measure, thresholds, op=">=", start=None, end=None, out_dir=DISTRIBUTION_DIR):
+    """
+    Threshold sweep as a frame: Date plus one count column per threshold, named like ">=0.03".
+    counts("PctChange1D", [0.03, 0.05, 0.07]) is three "up x%+ in the current day" series at once.
+    """
+    dates, result = load(measure, out_dir).count(thresholds, op, start, end)
+    columns = {"Date": pl.Series(dates).cast(pl.Date)}
+    for j, t in enumerate(thresholds):
+        columns[f"{op}{t:g}"] = pl.Series(result[:, j], dtype=pl.UInt32)
+    return pl.DataFrame(columns)
+
+def check(df_agg, out_dir=DISTRIBUTION_DIR):
+    """The published threshold metrics recomputed from the distributions. Returns True if all agree."""
+    ok = True
+    for name, (measure, op, threshold) in PUBLISHED.items():
+        if name not in df_agg.columns:
+            continue
+        found = counts(measure, [threshold], op, out_dir=out_dir)
+        joined = found.join(df_agg.select(["Date", name]), on="Date")
+        mismatches = joined.filter(pl.col(f"{op}{threshold:g}") != pl.col(name)).height
+        ok &= mismatches == 0 and len(joined) == len(df_agg)
+        print(f"  {name:<45} {'OK' if mismatches == 0 else f'{mismatches} dates differ'}")
+    print("Distributions match the published counts." if ok else "Distributions DIFFER from the published counts.")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Breadth counts for arbitrary thresholds from the stored return distributions.")
+    parser.add_argument("measure", nargs="?", choices=list(MEASURES))
+    parser.add_argument("thresholds", nargs="*", type=float, help="e.g. 0.03 0.05 0.07 (fractions, 0.03 = 3%%)")
+    parser.add_argument("--op", choices=OPS, default=">=")
+    parser.add_argument("--start", type=date.fromisoformat, help="YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, help="YYYY-MM-DD")
+    parser.add_argument("--check", action="store_true", help="Recompute the published threshold metrics and compare")
+    args = parser.parse_args()
+
+    if args.check:
+        from calculate_metrics import OUTPUT_FILE
+        raise SystemExit(0 if check(pl.read_parquet(OUTPUT_FILE)) else 1)
+    if not args.measure or not args.thresholds:
+        parser.error("measure and at least one threshold are required unless --check is given")
+    with pl.Config(tbl_rows=40, tbl_cols=len(args.thresholds) + 1):
+        print(counts(args.measure, args.thresholds, args.op, args.start, args.end))
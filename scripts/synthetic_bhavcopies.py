@@ -0,0 +1,144 @@
+import polars as pl
+import numpy as np
+import os
+import argparse
+from datetime import date, timedelta
+
+# Synthetic sec_bhavdata_full_DDMMYYYY.csv files for offline benchmarks and tests.
+# The files carry the quirks of the real NSE archive that process_data.py has to cope with:
+#   - ", " separators, so every header and value after the first has a leading space
+#   - latin1 encoding (a few non-equity symbols carry a byte outside ASCII)
+#   - "-" in the delivery columns, and optionally in price fields (--dirty-share)
+#   - non-equity series (BL, GB, N1, SM) mixed in with EQ / BE rows
+# Symbols list after the first day and delist before the last, so the history is ragged like the real one.
+HEADER = [
+    "SYMBOL", "SERIES", "DATE1", "PREV_CLOSE", "OPEN_PRICE", "HIGH_PRICE", "LOW_PRICE", "LAST_PRICE",
+    "CLOSE_PRICE", "AVG_PRICE", "TTL_TRD_QNTY", "TURNOVER_LACS", "NO_OF_TRADES", "DELIV_QTY", "DELIV_PER",
+]
+ENCODING = "latin1"
+TICK_PAISE = 5
+DEFAULT_OUT = "data/bench/raw_bhavcopies"
+# Where fetch_data / process_data look for real bhavcopies; synthetic files must never land there
+LIVE_DIR = "data/raw_bhavcopies"
+
+LATE_LISTING_SHARE = 0.15    # symbols that list after the first day
+DELISTING_SHARE = 0.10       # symbols that stop trading before the last day
+BE_SHARE = 0.05              # symbols trading in the BE (trade-for-trade) series instead of EQ
+NON_EQUITY_SHARE = 0.05      # extra BL / GB / N1 / SM rows per file, as a share of the equity rows
+DELIVERY_DASH_SHARE = 0.02   # equity rows without delivery data ("-")
+HOLIDAYS_PER_YEAR = 14
+
+def trading_days(start, years, rng):
+    """Weekdays from start over `years` years, minus HOLIDAYS_PER_YEAR random weekdays a year."""
+    end = date(start.year + years, start.month, start.day)
+    days = [start + timedelta(days=i) for i in range((end - start).days) if (start + timedelta(days=i)).weekday() < 5]
+    holidays = set(rng.choice(len(days), size=min(HOLIDAYS_PER_YEAR * years, len(days) // 10), replace=False))
+    return [d for i, d in enumerate(days) if i not in holidays]
+
+def _paise_text(col):
+    """Integer paise as a rupee string with two decimals ("1234.05"), exact for any value."""
+    return pl.format("{}.{}", pl.col(col) // 100, (pl.col(col) % 100).cast(pl.Utf8).str.zfill(2))
+
+def _day_lines(day, frame):
+    """CSV body lines for one day; frame holds integer paise prices and the series / quantity columns."""
+    dirty = pl.col("dirty")
+    price = lambda c: pl.when(dirty).then(pl.lit("-")).otherwise(_paise_text(c))
+    no_delivery = pl.col("Series").is_in(["EQ", "BE"]).not_() | pl.col("no_delivery")
+    return frame.select(
+        pl.concat_str(
+            [
+                pl.col("Symbol"), pl.col("Series"), pl.lit(day.strftime("%d-%b-%Y")),
+                _paise_text("PrevClose"), _paise_text("Open"), price("High"), price("Low"), _paise_text("Close"),
+                price("Close"), _paise_text("Close"), pl.col("Volume").cast(pl.Utf8), _paise_text("TurnoverPaise"),
+                pl.col("Trades").cast(pl.Utf8),
+                pl.when(no_delivery).then(pl.lit("-")).otherwise(pl.col("Delivery").cast(pl.Utf8)),
+                pl.when(no_delivery).then(pl.lit("-")).otherwise(_paise_text("DeliveryPct")),
+            ],
+            separator=", ",
+        )
+    ).to_series()
+
+def generate(out_dir, symbols=2000, years=3, start=date(2021, 1, 1), seed=0, dirty_share=0.0):
+    """
+    Write one bhavcopy per synthetic trading day into out_dir. Prices are per-symbol geometric random
+    walks on 5 paise ticks. dirty_share puts "-" in the High / Low / Close fields of that share of
+    equity rows (rows the parser turns into nulls). Returns the paths written.
+    Refuses the live raw data directory, where the files would be ingested as real NSE data.
+    """
+    if os.path.realpath(out_dir) == os.path.realpath(LIVE_DIR):
+        raise ValueError(f"{out_dir} holds the real bhavcopies; write synthetic ones elsewhere")
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    days = trading_days(start, years, rng)
+    n = len(days)
+
+    names = np.array([f"SYN{i:05d}" for i in range(symbols)])
+    series = np.where(rng.random(symbols) < BE_SHARE, "BE", "EQ")
+    listed = np.where(rng.random(symbols) < LATE_LISTING_SHARE, rng.integers(1, n, symbols), 0)
+    delisted = np.where(rng.random(symbols) < DELISTING_SHARE, rng.integers(listed + 1, n + 1), n)
+    vol = rng.uniform(0.01, 0.04, symbols)
+    liquidity = rng.lognormal(10, 1.5, symbols)
+    close = np.maximum(rng.lognormal(5, 1.2, symbols) * 100, 100)
+
+    written = []
+    for i, day in enumerate(days):
+        prev = close
+        close = np.maximum(np.round(prev * np.exp(rng.normal(0, vol)) / TICK_PAISE) * TICK_PAISE, TICK_PAISE)
+        open_ = np.maximum(np.round(prev * np.exp(rng.normal(0, vol / 3)) / TICK_PAISE) * TICK_PAISE, TICK_PAISE)
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, vol / 2)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, vol / 2)))
+        high, low = np.ceil(high / TICK_PAISE) * TICK_PAISE, np.maximum(np.floor(low / TICK_PAISE) * TICK_PAISE, TICK_PAISE)
+        volume = np.maximum(rng.poisson(liquidity), 1)
+
+        active = np.flatnonzero((listed <= i) & (i < delisted))
+        frame = pl.DataFrame({
+            "Symbol": names[active],
+            "Series": series[active],
+            "PrevClose": prev[active].astype(np.int64),
+            "Open": open_[active].astype(np.int64),
+            "High": high[active].astype(np.int64),
+            "Low": low[active].astype(np.int64),
+            "Close": close[active].astype(np.int64),
+            "Volume": volume[active],
+        })
+
+        # Non-equity rows for a random subset of listed symbols; the parser must filter them out
+        extra = np.sort(rng.choice(active, size=int(len(active) * NON_EQUITY_SHARE), replace=False))
+        extra_series = rng.choice(["BL", "GB", "N1", "SM"], size=len(extra))
+        extra_names = np.where(extra_series == "GB", np.char.add("SGBÉ", names[extra]), names[extra])
+        frame = pl.concat([
+            frame,
+            frame.filter(pl.col("Symbol").is_in(names[extra].tolist()))
+            .with_columns(pl.Series("Series", extra_series), pl.Series("Symbol", extra_names)),
+        ])
+
+        rows = len(frame)
+        frame = frame.with_columns(
+            (pl.col("Close") * pl.col("Volume") // 100_000).alias("TurnoverPaise"),
+            (pl.col("Volume") // 20 + 1).alias("Trades"),
+            (pl.col("Volume") * 6 // 10).alias("Delivery"),
+            pl.lit(6000).alias("DeliveryPct"),
+            pl.Series("no_delivery", rng.random(rows) < DELIVERY_DASH_SHARE),
+            pl.Series("dirty", (rng.random(rows) < dirty_share) & (np.arange(rows) < len(active))),
+        ).sample(fraction=1.0, shuffle=True, seed=seed + i)
+
+        path = os.path.join(out_dir, f"sec_bhavdata_full_{day.strftime('%d%m%Y')}.csv")
+        with open(path, "w", encoding=ENCODING, newline="") as f:
+            f.write(", ".join(HEADER) + "\n")
+            f.write("\n".join(_day_lines(day, frame).to_list()) + "\n")
+        written.append(path)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic NSE bhavcopies for offline benchmarks.")
+    parser.add_argument("--out", default=DEFAULT_OUT, help=f"Output directory (default: {DEFAULT_OUT}; never {LIVE_DIR})")
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2021, 1, 1), help="First calendar day (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dirty-share", type=float, default=0.0, help="Share of equity rows with '-' in a price field")
+    args = parser.parse_args()
+    if os.path.realpath(args.out) == os.path.realpath(LIVE_DIR):
+        parser.error(f"--out {args.out} is the real raw data directory")
+    files = generate(args.out, args.symbols, args.years, args.start, args.seed, args.dirty_share)
+    print(f"Wrote {len(files)} bhavcopies for {args.symbols} symbols to {args.out}.")
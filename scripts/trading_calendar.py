@@ -0,0 +1,135 @@
+import json
+import os
+import argparse
+import re
+import threading
+from datetime import date, datetime
+
+CALENDAR_FILE = "data/trading_calendar.json"
+# A 404 only becomes a holiday once a later day's run sees it again and the date is at least this old;
+# until then the date stays unknown and is probed again (late publication, transient errors)
+HOLIDAY_GRACE_DAYS = 3
+FILENAME_PATTERN = re.compile(r"sec_bhavdata_full_(\d{8})\.csv$")
+
+
+def _as_date(d):
+    return d.date() if isinstance(d, datetime) else d
+
+
+def date_from_filename(filename):
+    """Extract the trading date from a sec_bhavdata_full_DDMMYYYY.csv name (None if it doesn't match)."""
+    m = FILENAME_PATTERN.search(os.path.basename(filename))
+    if not m:
+        return None
+    return datetime.strptime(m.group(1), "%d%m%Y").date()
+
+
+class TradingCalendar:
+    """
+    Persisted index of NSE trading days, learned from the bhavcopies we hold and the 404s we have seen.
+
+    - trading_days: a bhavcopy exists for the date
+    - holidays: NSE answered 404 for the date on two different days, the later one past the grace period
+    - pending_holidays: dates with a single 404 so far -> the day it was seen (still probed)
+    - special_sessions: trading days that fall on a weekend (Budget Day, Muhurat trading, ...)
+    Anything else is unknown and still worth probing.
+    """
+    def __init__(self, path=CALENDAR_FILE):
+        self.path = path
+        self.trading_days = set()
+        self.holidays = set()
+        self.pending_holidays = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                raw = json.load(f)
+            self.trading_days = {date.fromisoformat(d) for d in raw.get("trading_days", [])}
+            self.holidays = {date.fromisoformat(d) for d in raw.get("holidays", [])}
+            self.pending_holidays = {date.fromisoformat(d): date.fromisoformat(seen) for d, seen in raw.get("pending_holidays", {}).items()}
+
+    @property
+    def special_sessions(self):
+        return {d for d in self.trading_days if d.weekday() >= 5}
+
+    def status(self, d):
+        d = _as_date(d)
+        if d in self.trading_days:
+            return "trading"
+        if d in self.holidays:
+            return "holiday"
+        return "unknown"
+
+    def record_trading_day(self, d):
+        d = _as_date(d)
+        with self.lock:
+            self.trading_days.add(d)
+            self.holidays.discard(d)
+            self.pending_holidays.pop(d, None)
+
+    def record_holiday(self, d, today=None):
+        """
+        Record a 404 for d. The first one only marks it pending; it is confirmed as a holiday when
+        a 404 comes again on a later day and d is at least HOLIDAY_GRACE_DAYS old by then.
+        Returns True if d is now a confirmed holiday.
+        """
+        d = _as_date(d)
+        today = today or date.today()
+        # Today's file may simply not be published yet, so a 404 only counts for past dates
+        if d >= today:
+            return False
+        with self.lock:
+            if d in self.trading_days:
+                return False
+            first_seen = self.pending_holidays.setdefault(d, today)
+            if first_seen < today and (today - d).days >= HOLIDAY_GRACE_DAYS:
+                del self.pending_holidays[d]
+                self.holidays.add(d)
+            return d in self.holidays
+
+    def clear(self, d):
+        """Forget everything recorded for d (e.g. a holiday NSE later published a file for)."""
+        d = _as_date(d)
+        with self.lock:
+            self.holidays.discard(d)
+            self.pending_holidays.pop(d, None)
+
+    def sync_with_files(self, data_dir):
+        """Mark every date we already hold a non-empty bhavcopy for as a trading day."""
+        for name in os.listdir(data_dir):
+            d = date_from_filename(name)
+            if d is not None and os.path.getsize(os.path.join(data_dir, name)) > 0:
+                self.record_trading_day(d)
+
+    def trading_days_between(self, start, end):
+        """Sorted confirmed trading days in [start, end], e.g. for aligning rolling windows."""
+        start, end = _as_date(start), _as_date(end)
+        return sorted(d for d in self.trading_days if start <= d <= end)
+
+    def save(self):
+        with self.lock:
+            payload = {
+                "trading_days": sorted(d.isoformat() for d in self.trading_days),
+                "holidays": sorted(d.isoformat() for d in self.holidays),
+                "pending_holidays": {d.isoformat(): seen.isoformat() for d, seen in sorted(self.pending_holidays.items())},
+                "special_sessions": sorted(d.isoformat() for d in self.special_sessions),
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or correct the persisted trading calendar.")
+    parser.add_argument("--clear", nargs="+", type=date.fromisoformat, metavar="YYYY-MM-DD",
+                        help="Forget holiday / pending entries so the fetcher probes these dates again")
+    args = parser.parse_args()
+
+    calendar = TradingCalendar()
+    if args.clear:
+        for d in args.clear:
+            calendar.clear(d)
+        calendar.save()
+        print(f"Cleared {len(args.clear)} date(s).")
+    print(f"{len(calendar.trading_days)} trading days, {len(calendar.holidays)} holidays, "
+          f"{len(calendar.pending_holidays)} pending: {', '.join(d.isoformat() for d in sorted(calendar.pending_holidays)) or '-'}")
@@ -0,0 +1,90 @@
+import polars as pl
+import os
+from datetime import datetime
+
+from instrumentation import profiled
+
+# Data-quality checks on every ingested batch, before it reaches the master.
+# The parse reads with ignore_errors / strict=False casts, so a malformed field becomes a null
+# instead of failing the file; these rules catch such rows before they reach the rolling windows.
+# Failing rows are written to QUARANTINE_FILE with the rules they broke. Rules marked drop remove
+# the row from the batch; the others only flag it for review and the row is kept.
+QUARANTINE_FILE = "data/quarantine.parquet"
+# Optional CSV of Date,Symbol pairs with a known corporate action (split, bonus, demerger...);
+# their price jumps are expected and not flagged
+CORPORATE_ACTIONS_FILE = "data/corporate_actions.csv"
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close"]
+KEY = ["Date", "Symbol", "Series"]
+# NSE price bands are at most 20%; a larger close-to-close move needs an explanation
+JUMP_LIMIT = 0.35
+
+def rules(has_actions=False):
+    """Rule name -> (expression true for an offending row, drop the row?)."""
+    close, low, high = pl.col("Close"), pl.col("Low"), pl.col("High")
+    jump = (close / pl.col("PrevClose") - 1).abs() > JUMP_LIMIT
+    if has_actions:
+        jump = jump & pl.col("_action").is_null()
+    return {
+        "null_price": (pl.any_horizontal([pl.col(c).is_null() for c in PRICE_COLUMNS]), True),
+        "high_below_low": (high < low, True),
+        "close_outside_range": ((close < low) | (close > high), True),
+        # The first row of a key is kept; repeats (overlapping downloads) are dropped
+        "duplicate_key": (pl.struct(KEY).is_first_distinct().not_(), True),
+        "price_jump": (jump, False),
+    }
+
+def load_corporate_actions(path=CORPORATE_ACTIONS_FILE):
+    if not os.path.exists(path):
+        return None
+    actions = pl.read_csv(path, columns=["Date", "Symbol"], schema_overrides={"Date": pl.Utf8, "Symbol": pl.Utf8})
+    return actions.select(
+        pl.col("Date").str.strip_chars().str.to_date(),
+        pl.col("Symbol").str.strip_chars(),
+        pl.lit(True).alias("_action"),
+    ).unique(subset=["Date", "Symbol"])
+
+@profiled("validate")
+def validate(df, actions=None):
+    """
+    Split a parsed batch into (rows to store, quarantined rows). Every rule is one vectorised
+    expression evaluated in a single pass; quarantined rows carry a comma-separated Reason and
+    whether they were dropped or only flagged.
+    """
+    checks = rules(has_actions=actions is not None)
+    if actions is not None:
+        df = df.join(actions, on=["Date", "Symbol"], how="left", maintain_order="left")
+
+    flagged = df.with_columns([expr.fill_null(False).alias(f"_{name}") for name, (expr, _) in checks.items()])
+    drop = pl.any_horizontal([pl.col(f"_{name}") for name, (_, dropped) in checks.items() if dropped])
+    any_rule = pl.any_horizontal([pl.col(f"_{name}") for name in checks])
+    flag_columns = [f"_{name}" for name in checks] + (["_action"] if actions is not None else [])
+
+    quarantined = flagged.filter(any_rule).with_columns(
+        pl.concat_str([pl.when(pl.col(f"_{name}")).then(pl.lit(name)) for name in checks], separator=",", ignore_nulls=True).alias("Reason"),
+        pl.when(drop).then(pl.lit("dropped")).otherwise(pl.lit("flagged")).alias("Action"),
+    )
+    counts = quarantined.select([pl.col(f"_{name}").sum().alias(name) for name in checks]).row(0, named=True)
+    quarantined = quarantined.drop(flag_columns)
+    clean = flagged.filter(drop.not_()).drop(flag_columns)
+
+    if len(quarantined):
+        summary = ", ".join(f"{name} {n}" for name, n in counts.items() if n)
+        print(f"Validation: {len(df) - len(clean)} rows dropped, {len(quarantined)} quarantined ({summary}).")
+    return clean, quarantined
+
+def save_quarantine(quarantined, batch_dates, replace=False, path=QUARANTINE_FILE):
+    """
+    Record a batch's quarantined rows. Rows stored for any date in the batch are replaced, so a
+    corrected re-download clears its old entries; replace=True starts the file over.
+    """
+    dates = pl.Series(list(batch_dates), dtype=pl.Date).implode()
+    quarantined = quarantined.with_columns(pl.lit(datetime.now().replace(microsecond=0)).alias("Ingested"))
+    if not replace and os.path.exists(path):
+        existing = pl.read_parquet(path).filter(pl.col("Date").is_in(dates).not_())
+        quarantined = pl.concat([existing, quarantined], how="diagonal_relaxed")
+    if quarantined.is_empty() and not os.path.exists(path):
+        return
+    tmp_path = path + ".tmp"
+    quarantined.sort(["Date", "Symbol"]).write_parquet(tmp_path)
+    os.replace(tmp_path, path)
@@ -1,7 +1,10 @@
 import { MarketData } from "@/components/Heatmap";
 import { ChartsView } from "@/components/ChartsView";
-import fs from 'fs';
-import path from 'path';
+import { breadthRange, loadPyramid, queryBreadth } from "@/lib/breadth";
+import type { BreadthPyramid } from "@/lib/breadthQuery";
+
+// Browser-reachable query service for the daily rows of a zoomed-in window (else the static shards)
+const PUBLIC_API_URL = process.env.NEXT_PUBLIC_BREADTH_API_URL;
 
 export const metadata = {
     title: 'Market Breadth Charts',
@@ -9,12 +12,21 @@ export const metadata = {
 }
 
 export default async function ChartsPage() {
-    // Load Data (Same logic as main page)
+    // The full range is drawn from the weekly / monthly / LTTB levels; the charts fetch daily rows
+    // only for a window short enough to draw them. An export without the levels ships every row.
     let data: MarketData[] = [];
+    let pyramid: BreadthPyramid | undefined;
+    let range: { start: string; end: string } | undefined;
+    try {
+        pyramid = loadPyramid();
+    } catch (error) {
+        console.error("Failed to load downsampled levels:", error);
+    }
     try {
-        const publicPath = path.join(process.cwd(), 'public', 'market_breadth.json');
-        const fileContents = fs.readFileSync(publicPath, 'utf8');
-        data = JSON.parse(fileContents);
+        range = await breadthRange();
+        if (!pyramid) {
+            data = await queryBreadth();
+        }
     } catch (error) {
         console.error("Failed to load metrics:", error);
         data = [];
@@ -31,7 +43,7 @@ export default async function ChartsPage() {
                 </p>
             </header>
 
-            <ChartsView initialData={data} />
+            <ChartsView initialData={data} pyramid={pyramid} dateRange={range} apiUrl={PUBLIC_API_URL} />
         </main>
     );
 }
@@ -1,25 +1,21 @@
 import { MarketData } from "@/components/Heatmap";
 import { DashboardClient } from "@/components/DashboardClient";
-import fs from 'fs';
-import path from 'path';
+import { breadthRange, queryBreadth } from "@/lib/breadth";
+import { defaultStartDate } from "@/lib/breadthQuery";
+
+// The page ships only the opening range; the dashboard fetches other ranges on demand, from the
+// query service when it is browser-reachable, else from the year shards in public/breadth.
+const PUBLIC_API_URL = process.env.NEXT_PUBLIC_BREADTH_API_URL;
 
 // Server Component (Renders once on build/request)
 export default async function Home() {
   // Load Data
   let data: MarketData[] = [];
+  let range: { start: string; end: string } | undefined;
   try {
-    // In production (Vercel), process.cwd() is the root.
-    // Local: 'web/' is root if running npm run dev from there?
-    // Let's assume standard behavior. 'public' folder data is accessible via URL if client-side, 
-    // but for Server Component usage, we read file system.
-    // Wait, Vercel file system can be tricky.
-    // Best practice: Import it if it's inside src, or read from public.
-    // Since we copied it to public/, let's try reading from there.
-
-    // Robust path finding
-    const publicPath = path.join(process.cwd(), 'public', 'market_breadth.json');
-    const fileContents = fs.readFileSync(publicPath, 'utf8');
-    data = JSON.parse(fileContents);
+    range = await breadthRange();
+    // Only the year shards overlapping the opening range are read
+    data = await queryBreadth({ start: defaultStartDate(range.end), end: range.end });
   } catch (error) {
     console.error("Failed to load metrics:", error);
     // Fallback or empty
@@ -41,7 +37,7 @@ export default async function Home() {
         </p>
       </header>
 
-      <DashboardClient initialData={sortedData} />
+      <DashboardClient initialData={sortedData} apiUrl={PUBLIC_API_URL} dateRange={range} />
     </main>
   );
 }
@@ -5,19 +5,36 @@ import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContai
 import { METRIC_CONFIG, MarketData } from './Heatmap';
 import { ArrowLeft, Calendar, Maximize2, X, ZoomIn, ZoomOut, RotateCcw, ArrowRight } from 'lucide-react';
 import Link from 'next/link';
+import { BreadthPyramid, chartSeries, fetchBreadth, fetchBreadthShards } from '@/lib/breadthQuery';
+
+// Most points a chart draws; longer ranges switch to a downsampled level (weekly, monthly, LTTB)
+const CARD_POINTS = 300;
+const EXPANDED_POINTS = 1000;
+
+// Trading days in [start, end] are at most its weekdays; used to decide if daily rows would fit
+function weekdaysBetween(start: string, end: string): number {
+    const days = (new Date(end).getTime() - new Date(start).getTime()) / (24 * 60 * 60 * 1000) + 1;
+    return Math.ceil(days * 5 / 7);
+}
 
 interface ChartsViewProps {
+    // Daily rows shipped with the page: every row for an export without downsampled levels, else none
     initialData: MarketData[];
+    pyramid?: BreadthPyramid;
+    // Full date range of the data (initialData is empty when the pyramid is given)
+    dateRange?: { start: string; end: string };
+    // Query service for daily rows; without it they are read from the static year shards
+    apiUrl?: string;
 }
 
-export function ChartsView({ initialData }: ChartsViewProps) {
+export function ChartsView({ initialData, pyramid, dateRange, apiUrl }: ChartsViewProps) {
     // 1. Data Prep & Range Calculation (Same as DashboardClient)
     const allSorted = useMemo(() =>
         [...initialData].sort((a, b) => new Date(b.Date).getTime() - new Date(a.Date).getTime()), // Descending for calculations
         [initialData]);
 
-    const maxDate = allSorted[0]?.Date || new Date().toISOString().split('T')[0];
-    const minDate = allSorted[allSorted.length - 1]?.Date || "2022-01-01";
+    const maxDate = dateRange?.end || allSorted[0]?.Date || new Date().toISOString().split('T')[0];
+    const minDate = dateRange?.start || allSorted[allSorted.length - 1]?.Date || "2022-01-01";
 
     // Default to FULL range
     const defaultStart = minDate;
@@ -27,8 +44,25 @@ export function ChartsView({ initialData }: ChartsViewProps) {
     const [endDate, setEndDate] = useState(maxDate);
     const [expandedMetric, setExpandedMetric] = useState<string | null>(null);
 
-    // 3. Filter Data
+    const [rangeStart, rangeEnd] = startDate <= endDate ? [startDate, endDate] : [endDate, startDate];
+
+    // 3. Daily rows. With the pyramid the page ships none: they are fetched once the window is short
+    // enough for the expanded chart to draw them, and kept while later windows fall inside it.
+    const [daily, setDaily] = useState<{ start: string; end: string; rows: MarketData[] } | null>(null);
+    const dailyCovers = daily !== null && daily.start <= rangeStart && daily.end >= rangeEnd;
+    useEffect(() => {
+        if (!pyramid || dailyCovers || weekdaysBetween(rangeStart, rangeEnd) > EXPANDED_POINTS) return;
+        const query = { start: rangeStart, end: rangeEnd };
+        let cancelled = false;
+        (apiUrl ? fetchBreadth(apiUrl, query) : fetchBreadthShards(query))
+            .then((rows) => { if (!cancelled) setDaily({ ...query, rows }); })
+            .catch((error) => console.error("Failed to load daily rows:", error));
+        return () => { cancelled = true; };
+    }, [pyramid, apiUrl, rangeStart, rangeEnd, dailyCovers]);
+
+    // Ascending daily rows for the charts (undefined: not loaded, the charts use the pyramid alone)
     const filteredData = useMemo(() => {
+        if (pyramid) return dailyCovers && daily ? daily.rows : undefined;
         const s = new Date(startDate).getTime();
         const e = new Date(endDate).getTime();
         const effectiveStart = Math.min(s, e);
@@ -41,7 +75,7 @@ export function ChartsView({ initialData }: ChartsViewProps) {
                 return t >= effectiveStart && t <= effectiveEnd;
             })
             .sort((a, b) => new Date(a.Date).getTime() - new Date(b.Date).getTime());
-    }, [initialData, startDate, endDate]);
+    }, [initialData, startDate, endDate, pyramid, daily, dailyCovers]);
 
     // 4. Reset Handler
     const handleReset = () => {
@@ -109,6 +143,9 @@ export function ChartsView({ initialData }: ChartsViewProps) {
                         key={metric}
                         metric={metric}
                         data={filteredData}
+                        pyramid={pyramid}
+                        start={rangeStart}
+                        end={rangeEnd}
                         onExpand={() => setExpandedMetric(metric)}
                     />
                 ))}
@@ -130,6 +167,9 @@ export function ChartsView({ initialData }: ChartsViewProps) {
                             <ChartCard
                                 metric={expandedMetric}
                                 data={filteredData}
+                                pyramid={pyramid}
+                                start={rangeStart}
+                                end={rangeEnd}
                                 isExpanded={true}
                             />
                         </div>
@@ -141,26 +181,41 @@ export function ChartsView({ initialData }: ChartsViewProps) {
     );
 }
 
-function ChartCard({ metric, data, onExpand, isExpanded = false }: { metric: string, data: MarketData[], onExpand?: () => void, isExpanded?: boolean }) {
-    const isRatio = metric === "Advance/Decline Ratio";
-    const isNetNewHighs = metric === "Net New Highs";
+interface ChartCardProps {
+    metric: string;
+    data?: MarketData[];
+    pyramid?: BreadthPyramid;
+    start: string;  // YYYY-MM-DD, start <= end
+    end: string;
+    onExpand?: () => void;
+    isExpanded?: boolean;
+}
+
+function ChartCard({ metric, data, pyramid, start, end, onExpand, isExpanded = false }: ChartCardProps) {
     const config = METRIC_CONFIG[metric];
+    const isRatio = config.format === 'float';
+    // Counts are charted as % of TotalTraded; ratios and metrics already in % are kept raw
+    const isCount = config.format === 'int';
+
+    // Daily rows while they fit the chart, else the finest downsampled level that does
+    const { level, rows } = useMemo(
+        () => chartSeries(data, pyramid, metric, start, end, isExpanded ? EXPANDED_POINTS : CARD_POINTS),
+        [data, pyramid, metric, start, end, isExpanded],
+    );
 
     // Process data for this chart
     const chartData = useMemo(() => {
-        return data.map(d => {
+        return rows.map(d => {
             const rawVal = d[metric];
-            // If it's the Ratio, keep raw. 
-            // If it's anything else, convert to % of TotalTraded.
             let val = rawVal;
 
-            if (!isRatio && d.TotalTraded) {
+            if (isCount && d.TotalTraded) {
                 if (typeof rawVal === 'number') {
                     val = (rawVal / d.TotalTraded) * 100;
                 } else {
                     val = 0;
                 }
-            } else if (isRatio && typeof rawVal !== 'number') {
+            } else if (!isCount && typeof rawVal !== 'number') {
                 val = 0;
             }
 
@@ -171,14 +226,14 @@ function ChartCard({ metric, data, onExpand, isExpanded = false }: { metric: str
                 Total: d.TotalTraded
             };
         });
-    }, [data, metric, isRatio]);
+    }, [rows, metric, isCount]);
 
-    const title = isRatio ? metric : `${metric} (%)`;
+    const title = isCount ? `${metric} (%)` : metric;
     const color = config.type === 'bad' ? '#ef4444' : '#22c55e';
 
     // Gradient Offset Logic
     const threshold = isRatio ? 1 : 0;
-    const isDiverging = isNetNewHighs || isRatio;
+    const isDiverging = config.type === 'diverging';
 
     const gradientOffset = useMemo(() => {
         if (!isDiverging || chartData.length === 0) return 0;
@@ -275,6 +330,11 @@ function ChartCard({ metric, data, onExpand, isExpanded = false }: { metric: str
                     <h3 className={`font-medium text-slate-200 truncate pr-4 ${isExpanded ? 'text-xl md:text-2xl' : 'text-sm'}`} title={title}>
                         {title}
                     </h3>
+                    {level !== 'daily' && (
+                        <span className="text-[10px] text-slate-500 uppercase font-bold tracking-wider" title="Downsampled to fit the chart">
+                            {level}
+                        </span>
+                    )}
 
                     {/* Zoom Controls (Visible only when Expanded) */}
                     {isExpanded && (
@@ -1,24 +1,30 @@
 "use client"
 
-import React, { useState, useMemo } from 'react';
+import React, { useState, useMemo, useEffect } from 'react';
 import { MarketData, METRIC_CONFIG } from '@/components/Heatmap';
 import { Heatmap } from './Heatmap';
 import { ArrowUp, ArrowDown, Calendar, Search, Settings, Check, LineChart } from 'lucide-react';
 import Link from 'next/link';
+import { defaultStartDate, fetchBreadth, fetchBreadthShards } from '@/lib/breadthQuery';
 
 interface DashboardClientProps {
+    // The opening range (defaultStartDate up to the last date); other ranges are fetched
     initialData: any[];
+    // Query service URL; without it ranges are read from the static year shards
+    apiUrl?: string;
+    // Full date range of the data, of which initialData is the opening slice
+    dateRange?: { start: string; end: string };
 }
 
-export function DashboardClient({ initialData }: DashboardClientProps) {
+export function DashboardClient({ initialData, apiUrl, dateRange }: DashboardClientProps) {
     // 1. State: Date Range
     const sortedByDate = useMemo(() =>
         [...initialData].sort((a, b) => new Date(b.Date).getTime() - new Date(a.Date).getTime()),
         [initialData]);
 
-    const maxDate = sortedByDate[0]?.Date || new Date().toISOString().split('T')[0];
-    const minDate = sortedByDate[sortedByDate.length - 1]?.Date || "2022-01-01";
-    const defaultStart = new Date(new Date(maxDate).getTime() - 60 * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
+    const maxDate = dateRange?.end || sortedByDate[0]?.Date || new Date().toISOString().split('T')[0];
+    const minDate = dateRange?.start || sortedByDate[sortedByDate.length - 1]?.Date || "2022-01-01";
+    const defaultStart = defaultStartDate(maxDate);
 
     const [startDate, setStartDate] = useState(defaultStart);
     const [endDate, setEndDate] = useState(maxDate);
@@ -42,18 +48,34 @@ export function DashboardClient({ initialData }: DashboardClientProps) {
         );
     };
 
-    // 2. Filter Data
+    // 2. Filter Data. A range inside the opening one is cut from initialData; any other is fetched
+    // (query service, else the year shards overlapping it)
+    const [rangeData, setRangeData] = useState<MarketData[] | null>(null);
+    useEffect(() => {
+        const [start, end] = startDate <= endDate ? [startDate, endDate] : [endDate, startDate];
+        if (dateRange && start >= defaultStart) {
+            setRangeData(null);
+            return;
+        }
+        let cancelled = false;
+        (apiUrl ? fetchBreadth(apiUrl, { start, end }) : fetchBreadthShards({ start, end }))
+            .then((rows) => { if (!cancelled) setRangeData(rows); })
+            .catch((error) => console.error("Failed to load range:", error));
+        return () => { cancelled = true; };
+    }, [apiUrl, dateRange, defaultStart, startDate, endDate]);
+
     const filteredData = useMemo(() => {
+        const source = rangeData ?? initialData;
         const s = new Date(startDate).getTime();
         const e = new Date(endDate).getTime();
         const effectiveStart = Math.min(s, e);
         const effectiveEnd = Math.max(s, e);
 
-        return initialData.filter(d => {
+        return source.filter(d => {
             const t = new Date(d.Date).getTime();
             return t >= effectiveStart && t <= effectiveEnd;
         });
-    }, [initialData, startDate, endDate]);
+    }, [initialData, startDate, endDate, rangeData]);
 
     // 3. Derived KPI Logic (Schema Updated)
     const sortedFiltered = useMemo(() =>
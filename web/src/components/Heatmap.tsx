@@ -3,6 +3,7 @@
 import React, { useMemo, useState } from 'react';
 import { scaleLinear } from 'd3-scale';
 import { cn } from '@/lib/utils';
+import metricConfig from '@/lib/metric_config.json';
 import { ArrowUp, ArrowDown } from 'lucide-react';
 
 export type MarketData = {
@@ -28,19 +29,8 @@ interface HeatmapProps {
     showPercentages?: boolean;
 }
 
-export const METRIC_CONFIG: Record<string, { type: 'good' | 'bad' | 'diverging'; format: 'int' | 'float' | 'pct' }> = {
-    "No. of stocks up 4.5%+ in the current day": { type: 'good', format: 'int' },
-    "No. of stocs down 4.5%+ in the current day": { type: 'bad', format: 'int' },
-    "No. of stocks up 20%+ in 5 days": { type: 'good', format: 'int' },
-    "No. of stocks down 20%+ in 5 days": { type: 'bad', format: 'int' },
-    "No of stocks above 200 day SMA": { type: 'good', format: 'int' },
-    "No of stocks above 50 day SMA": { type: 'good', format: 'int' },
-    "No of stocks above 20 day SMA": { type: 'good', format: 'int' },
-    "No of stocks which are positive": { type: 'good', format: 'int' },
-    "No of stocks which are negative": { type: 'bad', format: 'int' },
-    "Advance/Decline Ratio": { type: 'diverging', format: 'float' },
-    "Net New Highs": { type: 'diverging', format: 'int' },
-};
+// Generated from scripts/metrics_registry.py (python scripts/metrics_registry.py)
+export const METRIC_CONFIG = metricConfig as Record<string, { type: 'good' | 'bad' | 'diverging'; format: 'int' | 'float' | 'pct' }>;
 
 export function Heatmap({ initialData, visibleColumns, showPercentages = false }: HeatmapProps) {
     const columnsToShow = visibleColumns || Object.keys(METRIC_CONFIG);
@@ -0,0 +1,97 @@
+import fs from 'fs';
+import path from 'path';
+import type { MarketData } from '@/components/Heatmap';
+import { BreadthPyramid, BreadthQuery, Manifest, Shard, dateBound, fetchBreadth, fetchBreadthMeta, rowsFromColumnar } from '@/lib/breadthQuery';
+
+// Reader for the year-sharded export written by scripts/export_data.py
+// (public/breadth/manifest.json + one columnar JSON file per year).
+// With BREADTH_API_URL set, queryBreadth / breadthRange ask the local query service
+// (scripts/breadth_service.py) instead of reading the shards.
+
+interface Columns {
+    columns: number[];
+    data: (string | number | null)[][];
+}
+
+interface LttbLevel {
+    level: string;
+    points: number;
+    series: Record<string, Columns>;
+}
+
+const BREADTH_DIR = path.join(process.cwd(), 'public', 'breadth');
+const API_URL = process.env.BREADTH_API_URL;
+
+function readJson<T>(file: string): T {
+    return JSON.parse(fs.readFileSync(path.join(BREADTH_DIR, file), 'utf8'));
+}
+
+// Rows for every shard overlapping [startYear, endYear] (all years by default), oldest first.
+export function loadBreadth({ startYear, endYear }: { startYear?: number; endYear?: number } = {}): MarketData[] {
+    const manifest = readJson<Manifest>('manifest.json');
+    const rows: MarketData[] = [];
+
+    for (const shard of manifest.shards) {
+        if (startYear !== undefined && shard.year < startYear) continue;
+        if (endYear !== undefined && shard.year > endYear) continue;
+
+        const payload = readJson<Shard>(shard.file);
+        rows.push(...rowsFromColumnar({
+            columns: payload.columns.map((id) => manifest.columns[id].name),
+            data: payload.data,
+        }));
+    }
+    return rows;
+}
+
+// Rows in [start, end] with only the requested metrics, oldest first.
+export async function queryBreadth(query: BreadthQuery = {}): Promise<MarketData[]> {
+    if (API_URL) {
+        return fetchBreadth(API_URL, query, { cache: 'no-store' });
+    }
+    if (query.segment && query.segment !== 'ALL') {
+        throw new Error('Segment queries need the query service (BREADTH_API_URL)');
+    }
+    // Only the shards overlapping the range are read, then two binary searches on the sorted dates
+    const rows = loadBreadth({
+        startYear: query.start ? Number(query.start.slice(0, 4)) : undefined,
+        endYear: query.end ? Number(query.end.slice(0, 4)) : undefined,
+    });
+    const slice = rows.slice(
+        query.start ? dateBound(rows, query.start, false) : 0,
+        query.end ? dateBound(rows, query.end, true) : rows.length,
+    );
+    if (!query.metrics) return slice;
+    const keep = ['Date', ...query.metrics];
+    return slice.map((row) => Object.fromEntries(keep.map((k) => [k, row[k]])) as MarketData);
+}
+
+// First and last date available.
+export async function breadthRange(): Promise<{ start: string; end: string }> {
+    if (API_URL) {
+        const meta = await fetchBreadthMeta(API_URL, { cache: 'no-store' });
+        return { start: meta.start, end: meta.end };
+    }
+    const { shards } = readJson<Manifest>('manifest.json');
+    return { start: shards[0].start, end: shards[shards.length - 1].end };
+}
+
+// Weekly / monthly / LTTB levels listed in the manifest (undefined for an export without them).
+export function loadPyramid(): BreadthPyramid | undefined {
+    const manifest = readJson<Manifest>('manifest.json');
+    if (!manifest.levels) return undefined;
+    const named = ({ columns, data }: Columns) => rowsFromColumnar({ columns: columns.map((id) => manifest.columns[id].name), data });
+
+    const pyramid: BreadthPyramid = { aggregates: [], lttb: [] };
+    for (const level of manifest.levels) {
+        if (level.kind === 'aggregate') {
+            pyramid.aggregates.push({ name: level.name, rows: named(readJson<Columns>(level.file)) });
+        } else {
+            const payload = readJson<LttbLevel>(level.file);
+            const series: Record<string, MarketData[]> = {};
+            for (const [metric, part] of Object.entries(payload.series)) series[metric] = named(part);
+            pyramid.lttb.push({ name: level.name, points: payload.points, series });
+        }
+    }
+    return pyramid;
+}
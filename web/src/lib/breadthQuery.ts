@@ -0,0 +1,139 @@
+import type { MarketData } from '@/components/Heatmap';
+
+// Client for the local query service (scripts/breadth_service.py). No Node imports here, so both the
+// server pages (via lib/breadth.ts) and client components can use it.
+
+export interface BreadthQuery {
+    start?: string;      // YYYY-MM-DD, inclusive
+    end?: string;        // YYYY-MM-DD, inclusive
+    metrics?: string[];  // Date is always included; all columns when omitted
+    segment?: string;    // ALL by default
+}
+
+export interface Columnar {
+    columns: string[];
+    data: (string | number | null)[][];
+}
+
+export type ColumnType = 'date' | 'int' | 'float';
+
+// public/breadth/manifest.json as written by scripts/export_data.py
+export interface Manifest {
+    version: number;
+    columns: { name: string; type: ColumnType }[];
+    shards: { year: number; file: string; rows: number; start: string; end: string; sha256: string; arrow?: string }[];
+    levels?: { name: string; kind: 'aggregate' | 'lttb'; file: string; rows: number }[];
+}
+
+// One year shard: column ids into manifest.columns, one array per column
+export interface Shard {
+    year: number;
+    columns: number[];
+    data: (string | number | null)[][];
+}
+
+// The dashboard opens on the last 60 days up to the latest date
+export function defaultStartDate(maxDate: string): string {
+    return new Date(new Date(maxDate).getTime() - 60 * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
+}
+
+export function rowsFromColumnar({ columns, data }: Columnar): MarketData[] {
+    const rows: MarketData[] = [];
+    const length = data.length ? data[0].length : 0;
+    for (let r = 0; r < length; r++) {
+        const row: Record<string, string | number | null> = {};
+        columns.forEach((name, c) => {
+            row[name] = data[c][r];
+        });
+        rows.push(row as MarketData);
+    }
+    return rows;
+}
+
+// First index whose Date is > date (or >= date with inclusive=false); ISO dates sort as strings
+export function dateBound(rows: MarketData[], date: string, inclusive: boolean): number {
+    let lo = 0;
+    let hi = rows.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (rows[mid].Date < date || (inclusive && rows[mid].Date === date)) lo = mid + 1;
+        else hi = mid;
+    }
+    return lo;
+}
+
+// Downsampled levels from scripts/downsample.py: weekly / monthly means of every metric, and per
+// metric the points LTTB keeps at fixed budgets. All rows oldest first.
+export interface BreadthPyramid {
+    aggregates: { name: string; rows: MarketData[] }[];
+    lttb: { name: string; points: number; series: Record<string, MarketData[]> }[];
+}
+
+// Rows to chart for one metric over [start, end]: the level with the most points in the range that
+// still fits maxPoints (the daily rows when they fit), else the one with the fewest.
+// daily is undefined while the daily rows of the range are not loaded; only the levels are used then.
+export function chartSeries(
+    daily: MarketData[] | undefined,
+    pyramid: BreadthPyramid | undefined,
+    metric: string,
+    start: string,
+    end: string,
+    maxPoints: number,
+): { level: string; rows: MarketData[] } {
+    const candidates = [
+        ...(daily ? [{ level: 'daily', rows: daily }] : []),
+        ...(pyramid?.lttb || []).filter((l) => l.series[metric]).map((l) => ({ level: l.name, rows: l.series[metric] })),
+        ...(pyramid?.aggregates || []).map((l) => ({ level: l.name, rows: l.rows })),
+    ].map(({ level, rows }) => ({ level, rows: rows.slice(dateBound(rows, start, false), dateBound(rows, end, true)) }));
+
+    const fitting = candidates.filter((c) => c.rows.length <= maxPoints);
+    if (fitting.length) {
+        return fitting.reduce((best, c) => (c.rows.length > best.rows.length ? c : best));
+    }
+    return candidates.reduce((best, c) => (c.rows.length < best.rows.length ? c : best));
+}
+
+export function breadthQueryString({ start, end, metrics, segment }: BreadthQuery): string {
+    const params = new URLSearchParams();
+    if (start) params.set('start', start);
+    if (end) params.set('end', end);
+    if (segment) params.set('segment', segment);
+    // One metric= per name; URLSearchParams encodes the %, + and / in metric names
+    (metrics || []).forEach((m) => params.append('metric', m));
+    return params.toString();
+}
+
+// Rows for the query, oldest first. The browser revalidates with the ETag, so an unchanged range is a 304.
+export async function fetchBreadth(apiUrl: string, query: BreadthQuery = {}, init?: RequestInit): Promise<MarketData[]> {
+    const res = await fetch(`${apiUrl}/breadth?${breadthQueryString(query)}`, init);
+    if (!res.ok) {
+        throw new Error(`Breadth API ${res.status}: ${await res.text()}`);
+    }
+    return rowsFromColumnar(await res.json());
+}
+
+// Daily rows in [start, end] from the static year shards (public/breadth), for client components
+// without the query service. Only the shards overlapping the range are fetched.
+export async function fetchBreadthShards({ start, end }: BreadthQuery, baseUrl = '/breadth', init?: RequestInit): Promise<MarketData[]> {
+    const getJson = async <T>(file: string): Promise<T> => {
+        const res = await fetch(`${baseUrl}/${file}`, init);
+        if (!res.ok) {
+            throw new Error(`${baseUrl}/${file}: ${res.status}`);
+        }
+        return res.json();
+    };
+    const manifest = await getJson<Manifest>('manifest.json');
+    const shards = manifest.shards.filter((s) => (!start || s.end >= start) && (!end || s.start <= end));
+    const payloads = await Promise.all(shards.map((s) => getJson<Shard>(s.file)));
+    const rows = payloads.flatMap(({ columns, data }) =>
+        rowsFromColumnar({ columns: columns.map((id) => manifest.columns[id].name), data }));
+    return rows.slice(start ? dateBound(rows, start, false) : 0, end ? dateBound(rows, end, true) : rows.length);
+}
+
+export async function fetchBreadthMeta(apiUrl: string, init?: RequestInit): Promise<{ start: string; end: string; rows: number }> {
+    const res = await fetch(`${apiUrl}/meta`, init);
+    if (!res.ok) {
+        throw new Error(`Breadth API ${res.status}: ${await res.text()}`);
+    }
+    return res.json();
+}